@@ -0,0 +1,42 @@
+"""
+Jittered exponential backoff.
+"""
+import random
+
+
+class ExponentialBackoff:
+    """
+    Exponential backoff with full jitter.
+
+    Each consecutive failure doubles the delay ceiling up to `max_delay`;
+    the actual delay is drawn uniformly from [0, ceiling] so many clients
+    recovering from the same outage don't retry in lockstep.
+    """
+
+    def __init__(self, base: float = 1.0, max_delay: float = 60.0):
+        """
+        Args:
+            base: Delay ceiling after the first failure, in seconds
+            max_delay: Upper bound for the delay ceiling, in seconds
+        """
+        self.base = base
+        self.max_delay = max_delay
+        self.failures = 0
+
+    def ceiling(self, attempt: int) -> float:
+        """Delay ceiling for the given (1-based) attempt"""
+        return min(self.max_delay, self.base * (2 ** (attempt - 1)))
+
+    def next_delay(self, minimum: float = 0.0) -> float:
+        """
+        Record a failure and return how long to wait before trying again.
+
+        Args:
+            minimum: Lower bound for the delay (e.g. a server's retry_after)
+        """
+        self.failures += 1
+        return max(minimum, random.uniform(0, self.ceiling(self.failures)))
+
+    def reset(self):
+        """Record a success"""
+        self.failures = 0
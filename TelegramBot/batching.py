@@ -0,0 +1,163 @@
+"""
+Micro-batching of prompts for batch-capable serving endpoints.
+
+Custom pyfunc and completions endpoints accept several inputs per call.
+Prompts submitted within a short window are collected and sent as one
+request, and each caller receives its own item of the response.
+"""
+import asyncio
+import logging
+from typing import List, Optional
+
+import deadline
+from retry import RETRYABLE_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# Supported request layouts
+BATCH_FORMATS = ("completions", "dataframe_records", "inputs")
+
+
+def _item_error(error: Exception) -> bool:
+    # Whether a batch failure may be caused by some of its items: a rejected
+    # payload (non-retryable 4xx) or a response that doesn't match the inputs
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return 400 <= status < 500 and status not in RETRYABLE_STATUSES
+    return isinstance(error, ValueError)
+
+
+class MicroBatcher:
+    """Collects prompts for up to `max_batch` items or `max_wait` seconds"""
+
+    def __init__(
+        self,
+        serving,
+        endpoint: str,
+        payload_format: str = "inputs",
+        max_batch: int = 16,
+        max_wait: float = 0.02,
+        params: Optional[dict] = None,
+        input_column: str = "prompt",
+    ):
+        """
+        Args:
+            serving: The AsyncServingClient to query through
+            endpoint: The serving endpoint name
+            payload_format: One of BATCH_FORMATS
+            max_batch: Maximum prompts per request
+            max_wait: Seconds to wait for a batch to fill
+            params: Extra generation parameters sent with every batch
+            input_column: Column holding the prompt for dataframe_records
+        """
+        if payload_format not in BATCH_FORMATS:
+            raise ValueError(f"Unsupported batch format: {payload_format}")
+        self.serving = serving
+        self.endpoint = endpoint
+        self.payload_format = payload_format
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.params = params or {}
+        self.input_column = input_column
+        self._pending: list = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+
+        self.batches = 0
+        self.items = 0
+        self.fallbacks = 0
+
+    async def submit(self, prompt: str) -> str:
+        """
+        Queue a prompt for the next batch and wait for its answer.
+
+        Args:
+            prompt: The user prompt
+
+        Returns:
+            The model's answer for this prompt
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((prompt, future))
+        if len(self._pending) >= self.max_batch:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        # Callers that gave up while waiting are not sent
+        pending = [item for item in self._pending if not item[1].done()]
+        self._pending = []
+        for start in range(0, len(pending), self.max_batch):
+            # A batch serves several updates; none of their deadlines applies
+            asyncio.create_task(
+                self._run(pending[start:start + self.max_batch]), context=deadline.detached()
+            )
+
+    async def _run(self, batch: list):
+        try:
+            outputs = await self._query([prompt for prompt, _ in batch])
+            if len(outputs) != len(batch):
+                raise ValueError(f"Expected {len(batch)} outputs, got {len(outputs)}")
+        except Exception as e:
+            if len(batch) == 1 or not _item_error(e):
+                # Overload or an unavailable endpoint affects every item alike;
+                # splitting the batch would only multiply the load
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                return
+            # Isolate the failing item(s) by retrying each prompt on its own
+            logger.warning(f"Batch of {len(batch)} failed ({e}), retrying items individually")
+            self.fallbacks += 1
+            await asyncio.gather(*(self._run([item]) for item in batch))
+            return
+
+        self.batches += 1
+        self.items += len(batch)
+        for (_, future), output in zip(batch, outputs):
+            if future.done():
+                continue
+            if isinstance(output, Exception):
+                future.set_exception(output)
+            else:
+                future.set_result(output)
+
+    async def _query(self, prompts: List[str]) -> list:
+        if self.payload_format == "completions":
+            data = await self.serving.query(self.endpoint, {"prompt": prompts, **self.params})
+            choices = sorted(data.get("choices", []), key=lambda c: c.get("index", 0))
+            return [choice.get("text", "") for choice in choices]
+
+        if self.payload_format == "dataframe_records":
+            payload = {"dataframe_records": [{self.input_column: p} for p in prompts]}
+        else:
+            payload = {"inputs": prompts}
+        if self.params:
+            payload["params"] = self.params
+        data = await self.serving.query(self.endpoint, payload)
+        return [self._prediction_text(p) for p in data.get("predictions", [])]
+
+    @staticmethod
+    def _prediction_text(prediction):
+        """Extract the answer from one prediction, or an exception for a failed item"""
+        if isinstance(prediction, dict):
+            if prediction.get("error"):
+                return RuntimeError(str(prediction["error"]))
+            for field in ("output", "text", "response", "content"):
+                if field in prediction:
+                    return str(prediction[field])
+        return str(prediction)
+
+    def stats(self) -> dict:
+        """Batch counters"""
+        return {
+            "batches": self.batches,
+            "items": self.items,
+            "avg_batch_size": self.items / self.batches if self.batches else 0.0,
+            "fallbacks": self.fallbacks,
+        }
@@ -0,0 +1,63 @@
+"""
+Configuration for hosting several bots in one process.
+
+BOTS_CONFIG points to a JSON file with one entry per bot:
+
+    [
+        {"name": "support", "token_env": "SUPPORT_BOT_TOKEN", "endpoint": "support-llm"},
+        {"name": "sales", "token_env": "SALES_BOT_TOKEN"}
+    ]
+
+`token_env` names the environment variable (e.g. an App secret) holding the
+bot token; `token` may be given directly instead. `endpoint` defaults to
+DATABRICKS_SERVING_ENDPOINT. Names appear in webhook routes and state
+file names, so they are limited to letters, digits, "-" and "_".
+"""
+import json
+import os
+import re
+from typing import List
+
+NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]+$")
+
+
+def load_bot_configs(path: str) -> List[dict]:
+    """
+    Read and validate a bot configuration file.
+
+    Args:
+        path: JSON file with a list of bot entries
+
+    Returns:
+        One dict per bot with "name", "token" and "endpoint" (possibly None)
+
+    Raises:
+        ValueError: If an entry is invalid or a name is repeated
+    """
+    with open(path) as f:
+        entries = json.load(f)
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"{path} must contain a non-empty list of bots")
+
+    bots = []
+    names = set()
+    for entry in entries:
+        name = entry.get("name", "")
+        if not NAME_PATTERN.match(name):
+            raise ValueError(f"Invalid bot name {name!r} in {path}")
+        if name in names:
+            raise ValueError(f"Duplicate bot name {name!r} in {path}")
+        names.add(name)
+        token = entry.get("token") or os.getenv(entry.get("token_env", ""))
+        if not token:
+            raise ValueError(f"No token for bot {name!r} in {path}")
+        bots.append({"name": name, "token": token, "endpoint": entry.get("endpoint")})
+    return bots
+
+
+def bot_path(path: str, name: str) -> str:
+    """Per-bot variant of a state file path, e.g. conversations.db -> conversations.support.db"""
+    if not path or not name:
+        return path
+    root, ext = os.path.splitext(path)
+    return f"{root}.{name}{ext}"
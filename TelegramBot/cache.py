@@ -0,0 +1,193 @@
+"""
+In-memory response cache for serving endpoint answers.
+
+Entries are keyed on the normalized prompt, endpoint, served model version
+and generation parameters, expire after a TTL, and are evicted least
+recently used first once the cache exceeds its byte budget. The same keys
+are used to coalesce concurrent identical requests into a single call.
+"""
+import asyncio
+import contextvars
+import hashlib
+import json
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+# Approximate per-entry bookkeeping overhead (key digest, tuple, dict slot)
+ENTRY_OVERHEAD_BYTES = 200
+
+
+def normalize_prompt(prompt: str) -> str:
+    """NFKC-normalize, case-fold and collapse whitespace"""
+    return " ".join(unicodedata.normalize("NFKC", prompt).casefold().split())
+
+
+def cache_key(prompt: str, endpoint: str, model_version: str = "", params: Optional[dict] = None) -> str:
+    """
+    Build a cache key for a prompt.
+
+    Args:
+        prompt: The user prompt
+        endpoint: The serving endpoint name
+        model_version: Identifier of the model currently served by the endpoint
+        params: Generation parameters sent with the request
+
+    Returns:
+        A fixed-size hex digest
+    """
+    material = json.dumps(
+        [normalize_prompt(prompt), endpoint, model_version, params or {}],
+        sort_keys=True,
+        ensure_ascii=False,
+    )
+    return hashlib.sha256(material.encode()).hexdigest()
+
+
+class ResponseCache:
+    """Byte-bounded LRU cache with per-entry TTL"""
+
+    def __init__(self, max_bytes: int = 64 * 1024 * 1024, ttl: float = 3600.0):
+        """
+        Args:
+            max_bytes: Approximate upper bound on memory used by entries
+            ttl: Seconds an entry stays valid
+        """
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.bytes = 0
+        # key -> (value, expires_at, size); ordered oldest use first
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[str]:
+        """Return the cached value for `key`, or None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        value, expires_at, size = entry
+        if expires_at <= time.monotonic():
+            self._remove(key)
+            self.expirations += 1
+            self.misses += 1
+            return None
+        self._entries.move_to_end(key)
+        self.hits += 1
+        return value
+
+    def put(self, key: str, value: str):
+        """Store `value` under `key`, evicting LRU entries if over budget"""
+        size = len(key) + len(value.encode()) + ENTRY_OVERHEAD_BYTES
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (value, time.monotonic() + self.ttl, size)
+        self.bytes += size
+        while self.bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.evictions += 1
+
+    def _remove(self, key: str):
+        _, _, size = self._entries.pop(key)
+        self.bytes -= size
+
+    def stats(self) -> dict:
+        """Hit/miss/eviction counters and current size"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "bytes": self.bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+        }
+
+
+class _Flight:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Coalesces concurrent calls that share a key into one execution.
+
+    The first caller for a key starts the call; callers arriving while it
+    is in flight wait for the same result (or exception). A waiter that is
+    cancelled only stops waiting; the shared call is cancelled and forgotten
+    once every waiter has gone away, so later callers start a new one.
+    """
+
+    def __init__(self):
+        self._flights: Dict[str, _Flight] = {}
+        self.calls = 0
+        self.coalesced = 0
+
+    def in_flight(self, key: str) -> bool:
+        return key in self._flights
+
+    async def do(
+        self, key: str, fn: Callable[[], Awaitable], context: Optional[contextvars.Context] = None
+    ):
+        """
+        Run `fn()` unless a call for `key` is already in flight, and return its result.
+
+        Args:
+            key: Coalescing key, e.g. a response cache key
+            fn: Zero-argument coroutine function performing the call
+            context: Context the shared call runs in; defaults to a copy of
+                the first caller's
+        """
+        flight = self._flights.get(key)
+        if flight is not None and flight.task.cancelled():
+            # Abandoned by its waiters; never hand a cancellation to a caller
+            # that was not cancelled itself
+            self._forget(key, flight)
+            flight = None
+        if flight is None:
+            self.calls += 1
+            flight = self._flights[key] = _Flight(asyncio.create_task(fn(), context=context))
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        else:
+            self.coalesced += 1
+
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        except asyncio.CancelledError:
+            if not flight.task.done() and flight.waiters == 1:
+                flight.task.cancel()
+                self._forget(key, flight)
+            raise
+        finally:
+            flight.waiters -= 1
+
+    def _forget(self, key: str, flight: _Flight):
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    def stats(self) -> dict:
+        """Executed vs coalesced call counters"""
+        total = self.calls + self.coalesced
+        return {
+            "in_flight": len(self._flights),
+            "calls": self.calls,
+            "coalesced": self.coalesced,
+            "coalescing_ratio": self.coalesced / total if total else 0.0,
+        }
@@ -0,0 +1,104 @@
+"""
+Chat actions ("typing…") that stay visible during long work.
+
+Telegram shows a chat action for about five seconds, so a single
+sendChatAction before a long generation leaves the user with no sign of
+life for most of it. The keeper refreshes the action on an interval while
+work for the chat is in flight. Concurrent work in the same chat shares
+one refresher, which stops as soon as the last of it finishes.
+
+Only the first action waits for the outbound rate limiter; refreshes are
+skipped while it has no spare capacity, so they never delay replies.
+"""
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from typing import AsyncIterator, Awaitable, Callable, Dict, Hashable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class _Refresher:
+    __slots__ = ("task", "users")
+
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.users = 0
+
+
+class ChatActionKeeper:
+    """Per-chat background refresh of a chat action"""
+
+    def __init__(
+        self,
+        send: Callable[[Hashable, str], Awaitable],
+        available: Optional[Callable[[], bool]] = None,
+        interval: float = 4.5,
+    ):
+        """
+        Args:
+            send: Coroutine function sending an action to a chat
+            available: Whether a refresh may be sent now without waiting;
+                None always sends
+            interval: Seconds between refreshes
+        """
+        self.send = send
+        self.available = available
+        self.interval = interval
+        self._refreshers: Dict[Tuple[Hashable, str], _Refresher] = {}
+
+        self.sent = 0
+        self.skipped = 0
+        self.coalesced = 0
+
+    async def _refresh(self, chat_id: Hashable, action: str):
+        first = True
+        while True:
+            started = time.monotonic()
+            if first or self.available is None or self.available():
+                try:
+                    await self.send(chat_id, action)
+                    self.sent += 1
+                except Exception as e:
+                    logger.warning(f"Failed to refresh {action} in chat {chat_id}: {e}")
+            else:
+                self.skipped += 1
+            first = False
+            await asyncio.sleep(max(0.0, self.interval - (time.monotonic() - started)))
+
+    @asynccontextmanager
+    async def keep(self, chat_id: Hashable, action: str = "typing") -> AsyncIterator[None]:
+        """
+        Show `action` in a chat for as long as the block runs.
+
+        Args:
+            chat_id: The Telegram chat ID
+            action: Chat action, e.g. "typing" or "upload_photo"
+        """
+        key = (chat_id, action)
+        refresher = self._refreshers.get(key)
+        if refresher is None:
+            refresher = self._refreshers[key] = _Refresher(
+                asyncio.create_task(self._refresh(chat_id, action))
+            )
+        else:
+            self.coalesced += 1
+        refresher.users += 1
+        try:
+            yield
+        finally:
+            refresher.users -= 1
+            if refresher.users == 0:
+                refresher.task.cancel()
+                if self._refreshers.get(key) is refresher:
+                    del self._refreshers[key]
+
+    def stats(self) -> dict:
+        """Active refreshers and action counters"""
+        return {
+            "active": len(self._refreshers),
+            "sent": self.sent,
+            "skipped": self.skipped,
+            "coalesced": self.coalesced,
+        }
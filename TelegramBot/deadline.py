@@ -0,0 +1,149 @@
+"""
+End-to-end deadlines for processing updates.
+
+Each update gets a deadline counted from when it was queued. The deadline
+is kept in a context variable, so code on the processing path (serving
+calls, retries, Telegram sends) can look up how much time is left without
+it being passed through every call, and tasks started on the way inherit
+it. When the deadline passes, processing is cancelled and the stage it was
+in is counted. Work shared by several updates, or outliving the one that
+started it, runs in a detached() context so it is not cut short by
+whichever update happened to start it.
+
+Deadlines are configured with a default and overrides by chat type
+("private", "group", "supergroup", "channel") or by command ("/status");
+a command override takes precedence over a chat type override.
+"""
+import time
+from contextvars import Context, ContextVar, copy_context
+from typing import Dict, Optional
+
+# Stage an update is in before processing starts
+QUEUE_STAGE = "queue"
+
+
+class Deadline:
+    """Point in time by which an update must be processed"""
+
+    __slots__ = ("expires_at", "stage")
+
+    def __init__(self, expires_at: float):
+        """
+        Args:
+            expires_at: time.monotonic() value of the deadline
+        """
+        self.expires_at = expires_at
+        # The processing stage currently running, for exceeded counters
+        self.stage = QUEUE_STAGE
+
+    def remaining(self) -> float:
+        """Seconds left, negative once the deadline has passed"""
+        return self.expires_at - time.monotonic()
+
+
+_current: ContextVar[Optional[Deadline]] = ContextVar("deadline", default=None)
+
+
+def current() -> Optional[Deadline]:
+    """The deadline of the update being processed, if any"""
+    return _current.get()
+
+
+def activate(deadline: Optional[Deadline]):
+    """
+    Make `deadline` the current one for this task and tasks it starts.
+
+    Returns:
+        Token for ContextVar.reset
+    """
+    return _current.set(deadline)
+
+
+def reset(token):
+    """Restore the deadline that was current before activate()"""
+    _current.reset(token)
+
+
+def detached() -> Context:
+    """
+    A copy of the current context without a deadline.
+
+    Pass it as `context` to asyncio.create_task for tasks that don't belong
+    to the current update alone.
+    """
+    context = copy_context()
+    context.run(_current.set, None)
+    return context
+
+
+def remaining() -> Optional[float]:
+    """Seconds left for the current update, or None without a deadline"""
+    deadline = _current.get()
+    return deadline.remaining() if deadline is not None else None
+
+
+def enter(stage: str):
+    """Record that the current update has reached `stage`"""
+    deadline = _current.get()
+    if deadline is not None:
+        deadline.stage = stage
+
+
+class DeadlinePolicy:
+    """Per chat type and command deadlines, with exceeded counters per stage"""
+
+    def __init__(self, default: float, overrides: Optional[Dict[str, float]] = None):
+        """
+        Args:
+            default: Seconds allowed per update; 0 means no deadline
+            overrides: Seconds by chat type or command (0 = no deadline)
+        """
+        self.default = default
+        self.overrides = overrides or {}
+        self.updates = 0
+        self.exceeded: Dict[str, int] = {}
+
+    def seconds(self, update: dict) -> Optional[float]:
+        """
+        Time allowed for an update.
+
+        Returns:
+            Seconds, or None if the update has no deadline
+        """
+        message = update.get("message") or {}
+        text = message.get("text") or ""
+        seconds = self.default
+        chat_type = message.get("chat", {}).get("type")
+        if chat_type in self.overrides:
+            seconds = self.overrides[chat_type]
+        if text.startswith("/"):
+            # "/status@SomeBot args" -> "/status"
+            command = text.split()[0].split("@")[0]
+            seconds = self.overrides.get(command, seconds)
+        return seconds if seconds > 0 else None
+
+    def start(self, update: dict, received_at: Optional[float] = None) -> Optional[Deadline]:
+        """
+        Create the deadline for an update.
+
+        Args:
+            update: The update dictionary from Telegram
+            received_at: time.monotonic() when it was queued; defaults to now
+        """
+        seconds = self.seconds(update)
+        if seconds is None:
+            return None
+        self.updates += 1
+        return Deadline((received_at or time.monotonic()) + seconds)
+
+    def record_exceeded(self, deadline: Deadline):
+        """Count an update whose deadline passed, by the stage it was in"""
+        self.exceeded[deadline.stage] = self.exceeded.get(deadline.stage, 0) + 1
+
+    def stats(self) -> dict:
+        """Updates with a deadline and exceeded counts per stage"""
+        return {
+            "updates": self.updates,
+            "exceeded": sum(self.exceeded.values()),
+            "exceeded_by_stage": dict(self.exceeded),
+        }
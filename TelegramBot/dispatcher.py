@@ -0,0 +1,321 @@
+"""
+Concurrent update dispatcher.
+
+Updates for different chats are processed concurrently by a bounded pool of
+workers, while updates within the same chat are processed strictly in the
+order they were received. The dispatcher also acts as the bounded ingestion
+queue between polling and processing. While a handler runs, `queued_at`
+holds the time its update was queued.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, Hashable, Optional
+
+logger = logging.getLogger(__name__)
+
+# time.monotonic() at which the update being handled was submitted
+queued_at: ContextVar[Optional[float]] = ContextVar("queued_at", default=None)
+
+
+def chat_key(update: dict) -> Hashable:
+    """
+    Return the ordering key for an update.
+
+    Updates that carry a chat are ordered per chat; anything else is keyed
+    by its update_id and therefore processed independently.
+    """
+    for field in ("message", "edited_message", "channel_post", "edited_channel_post"):
+        if field in update:
+            return update[field]["chat"]["id"]
+    return ("update", update.get("update_id"))
+
+
+class ChatDispatcher:
+    """Per-chat ordered, cross-chat concurrent dispatcher"""
+
+    def __init__(
+        self,
+        handler: Optional[Callable[[dict], Awaitable[None]]],
+        workers: int = 16,
+        max_pending: int = 0,
+    ):
+        """
+        Args:
+            handler: Coroutine function that processes a single update; may
+                be None if every submit passes its own
+            workers: Maximum number of updates processed concurrently
+            max_pending: Maximum queued plus running updates (0 = unbounded)
+        """
+        self.handler = handler
+        self.workers = workers
+        self.max_pending = max_pending
+        # A chat has a mailbox only while it has pending or running work;
+        # its key is then either in the ready queue or held by a worker.
+        self._mailboxes: Dict[Hashable, deque] = {}
+        self._ready: asyncio.Queue = asyncio.Queue()
+        self._tasks: list = []
+        self._pending = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+
+        # Queue wait time (submit -> processing started) statistics
+        self.dispatched = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+
+    @property
+    def pending(self) -> int:
+        """Number of updates queued or being processed"""
+        return self._pending
+
+    @property
+    def active_chats(self) -> int:
+        """Number of chats with queued or running work"""
+        return len(self._mailboxes)
+
+    @property
+    def full(self) -> bool:
+        """Whether the pending limit has been reached"""
+        return 0 < self.max_pending <= self._pending
+
+    def stats(self) -> dict:
+        """Queue depth and wait time statistics"""
+        return {
+            "pending": self._pending,
+            "active_chats": len(self._mailboxes),
+            "dispatched": self.dispatched,
+            "avg_wait": self.wait_total / self.dispatched if self.dispatched else 0.0,
+            "max_wait": self.wait_max,
+        }
+
+    def start(self):
+        """Start the worker tasks; does nothing if they are already running"""
+        if self._tasks:
+            return
+        self._tasks = [
+            asyncio.create_task(self._worker(i)) for i in range(self.workers)
+        ]
+
+    def submit(
+        self,
+        update: dict,
+        key: Optional[Hashable] = None,
+        handler: Optional[Callable[[dict], Awaitable[None]]] = None,
+        received_at: Optional[float] = None,
+    ):
+        """
+        Queue an update for processing, ignoring the depth limit.
+
+        Args:
+            update: The update dictionary from Telegram
+            key: Ordering key; defaults to the update's chat id
+            handler: Handler for this update instead of the dispatcher's own
+            received_at: time.monotonic() when the update was received, if
+                it was queued elsewhere first; defaults to now
+        """
+        if key is None:
+            key = chat_key(update)
+        self._pending += 1
+        self._idle.clear()
+        if self.full:
+            self._not_full.clear()
+
+        item = (update, received_at or time.monotonic(), handler or self.handler)
+        mailbox = self._mailboxes.get(key)
+        if mailbox is not None:
+            mailbox.append(item)
+            return
+        self._mailboxes[key] = deque([item])
+        self._ready.put_nowait(key)
+
+    def offer(self, update: dict) -> bool:
+        """
+        Queue an update if there is room.
+
+        Returns:
+            False if the queue is full and the update was not accepted
+        """
+        if self.full:
+            return False
+        self.submit(update)
+        return True
+
+    async def put(self, update: dict):
+        """Queue an update, waiting for room if the queue is full"""
+        while self.full:
+            await self._not_full.wait()
+        self.submit(update)
+
+    async def _worker(self, worker_id: int):
+        while True:
+            key = await self._ready.get()
+            mailbox = self._mailboxes[key]
+            update, enqueued_at, handler = mailbox.popleft()
+            waited = time.monotonic() - enqueued_at
+            self.dispatched += 1
+            self.wait_total += waited
+            if waited > self.wait_max:
+                self.wait_max = waited
+            queued_at.set(enqueued_at)
+            try:
+                await handler(update)
+            except asyncio.CancelledError:
+                # Only stop when this worker is being cancelled; a
+                # cancellation leaking out of the handler must not kill it
+                if asyncio.current_task().cancelling():
+                    raise
+                logger.error(f"Worker {worker_id} got a stray cancellation on update for {key}")
+            except Exception as e:
+                logger.error(f"Worker {worker_id} failed on update for {key}: {str(e)}")
+            finally:
+                self._pending -= 1
+                if not self.full:
+                    self._not_full.set()
+                if mailbox:
+                    # Re-queue at the back so busy chats don't starve others
+                    self._ready.put_nowait(key)
+                else:
+                    del self._mailboxes[key]
+                if self._pending == 0:
+                    self._idle.set()
+
+    async def join(self):
+        """Wait until every submitted update has been processed"""
+        await self._idle.wait()
+
+    async def stop(self):
+        """Cancel the worker tasks"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+
+class DispatcherView:
+    """
+    One tenant's share of a ChatDispatcher.
+
+    Several bots can share one pool of workers: each view namespaces its
+    chat keys, runs its own handler and enforces its own pending limit, so
+    a busy bot only applies backpressure to its own ingestion. The shared
+    dispatcher is started and stopped by its owner, not through views.
+    """
+
+    def __init__(
+        self,
+        dispatcher: ChatDispatcher,
+        namespace: Hashable,
+        handler: Callable[[dict], Awaitable[None]],
+        max_pending: int = 0,
+    ):
+        """
+        Args:
+            dispatcher: The shared dispatcher
+            namespace: Prefix that keeps this tenant's chat keys apart
+            handler: Coroutine function that processes a single update
+            max_pending: Maximum queued plus running updates (0 = unbounded)
+        """
+        self.dispatcher = dispatcher
+        self.namespace = namespace
+        self.handler = handler
+        self.max_pending = max_pending
+        self._chats: Dict[Hashable, int] = {}
+        self._pending = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self.dispatched = 0
+
+    @property
+    def pending(self) -> int:
+        """Number of this tenant's updates queued or being processed"""
+        return self._pending
+
+    @property
+    def active_chats(self) -> int:
+        """Number of this tenant's chats with queued or running work"""
+        return len(self._chats)
+
+    @property
+    def full(self) -> bool:
+        """Whether this tenant's pending limit has been reached"""
+        return 0 < self.max_pending <= self._pending
+
+    def stats(self) -> dict:
+        """This tenant's queue depth plus the shared pool's wait statistics"""
+        return {
+            **self.dispatcher.stats(),
+            "pending": self._pending,
+            "active_chats": len(self._chats),
+            "dispatched": self.dispatched,
+            "shared_pending": self.dispatcher.pending,
+        }
+
+    def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def submit(self, update: dict, key: Optional[Hashable] = None):
+        """
+        Queue an update for processing, ignoring the depth limit.
+
+        Args:
+            update: The update dictionary from Telegram
+            key: Ordering key; defaults to the update's chat id
+        """
+        if key is None:
+            key = chat_key(update)
+        self._chats[key] = self._chats.get(key, 0) + 1
+        self._pending += 1
+        self._idle.clear()
+        if self.full:
+            self._not_full.clear()
+        self.dispatcher.submit(
+            update, (self.namespace, key), lambda u: self._run(u, key)
+        )
+
+    async def _run(self, update: dict, key: Hashable):
+        try:
+            await self.handler(update)
+        finally:
+            self.dispatched += 1
+            remaining = self._chats[key] - 1
+            if remaining:
+                self._chats[key] = remaining
+            else:
+                del self._chats[key]
+            self._pending -= 1
+            if not self.full:
+                self._not_full.set()
+            if self._pending == 0:
+                self._idle.set()
+
+    def offer(self, update: dict) -> bool:
+        """
+        Queue an update if there is room.
+
+        Returns:
+            False if the queue is full and the update was not accepted
+        """
+        if self.full:
+            return False
+        self.submit(update)
+        return True
+
+    async def put(self, update: dict):
+        """Queue an update, waiting for room if the queue is full"""
+        while self.full:
+            await self._not_full.wait()
+        self.submit(update)
+
+    async def join(self):
+        """Wait until every submitted update has been processed"""
+        await self._idle.wait()
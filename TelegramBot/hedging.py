@@ -0,0 +1,130 @@
+"""
+Hedged requests for tail-latency control.
+
+If a request is still running after a high percentile of recent latency,
+a duplicate is sent (to a secondary endpoint, or another pool member) and
+whichever answers first wins; the other is cancelled. Hedges are paid for
+from a budget that grows by a fixed fraction per request, so they never
+add more than that fraction of extra load, even during an outage when
+every request is slow.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Awaitable, Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class Hedger:
+    """Issues a backup request when the first one is slower than usual"""
+
+    def __init__(
+        self,
+        percentile: float = 95.0,
+        budget: float = 0.05,
+        min_delay: float = 0.05,
+        window: int = 1000,
+        min_samples: int = 50,
+        burst: float = 10.0,
+    ):
+        """
+        Args:
+            percentile: Recent latency percentile after which to hedge
+            budget: Maximum hedges per request, e.g. 0.05 for 5% extra load
+            min_delay: Never hedge earlier than this many seconds
+            window: Number of recent latencies the percentile is taken over
+            min_samples: Latencies needed before hedging starts
+            burst: Maximum hedges that can be saved up while things are fast
+        """
+        self.percentile = percentile
+        self.budget = budget
+        self.min_delay = min_delay
+        self.min_samples = min_samples
+        self.burst = burst
+        self._latencies: deque = deque(maxlen=window)
+        self._delay: Optional[float] = None
+        self._since_sort = 0
+        self._tokens = 0.0
+
+        self.requests = 0
+        self.hedged = 0
+        self.hedge_wins = 0
+        self.over_budget = 0
+
+    def _record(self, latency: float):
+        self._latencies.append(latency)
+        self._since_sort += 1
+
+    def delay(self) -> Optional[float]:
+        """Seconds after which a request is hedged, or None while warming up"""
+        if len(self._latencies) < self.min_samples:
+            return None
+        # Re-sorting the window on every request is wasteful; the
+        # percentile moves slowly, so refresh it every few samples
+        if self._delay is None or self._since_sort >= 20:
+            ordered = sorted(self._latencies)
+            index = min(len(ordered) - 1, int(len(ordered) * self.percentile / 100.0))
+            self._delay = max(self.min_delay, ordered[index])
+            self._since_sort = 0
+        return self._delay
+
+    async def run(
+        self,
+        primary: Callable[[], Awaitable],
+        secondary: Callable[[], Awaitable],
+    ):
+        """
+        Run `primary()`, hedging with `secondary()` if it is slow.
+
+        Args:
+            primary: Zero-argument coroutine function for the first request
+            secondary: Zero-argument coroutine function for the backup request
+
+        Returns:
+            The result of whichever request succeeded first
+        """
+        self.requests += 1
+        self._tokens = min(self.burst, self._tokens + self.budget)
+        started = time.monotonic()
+        delay = self.delay()
+        first = asyncio.ensure_future(primary())
+        tasks = {first}
+        try:
+            if delay is not None:
+                done, _ = await asyncio.wait(tasks, timeout=delay)
+                if not done:
+                    if self._tokens >= 1.0:
+                        self._tokens -= 1.0
+                        self.hedged += 1
+                        tasks.add(asyncio.ensure_future(secondary()))
+                    else:
+                        self.over_budget += 1
+
+            error: Optional[BaseException] = None
+            while tasks:
+                done, tasks = await asyncio.wait(tasks, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    if task.exception() is None:
+                        if task is not first:
+                            self.hedge_wins += 1
+                        self._record(time.monotonic() - started)
+                        return task.result()
+                    error = error or task.exception()
+            # Every attempt failed; surface the first failure
+            raise error
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def stats(self) -> dict:
+        """Hedge counters and current hedge delay"""
+        return {
+            "requests": self.requests,
+            "hedged": self.hedged,
+            "hedge_wins": self.hedge_wins,
+            "over_budget": self.over_budget,
+            "extra_load": self.hedged / self.requests if self.requests else 0.0,
+            "delay": self._delay,
+        }
@@ -0,0 +1,280 @@
+"""
+Per-chat conversation memory.
+
+Each chat keeps its most recent turns in a fixed-size ring buffer of
+ready-made message dicts, so appending is O(1) and assembling the
+`messages` list for a request copies references, never message text.
+Each message's token count is computed once when it is stored, so history
+can be trimmed to a token budget without re-tokenizing. Chats are kept in
+LRU order and the least recently active ones are evicted once the store
+exceeds its memory budget.
+"""
+import logging
+from collections import OrderedDict
+from typing import Callable, List, Optional, Tuple
+
+from tokens import approximate_tokens
+
+logger = logging.getLogger(__name__)
+
+# Approximate fixed cost of one stored message (dict, keys, ring slot)
+MESSAGE_OVERHEAD_BYTES = 250
+# Approximate fixed cost of one chat (ChatHistory, ring list, LRU entry)
+CHAT_OVERHEAD_BYTES = 300
+
+
+class ChatHistory:
+    """Ring buffer of the most recent messages in one chat"""
+
+    __slots__ = ("_ring", "_tokens", "_start", "_count", "bytes", "summary", "summary_tokens")
+
+    def __init__(self, max_messages: int):
+        self._ring: list = [None] * max_messages
+        self._tokens: list = [0] * max_messages
+        self._start = 0
+        self._count = 0
+        self.bytes = CHAT_OVERHEAD_BYTES
+        # Summary of turns that were compacted out of the ring
+        self.summary = ""
+        self.summary_tokens = 0
+
+    def __len__(self) -> int:
+        return self._count
+
+    def append(self, role: str, content: str, tokens: int = 0) -> int:
+        """
+        Add a message, overwriting the oldest one if the buffer is full.
+
+        Args:
+            role: "user", "assistant" or "system"
+            content: The message text
+            tokens: The message's token count
+
+        Returns:
+            The change in approximate memory use, in bytes
+        """
+        capacity = len(self._ring)
+        size = len(content) + MESSAGE_OVERHEAD_BYTES
+        delta = size
+        if self._count == capacity:
+            slot = self._start
+            delta -= len(self._ring[slot]["content"]) + MESSAGE_OVERHEAD_BYTES
+            self._start = (self._start + 1) % capacity
+        else:
+            slot = (self._start + self._count) % capacity
+            self._count += 1
+        self._ring[slot] = {"role": role, "content": content}
+        self._tokens[slot] = tokens
+        self.bytes += delta
+        return delta
+
+    def window(self, budget: Optional[int] = None) -> Tuple[List[dict], int]:
+        """
+        Messages oldest first; the dicts are shared, not copied.
+
+        Trimming walks back from the newest message using the stored token
+        counts, so it is O(turns) and never re-tokenizes.
+
+        Args:
+            budget: If given, drop the oldest messages until the total token
+                count fits, and never start the history with a reply
+
+        Returns:
+            (the possibly trimmed history, its token count)
+        """
+        capacity = len(self._ring)
+        keep = 0
+        used = 0
+        while keep < self._count:
+            tokens = self._tokens[(self._start + self._count - 1 - keep) % capacity]
+            if budget is not None and used + tokens > budget:
+                break
+            used += tokens
+            keep += 1
+        while keep:
+            slot = (self._start + self._count - keep) % capacity
+            if self._ring[slot]["role"] == "user":
+                break
+            used -= self._tokens[slot]
+            keep -= 1
+        first = (self._start + self._count - keep) % capacity
+        end = first + keep
+        if end <= capacity:
+            return self._ring[first:end], used
+        return self._ring[first:] + self._ring[:end - capacity], used
+
+    def messages(self, budget: Optional[int] = None) -> List[dict]:
+        """Messages oldest first, optionally trimmed to a token budget"""
+        return self.window(budget)[0]
+
+    def compact(self, prefix: List[dict], summary: str, summary_tokens: int) -> int:
+        """
+        Replace summarized messages with a summary.
+
+        Messages may have been appended (and the oldest overwritten) since
+        `prefix` was taken, so only the part of it still at the front of
+        the ring is removed.
+
+        Args:
+            prefix: The oldest messages, as returned by window(), that were summarized
+            summary: Summary text covering `prefix` (and any earlier summary)
+            summary_tokens: Token count of the summary
+
+        Returns:
+            The change in approximate memory use, in bytes
+        """
+        capacity = len(self._ring)
+        current = [self._ring[(self._start + i) % capacity] for i in range(self._count)]
+        tokens = [self._tokens[(self._start + i) % capacity] for i in range(self._count)]
+        removed = 0
+        if current:
+            # Find where the current front sits within the summarized prefix
+            offset = next((i for i, m in enumerate(prefix) if m is current[0]), len(prefix))
+            for message in prefix[offset:]:
+                if removed < len(current) and current[removed] is message:
+                    removed += 1
+                else:
+                    break
+
+        delta = len(summary) - len(self.summary)
+        delta -= sum(len(m["content"]) + MESSAGE_OVERHEAD_BYTES for m in current[:removed])
+        self._ring = current[removed:] + [None] * (capacity - len(current) + removed)
+        self._tokens = tokens[removed:] + [0] * (capacity - len(current) + removed)
+        self._start = 0
+        self._count = len(current) - removed
+        self.summary = summary
+        self.summary_tokens = summary_tokens
+        self.bytes += delta
+        return delta
+
+
+class ConversationStore:
+    """Conversation histories for all chats under a global memory cap"""
+
+    def __init__(
+        self,
+        max_turns: int = 10,
+        max_bytes: int = 256 * 1024 * 1024,
+        count_tokens: Callable[[str], int] = approximate_tokens,
+    ):
+        """
+        Args:
+            max_turns: User/assistant exchanges kept per chat
+            max_bytes: Approximate memory budget across all chats
+            count_tokens: Function returning the token count of a message
+        """
+        self.count_tokens = count_tokens
+        self.max_messages = 2 * max_turns
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self._chats: "OrderedDict[int, ChatHistory]" = OrderedDict()
+        self.evictions = 0
+
+    def __len__(self) -> int:
+        return len(self._chats)
+
+    def __contains__(self, chat_id: int) -> bool:
+        return chat_id in self._chats
+
+    def load(self, chat_id: int, messages: List[tuple], summary: str = ""):
+        """
+        Populate a chat's history, e.g. from durable storage.
+
+        Args:
+            chat_id: The Telegram chat ID
+            messages: (role, content) tuples, oldest first
+            summary: Summary of earlier, compacted turns
+        """
+        self.clear(chat_id)
+        history = self._chats[chat_id] = ChatHistory(self.max_messages)
+        for role, content in messages[-self.max_messages:]:
+            history.append(role, content, self.count_tokens(content))
+        if summary:
+            history.summary = summary
+            history.summary_tokens = self.count_tokens(summary)
+            history.bytes += len(summary)
+        self.bytes += history.bytes
+        self._evict(keep=chat_id)
+
+    def window(self, chat_id: int, budget: Optional[int] = None) -> Tuple[List[dict], int]:
+        """
+        History of a chat, oldest first, and its token count.
+
+        Args:
+            chat_id: The Telegram chat ID
+            budget: Optional token budget the history is trimmed to
+        """
+        history = self._chats.get(chat_id)
+        if history is None:
+            return [], 0
+        self._chats.move_to_end(chat_id)
+        return history.window(budget)
+
+    def messages(self, chat_id: int, budget: Optional[int] = None) -> List[dict]:
+        """History of a chat, oldest first (empty if none)"""
+        return self.window(chat_id, budget)[0]
+
+    def summary(self, chat_id: int) -> Tuple[str, int]:
+        """Summary of a chat's compacted turns and its token count"""
+        history = self._chats.get(chat_id)
+        if history is None:
+            return "", 0
+        return history.summary, history.summary_tokens
+
+    def compact(self, chat_id: int, prefix: List[dict], summary: str) -> int:
+        """
+        Replace a chat's oldest messages with a summary.
+
+        Returns:
+            Number of messages left in the chat's history
+        """
+        history = self._chats.get(chat_id)
+        if history is None:
+            return 0
+        self.bytes += history.compact(prefix, summary, self.count_tokens(summary))
+        return len(history)
+
+    def append(self, chat_id: int, role: str, content: str):
+        """
+        Record a message in a chat's history.
+
+        Args:
+            chat_id: The Telegram chat ID
+            role: "user", "assistant" or "system"
+            content: The message text
+        """
+        history = self._chats.get(chat_id)
+        if history is None:
+            history = self._chats[chat_id] = ChatHistory(self.max_messages)
+            self.bytes += history.bytes
+        else:
+            self._chats.move_to_end(chat_id)
+        self.bytes += history.append(role, content, self.count_tokens(content))
+        self._evict(keep=chat_id)
+
+    def append_turn(self, chat_id: int, user_message: str, reply: str):
+        """Record a user message and the assistant's reply"""
+        self.append(chat_id, "user", user_message)
+        self.append(chat_id, "assistant", reply)
+
+    def clear(self, chat_id: int):
+        """Forget a chat's history"""
+        history = self._chats.pop(chat_id, None)
+        if history is not None:
+            self.bytes -= history.bytes
+
+    def _evict(self, keep: Optional[int] = None):
+        while self.bytes > self.max_bytes and len(self._chats) > 1:
+            chat_id = next(iter(self._chats))
+            if chat_id == keep:
+                break
+            self.bytes -= self._chats.pop(chat_id).bytes
+            self.evictions += 1
+
+    def stats(self) -> dict:
+        """Chat count, memory use and eviction counter"""
+        return {
+            "chats": len(self._chats),
+            "bytes": self.bytes,
+            "evictions": self.evictions,
+        }
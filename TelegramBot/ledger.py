@@ -0,0 +1,205 @@
+"""
+Restart-safe bookkeeping of Telegram updates.
+
+Telegram forgets an update as soon as getUpdates is called with a higher
+offset, so the bot has to remember what it took over before acknowledging
+it. The ledger keeps the acknowledged offset, the updates accepted but not
+yet processed, and a sliding bitmap window of recently processed update
+ids. It is checkpointed to a local file by a background task: changes are
+batched, and a checkpoint is one write plus fsync followed by an atomic rename.
+
+On restart the offset is restored, unprocessed updates are replayed, and
+redelivered updates that were already processed are recognized and skipped.
+"""
+import asyncio
+import base64
+import json
+import logging
+import os
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateLedger:
+    """Durable offset, pending updates and processed-id window"""
+
+    def __init__(self, path: str, window: int = 8192, flush_interval: float = 0.05):
+        """
+        Args:
+            path: Checkpoint file
+            window: Number of most recent update ids tracked as processed
+            flush_interval: Maximum seconds a change waits to be checkpointed
+        """
+        self.path = path
+        self.window = window - window % 8
+        self.flush_interval = flush_interval
+        # Highest update_id acknowledged to Telegram
+        self.offset = 0
+        # Updates handed to processing but not finished, by update_id
+        self.pending: Dict[int, dict] = {}
+        # Bit i is set if update `_base + i` has been processed
+        self._base = 0
+        self._bits = bytearray(self.window // 8)
+
+        self._version = 0
+        self._durable = 0
+        self._wake = asyncio.Event()
+        self._flushed = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+
+        self.duplicates = 0
+        self.checkpoints = 0
+
+    def load(self) -> List[dict]:
+        """
+        Restore the last checkpoint, if any.
+
+        Returns:
+            Updates that were accepted but not processed, oldest first
+        """
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError) as e:
+            logger.error(f"Ignoring unreadable update ledger {self.path}: {e}")
+            return []
+        self.offset = state.get("offset", 0)
+        self._base = state.get("base", 0)
+        bits = base64.b64decode(state.get("processed", ""))
+        self._bits[:len(bits)] = bits[:len(self._bits)]
+        self.pending = {update["update_id"]: update for update in state.get("pending", [])}
+        logger.info(
+            f"Update ledger restored: offset {self.offset}, "
+            f"{len(self.pending)} unprocessed updates"
+        )
+        return [self.pending[update_id] for update_id in sorted(self.pending)]
+
+    def _changed(self):
+        self._version += 1
+
+    def _processed(self, update_id: int) -> bool:
+        if update_id < self._base:
+            return True
+        index = update_id - self._base
+        if index >= self.window:
+            return False
+        return bool(self._bits[index >> 3] & (1 << (index & 7)))
+
+    def _mark(self, update_id: int):
+        if update_id < self._base:
+            return
+        index = update_id - self._base
+        if index >= self.window:
+            # Slide the window forward, whole bytes at a time
+            shift = (index - self.window) // 8 + 1
+            if shift >= len(self._bits):
+                self._bits = bytearray(len(self._bits))
+                self._base = update_id - update_id % 8
+            else:
+                self._bits = self._bits[shift:] + bytearray(shift)
+                self._base += shift * 8
+            index = update_id - self._base
+        self._bits[index >> 3] |= 1 << (index & 7)
+
+    def is_duplicate(self, update_id: int) -> bool:
+        """Whether an update is already being processed or was processed before"""
+        if update_id in self.pending or self._processed(update_id):
+            self.duplicates += 1
+            return True
+        return False
+
+    def accept(self, update: dict):
+        """Record an update handed to processing"""
+        self.pending[update["update_id"]] = update
+        self._changed()
+
+    def acknowledge(self, offset: int):
+        """Record that updates up to `offset` may be confirmed to Telegram"""
+        if offset > self.offset:
+            self.offset = offset
+            self._changed()
+
+    def done(self, update_id: int):
+        """Record that an update has been processed"""
+        self.pending.pop(update_id, None)
+        self._mark(update_id)
+        self._changed()
+
+    def _snapshot(self) -> dict:
+        return {
+            "offset": self.offset,
+            "base": self._base,
+            "processed": base64.b64encode(bytes(self._bits)).decode(),
+            "pending": list(self.pending.values()),
+        }
+
+    def _write(self, state: dict):
+        tmp = f"{self.path}.tmp"
+        with open(tmp, "w") as f:
+            json.dump(state, f, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self.path)
+        # Make the rename itself durable
+        directory = os.open(os.path.dirname(os.path.abspath(self.path)), os.O_RDONLY)
+        try:
+            os.fsync(directory)
+        finally:
+            os.close(directory)
+
+    async def flush(self):
+        """Checkpoint the current state if it changed"""
+        if self._durable == self._version:
+            return
+        version = self._version
+        try:
+            await asyncio.to_thread(self._write, self._snapshot())
+            self._durable = version
+            self.checkpoints += 1
+        except OSError as e:
+            logger.error(f"Failed to checkpoint update ledger: {e}")
+            await asyncio.sleep(self.flush_interval)
+        finally:
+            flushed, self._flushed = self._flushed, asyncio.Event()
+            flushed.set()
+
+    async def sync(self):
+        """Wait until every change made so far has been checkpointed"""
+        target = self._version
+        while self._durable < target:
+            self._wake.set()
+            await self._flushed.wait()
+
+    async def _writer(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def start(self):
+        """Start the background checkpoint task"""
+        if self._task is None:
+            self._task = asyncio.create_task(self._writer())
+
+    async def close(self):
+        """Stop the checkpoint task and write a final checkpoint"""
+        if self._task is not None:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+        await self.flush()
+
+    def stats(self) -> dict:
+        """Offset, backlog and checkpoint counters"""
+        return {
+            "offset": self.offset,
+            "pending": len(self.pending),
+            "duplicates": self.duplicates,
+            "checkpoints": self.checkpoints,
+        }
@@ -1,18 +1,55 @@
 """
-Alternative version using POLLING instead of webhooks
-Use this if you can't make the Databricks App publicly accessible
+Telegram bot backed by a Databricks serving endpoint.
 
-This version continuously polls Telegram for new messages instead of
-waiting for webhooks. It can run as a Databricks Job or in the App.
+By default the bot continuously polls Telegram for new messages, which works
+even if the Databricks App isn't publicly accessible. It can run as a
+Databricks Job (`python main.py`) or in the App (`uvicorn main:app`).
+
+With BOT_MODE=webhook the FastAPI app instead registers a webhook and
+receives updates pushed by Telegram, authenticated with the
+X-Telegram-Bot-Api-Secret-Token header. Both modes share the same
+dispatcher and processing pipeline.
+
+With SHARD_WORKERS > 1 this process becomes the leader: it still polls or
+receives webhooks, but routes each update by chat to one of several worker
+processes, which run the processing pipeline in "worker" mode.
+
+With BOTS_CONFIG set, one process hosts several bots (see bots.py).
 """
 import os
+import hmac
+import json
 import logging
 import time
 import asyncio
-from typing import Optional
+from contextlib import asynccontextmanager
+from typing import Dict, List, Optional
 import httpx
 from databricks.sdk import WorkspaceClient
-from databricks.sdk.service.serving import ChatMessage, ChatMessageRole
+from fastapi import FastAPI, Request, HTTPException
+
+from backoff import ExponentialBackoff
+from batching import MicroBatcher
+import deadline
+from bots import bot_path, load_bot_configs
+from cache import ResponseCache, SingleFlight, cache_key
+from chat_actions import ChatActionKeeper
+from deadline import DeadlinePolicy
+from dispatcher import ChatDispatcher, DispatcherView, queued_at
+from hedging import Hedger
+from history import ConversationStore
+from ledger import UpdateLedger
+from overload import CircuitOpenError
+from retry import RETRYABLE_STATUSES, RetryBudget, RetryPolicy, TransientError, parse_retry_after
+from ratelimit import TelegramRateLimiter
+from semantic import EndpointEmbedder, SemanticCache
+from splitting import markdown_rejected, split_message
+from sharding import ShardedDispatcher
+from store import SQLiteConversationLog
+from summarizer import HistorySummarizer
+from tokens import TokenHistogram, get_tokenizer
+from serving import AsyncServingClient
+from streaming import ProgressiveMessage
 
 # Configure logging
 logging.basicConfig(
@@ -23,125 +60,829 @@ logger = logging.getLogger(__name__)
 
 # Environment variables
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+BOT_MODE = os.getenv("BOT_MODE", "polling")  # "polling" or "webhook"
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")  # Public URL of the /webhook route
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")  # Required in webhook mode
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv("WEBHOOK_MAX_CONNECTIONS", "40"))
+# An endpoint name, or a weighted pool such as "llm-a:3,llm-b:1"
 DATABRICKS_SERVING_ENDPOINT = os.getenv("DATABRICKS_SERVING_ENDPOINT")
-POLL_INTERVAL = int(os.getenv("POLL_INTERVAL", "2"))  # seconds
+LONG_POLL_TIMEOUT = int(os.getenv("LONG_POLL_TIMEOUT", "30"))  # seconds
+POLL_BACKOFF_BASE = float(os.getenv("POLL_BACKOFF_BASE", "1"))  # seconds
+POLL_BACKOFF_MAX = float(os.getenv("POLL_BACKOFF_MAX", "60"))  # seconds
+SERVING_MAX_IN_FLIGHT = int(os.getenv("SERVING_MAX_IN_FLIGHT", "32"))
+SERVING_TIMEOUT = float(os.getenv("SERVING_TIMEOUT", "120"))  # seconds
+# Floor of each endpoint's adaptive concurrency limit; set it to
+# SERVING_MAX_IN_FLIGHT for a fixed limit
+SERVING_MIN_IN_FLIGHT = int(os.getenv("SERVING_MIN_IN_FLIGHT", "1"))
+# Latency above this multiple of an endpoint's baseline lowers its limit
+SERVING_LATENCY_TOLERANCE = float(os.getenv("SERVING_LATENCY_TOLERANCE", "2"))
+# Consecutive failures that open an endpoint's circuit; 0 disables
+SERVING_BREAKER_FAILURES = int(os.getenv("SERVING_BREAKER_FAILURES", "5"))
+SERVING_BREAKER_SECONDS = float(os.getenv("SERVING_BREAKER_SECONDS", "30"))
+# Extra generation parameters sent with every query, as JSON
+SERVING_PARAMS = json.loads(os.getenv("SERVING_PARAMS", "{}"))
+# Endpoint pools: "p2c" (latency EWMA) or "least_outstanding"
+SERVING_ROUTING = os.getenv("SERVING_ROUTING", "p2c")
+SERVING_EJECT_AFTER = int(os.getenv("SERVING_EJECT_AFTER", "3"))  # consecutive failures
+SERVING_EJECT_SECONDS = float(os.getenv("SERVING_EJECT_SECONDS", "10"))
+# Hedge queries still running after this latency percentile; 0 disables
+SERVING_HEDGE_PERCENTILE = float(os.getenv("SERVING_HEDGE_PERCENTILE", "0"))
+SERVING_HEDGE_BUDGET = float(os.getenv("SERVING_HEDGE_BUDGET", "0.05"))  # max extra load
+# Where hedges go; defaults to the same endpoint (another member of a pool)
+SERVING_HEDGE_ENDPOINT = os.getenv("SERVING_HEDGE_ENDPOINT")
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(64 * 1024 * 1024)))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "3600"))  # seconds
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "false").lower() == "true"
+# Embeddings serving endpoint; required, the semantic cache stays off without it
+SEMANTIC_CACHE_EMBEDDING_ENDPOINT = os.getenv("SEMANTIC_CACHE_EMBEDDING_ENDPOINT")
+SEMANTIC_CACHE_THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+SEMANTIC_CACHE_MAX_ENTRIES = int(os.getenv("SEMANTIC_CACHE_MAX_ENTRIES", "100000"))
+# For batch-capable endpoints: "completions", "dataframe_records" or "inputs";
+# ignored when SYSTEM_PROMPT is set
+SERVING_BATCH_FORMAT = os.getenv("SERVING_BATCH_FORMAT", "")
+SERVING_BATCH_MAX_SIZE = int(os.getenv("SERVING_BATCH_MAX_SIZE", "16"))
+SERVING_BATCH_WINDOW_MS = float(os.getenv("SERVING_BATCH_WINDOW_MS", "20"))
+SERVING_BATCH_INPUT_COLUMN = os.getenv("SERVING_BATCH_INPUT_COLUMN", "prompt")
+HISTORY_ENABLED = os.getenv("HISTORY_ENABLED", "true").lower() == "true"
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", "10"))  # per chat
+HISTORY_MAX_BYTES = int(os.getenv("HISTORY_MAX_BYTES", str(256 * 1024 * 1024)))
+SYSTEM_PROMPT = os.getenv("SYSTEM_PROMPT", "")
+# Prompt token budget: system prompt + history + new message
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "4096"))
+TOKENIZER = os.getenv("TOKENIZER", "approx")  # "approx" or "tiktoken:<encoding>"
+# SQLite file for durable conversation history; empty disables it. Shard
+# workers each use their own, e.g. conversations.shard0.db
+CONVERSATION_DB_PATH = os.getenv("CONVERSATION_DB_PATH", "conversations.db")
+CONVERSATION_RETENTION_DAYS = float(os.getenv("CONVERSATION_RETENTION_DAYS", "30"))
+# Replace the oldest turns of long chats with a summary in the background
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "false").lower() == "true"
+# Endpoint that writes summaries; defaults to the bot's chat endpoint
+SUMMARY_ENDPOINT = os.getenv("SUMMARY_ENDPOINT")
+SUMMARY_TRIGGER_TOKENS = int(os.getenv("SUMMARY_TRIGGER_TOKENS", "2048"))
+SUMMARY_KEEP_TURNS = int(os.getenv("SUMMARY_KEEP_TURNS", "3"))
+SERVING_STREAMING = os.getenv("SERVING_STREAMING", "false").lower() == "true"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1"))  # seconds
+STREAM_EDIT_MAX_INTERVAL = float(os.getenv("STREAM_EDIT_MAX_INTERVAL", "3"))  # seconds
+# Telegram hides "typing…" after about 5 seconds
+TYPING_REFRESH_INTERVAL = float(os.getenv("TYPING_REFRESH_INTERVAL", "4.5"))  # seconds
+DISPATCHER_WORKERS = int(os.getenv("DISPATCHER_WORKERS", "16"))
+# Worker processes that chats are sharded across; 1 processes in-process
+SHARD_WORKERS = int(os.getenv("SHARD_WORKERS", "1"))
+# JSON file listing several bots to host in this process (see bots.py)
+BOTS_CONFIG = os.getenv("BOTS_CONFIG")
+INGEST_MAX_DEPTH = int(os.getenv("INGEST_MAX_DEPTH", "1000"))
+TELEGRAM_GLOBAL_RATE = float(os.getenv("TELEGRAM_GLOBAL_RATE", "30"))  # msg/s
+TELEGRAM_CHAT_RATE = float(os.getenv("TELEGRAM_CHAT_RATE", "1"))  # msg/s per chat
+TELEGRAM_GROUP_RATE = float(os.getenv("TELEGRAM_GROUP_RATE", "20"))  # msg/min per group
+# Checkpoint of the update offset and processed updates; empty disables it
+UPDATE_STATE_PATH = os.getenv("UPDATE_STATE_PATH", "update_state.json")
+# "block" stops acknowledging updates while the queue is full,
+# "shed" drops updates that arrive while it is full
+INGEST_BACKPRESSURE = os.getenv("INGEST_BACKPRESSURE", "block")
+# Attempts per call (including the first) on timeouts, 429 and 5xx
+TELEGRAM_RETRY_ATTEMPTS = int(os.getenv("TELEGRAM_RETRY_ATTEMPTS", "3"))
+SERVING_RETRY_ATTEMPTS = int(os.getenv("SERVING_RETRY_ATTEMPTS", "3"))
+# Retries allowed per request, so retries can't multiply load in an outage
+RETRY_BUDGET = float(os.getenv("RETRY_BUDGET", "0.1"))
+# Seconds from receiving an update to replying; 0 disables the deadline
+UPDATE_DEADLINE = float(os.getenv("UPDATE_DEADLINE", "90"))
+# Deadlines by chat type or command as JSON, e.g. {"group": 30, "/status": 10}
+UPDATE_DEADLINE_OVERRIDES = json.loads(os.getenv("UPDATE_DEADLINE_OVERRIDES", "{}"))
 
 # Initialize Databricks client
 w = WorkspaceClient()
 
-# Telegram API base URL
-TELEGRAM_API_URL = f"https://api.telegram.org/bot{TELEGRAM_BOT_TOKEN}"
+# Telegram API base URL, followed by the bot token
+TELEGRAM_API_BASE = "https://api.telegram.org/bot"
+
+# getUpdates accepts at most 100 updates per call
+TELEGRAM_MAX_UPDATES_LIMIT = 100
+
+# Reply while the serving endpoint's circuit is open
+UNAVAILABLE_REPLY = (
+    "⏳ The model is overloaded or unavailable right now. Please try again in a minute."
+)
+
+# Reply when an update could not be answered before its deadline
+DEADLINE_REPLY = "⌛ Sorry, that took too long to answer. Please try again."
+
+# Seconds the deadline reply itself may take
+DEADLINE_REPLY_TIMEOUT = 5.0
+
+
+def http_client() -> httpx.AsyncClient:
+    """HTTP client for the Bot API"""
+    # Keep the read timeout well above the long-poll timeout so an idle
+    # long poll never races the client timeout
+    return httpx.AsyncClient(timeout=httpx.Timeout(30.0, read=LONG_POLL_TIMEOUT + 15.0))
+
+
+def serving_client(max_in_flight: int) -> AsyncServingClient:
+    """Serving endpoint client with overload protection, hedging slow queries if configured"""
+    hedger = (
+        Hedger(percentile=SERVING_HEDGE_PERCENTILE, budget=SERVING_HEDGE_BUDGET)
+        if SERVING_HEDGE_PERCENTILE > 0 else None
+    )
+    return AsyncServingClient(
+        w,
+        max_in_flight=max_in_flight,
+        timeout=SERVING_TIMEOUT,
+        hedger=hedger,
+        min_in_flight=min(SERVING_MIN_IN_FLIGHT, max_in_flight),
+        latency_tolerance=SERVING_LATENCY_TOLERANCE,
+        breaker_failures=SERVING_BREAKER_FAILURES,
+        breaker_open=SERVING_BREAKER_SECONDS,
+        retry=RetryPolicy(SERVING_RETRY_ATTEMPTS, budget=RetryBudget(RETRY_BUDGET)),
+    )
+
+
+def telegram_error(error: httpx.HTTPError) -> dict:
+    """The Bot API's error response for a failed request, if it sent one"""
+    if isinstance(error, httpx.HTTPStatusError):
+        try:
+            data = error.response.json()
+        except ValueError:
+            data = None
+        if isinstance(data, dict):
+            return data
+    return {"ok": False, "error": str(error)}
 
 
 class TelegramPoller:
     """Polls Telegram for new messages and processes them"""
     
-    def __init__(self):
+    def __init__(
+        self,
+        mode: str = "polling",
+        name: str = "",
+        token: Optional[str] = None,
+        endpoint: Optional[str] = None,
+        client: Optional[httpx.AsyncClient] = None,
+        serving: Optional[AsyncServingClient] = None,
+        dispatcher: Optional[ChatDispatcher] = None,
+        cache: Optional[ResponseCache] = None,
+        flights: Optional[SingleFlight] = None,
+        shard: Optional[int] = None,
+        history_bytes: Optional[int] = None,
+    ):
+        """
+        Args:
+            mode: "polling" or "webhook" to receive updates, or "worker" for a
+                shard process that only processes updates routed to it
+            name: Bot name when several bots share the process; also keeps
+                their state files apart
+            token: Bot token; defaults to TELEGRAM_BOT_TOKEN
+            endpoint: Serving endpoint; defaults to DATABRICKS_SERVING_ENDPOINT
+            client: Shared HTTP client for the Bot API
+            serving: Shared serving endpoint client
+            dispatcher: Shared worker pool; this bot gets its own view of it
+            cache: Shared response cache
+            flights: Shared request coalescer
+            shard: Index of this shard worker; keeps its conversation
+                database apart from the other shards
+            history_bytes: Memory budget of this bot's conversation
+                history; defaults to HISTORY_MAX_BYTES
+        """
+        self.mode = mode
+        self.name = name
+        self.token = token or TELEGRAM_BOT_TOKEN
+        self.api_url = f"{TELEGRAM_API_BASE}{self.token}"
+        self.endpoint = endpoint or DATABRICKS_SERVING_ENDPOINT
         self.last_update_id = 0
-        self.client = httpx.AsyncClient(timeout=30.0)
+        self.started = False
+        # Leader with SHARD_WORKERS processes; each gets a share of the
+        # process-wide limits so the totals stay as configured
+        self.sharded = SHARD_WORKERS > 1 and mode != "worker" and dispatcher is None
+        share = SHARD_WORKERS if mode == "worker" else 1
+        # Called with each processed update_id in "worker" mode
+        self.on_processed = None
+        # Shared resources are closed by their owner
+        self.owns_client = client is None
+        self.owns_serving = serving is None
+        self.client = client or http_client()
+        self.poll_backoff = ExponentialBackoff(POLL_BACKOFF_BASE, POLL_BACKOFF_MAX)
+        # Flood waits of up to a minute are waited out rather than dropping the send
+        self.telegram_retry = RetryPolicy(
+            TELEGRAM_RETRY_ATTEMPTS, max_delay=60.0, budget=RetryBudget(RETRY_BUDGET)
+        )
+        self.serving = serving or serving_client(max(1, SERVING_MAX_IN_FLIGHT // share))
+        if self.endpoint:
+            self.endpoint = self.register_endpoints(self.endpoint)
+            if SERVING_HEDGE_ENDPOINT:
+                self.serving.hedge_endpoints[self.endpoint] = self.register_endpoints(
+                    SERVING_HEDGE_ENDPOINT
+                )
+        self.ledger = (
+            UpdateLedger(bot_path(UPDATE_STATE_PATH, name))
+            if UPDATE_STATE_PATH and mode != "worker" else None
+        )
+        if dispatcher is not None:
+            self.dispatcher = DispatcherView(
+                dispatcher, name, self.handle_update, max_pending=INGEST_MAX_DEPTH
+            )
+        elif self.sharded:
+            self.dispatcher = ShardedDispatcher(
+                shard_worker,
+                SHARD_WORKERS,
+                max_pending=INGEST_MAX_DEPTH,
+                on_done=self.update_done,
+            )
+        else:
+            self.dispatcher = ChatDispatcher(
+                self.handle_update,
+                workers=DISPATCHER_WORKERS,
+                # The leader bounds the queue for all shards
+                max_pending=INGEST_MAX_DEPTH if mode != "worker" else 0,
+            )
+        self.shed_updates = 0
+        self.deadlines = DeadlinePolicy(UPDATE_DEADLINE, UPDATE_DEADLINE_OVERRIDES)
+        if cache is not None or not RESPONSE_CACHE_ENABLED:
+            self.cache = cache
+        else:
+            self.cache = ResponseCache(max_bytes=RESPONSE_CACHE_MAX_BYTES, ttl=RESPONSE_CACHE_TTL)
+        self.batcher = (
+            MicroBatcher(
+                self.serving,
+                self.endpoint,
+                payload_format=SERVING_BATCH_FORMAT,
+                max_batch=SERVING_BATCH_MAX_SIZE,
+                max_wait=SERVING_BATCH_WINDOW_MS / 1000.0,
+                params=SERVING_PARAMS,
+                input_column=SERVING_BATCH_INPUT_COLUMN,
+            )
+            # Batch inputs are bare prompts with no room for a system prompt
+            if SERVING_BATCH_FORMAT and not SYSTEM_PROMPT else None
+        )
+        if SERVING_BATCH_FORMAT and SYSTEM_PROMPT:
+            logger.warning("SERVING_BATCH_FORMAT is ignored because SYSTEM_PROMPT is set")
+        self.count_tokens = get_tokenizer(TOKENIZER)
+        self.system_messages = (
+            [{"role": "system", "content": SYSTEM_PROMPT}] if SYSTEM_PROMPT else []
+        )
+        self.system_tokens = self.count_tokens(SYSTEM_PROMPT) if SYSTEM_PROMPT else 0
+        self.prompt_tokens = TokenHistogram()
+        self.conversations = (
+            ConversationStore(
+                max_turns=HISTORY_MAX_TURNS,
+                max_bytes=history_bytes or HISTORY_MAX_BYTES,
+                count_tokens=self.count_tokens,
+            )
+            if HISTORY_ENABLED else None
+        )
+        db_path = bot_path(CONVERSATION_DB_PATH, name)
+        if shard is not None:
+            # Chats stay on one shard, so each shard only needs its own
+            db_path = bot_path(db_path, f"shard{shard}")
+        self.conversation_log = (
+            SQLiteConversationLog(
+                db_path,
+                retention=CONVERSATION_RETENTION_DAYS * 86400,
+            )
+            if self.conversations is not None and CONVERSATION_DB_PATH and not self.sharded
+            else None
+        )
+        self.summarizer = (
+            HistorySummarizer(
+                self.serving,
+                self.register_endpoints(SUMMARY_ENDPOINT) if SUMMARY_ENDPOINT else self.endpoint,
+                self.conversations,
+                log=self.conversation_log,
+                trigger_tokens=SUMMARY_TRIGGER_TOKENS,
+                keep_messages=2 * SUMMARY_KEEP_TURNS,
+            )
+            if self.conversations is not None and SUMMARY_ENABLED else None
+        )
+        # Coalesces concurrent identical prompts into one endpoint call
+        self.flights = flights or SingleFlight()
+        # Streaming placeholders of updates that ran out of time, by chat;
+        # the deadline reply replaces them
+        self.placeholders: Dict[int, int] = {}
+        self.embedder = None
+        self.semantic: Optional[SemanticCache] = None
+        if SEMANTIC_CACHE_ENABLED and SEMANTIC_CACHE_EMBEDDING_ENDPOINT:
+            self.embedder = EndpointEmbedder(self.serving, SEMANTIC_CACHE_EMBEDDING_ENDPOINT)
+        elif SEMANTIC_CACHE_ENABLED:
+            # HashingEmbedder only sees shared words, so it would answer
+            # prompts that merely look alike
+            logger.warning(
+                "SEMANTIC_CACHE_ENABLED is ignored because SEMANTIC_CACHE_EMBEDDING_ENDPOINT is not set"
+            )
+        self.limiter = TelegramRateLimiter(
+            global_rate=TELEGRAM_GLOBAL_RATE / share,
+            chat_rate=TELEGRAM_CHAT_RATE,
+            group_rate=TELEGRAM_GROUP_RATE / 60.0,
+            group_burst=TELEGRAM_GROUP_RATE,
+        )
+        self.typing = ChatActionKeeper(
+            self.send_chat_action,
+            available=self.limiter.available,
+            interval=TYPING_REFRESH_INTERVAL,
+        )
         
-    async def send_to_databricks_endpoint(self, message: str) -> str:
+    def register_endpoints(self, spec: str) -> str:
+        """Set up load balancing if `spec` lists several endpoints; returns the name to query"""
+        return self.serving.register_endpoints(
+            spec,
+            strategy=SERVING_ROUTING,
+            eject_after=SERVING_EJECT_AFTER,
+            eject_base=SERVING_EJECT_SECONDS,
+        )
+    
+    async def lookup_cached_answer(self, message: str, use_cache: bool = True) -> tuple:
+        """
+        Look a prompt up in the exact and semantic response caches.
+        
+        Args:
+            message: The user message
+            use_cache: False for prompts whose answer depends on context
+                beyond the message itself (e.g. conversation history)
+            
+        Returns:
+            (cached answer or None, lookup state for store_cached_answer)
+        """
+        if not use_cache:
+            return None, None
+        version = await self.serving.model_version(self.endpoint)
+        params = {**SERVING_PARAMS, "system_prompt": SYSTEM_PROMPT} if SYSTEM_PROMPT else SERVING_PARAMS
+        
+        # The key is also used for request coalescing, so it's computed
+        # even if the exact cache is disabled
+        key = cache_key(message, self.endpoint, version, params)
+        if self.cache is not None:
+            cached = self.cache.get(key)
+            if cached is not None:
+                logger.info(f"Cache hit for: {message[:100]}")
+                return cached, None
+        
+        vector = None
+        if self.embedder is not None:
+            try:
+                vector = await self.embedder.embed(message)
+            except Exception as e:
+                logger.warning(f"Failed to embed prompt for semantic cache: {e}")
+            if vector is not None:
+                if self.semantic is None:
+                    self.semantic = SemanticCache(
+                        dim=len(vector),
+                        max_entries=SEMANTIC_CACHE_MAX_ENTRIES,
+                        threshold=SEMANTIC_CACHE_THRESHOLD,
+                        ttl=RESPONSE_CACHE_TTL,
+                    )
+                if self.semantic.version != version:
+                    self.semantic.reset(version)
+                cached = self.semantic.lookup(vector)
+                if cached is not None:
+                    logger.info(f"Semantic cache hit for: {message[:100]}")
+                    if self.cache is not None:
+                        self.cache.put(key, cached)
+                    return cached, None
+        
+        return None, (key, vector)
+    
+    def store_cached_answer(self, state: Optional[tuple], answer: str):
+        """
+        Cache a fresh answer.
+        
+        Args:
+            state: The lookup state returned by lookup_cached_answer
+            answer: The model's answer
+        """
+        if state is None:
+            return
+        key, vector = state
+        if self.cache is not None:
+            self.cache.put(key, answer)
+        if vector is not None and self.semantic is not None:
+            self.semantic.add(vector, answer)
+            if self.semantic.index_due:
+                asyncio.create_task(self.semantic.build_index(), context=deadline.detached())
+    
+    async def load_history(self, chat_id: Optional[int]) -> bool:
+        """
+        Make sure a chat's history is in memory, reading it back from the
+        conversation log on the first message since start (or since eviction).
+        
+        Returns:
+            Whether history is kept for this chat at all
+        """
+        if self.conversations is None or chat_id is None:
+            return False
+        if self.conversation_log is not None and chat_id not in self.conversations:
+            summary, rows = await self.conversation_log.load(
+                chat_id, self.conversations.max_messages
+            )
+            if rows or summary:
+                self.conversations.load(chat_id, rows, summary)
+        return True
+    
+    async def chat_history(self, chat_id: Optional[int], budget: Optional[int] = None) -> tuple:
+        """
+        Earlier messages of a chat to send along with a new one.
+        
+        Args:
+            chat_id: The Telegram chat ID
+            budget: Token budget the history is trimmed to, oldest first
+            
+        Returns:
+            (history messages, their token count)
+        """
+        if not await self.load_history(chat_id):
+            return [], 0
+        return self.conversations.window(chat_id, budget)
+    
+    async def build_prompt(self, chat_id: Optional[int], message: str) -> tuple:
+        """
+        Assemble the messages for a request within CONTEXT_TOKEN_BUDGET.
+        
+        The system prompt, the summary of compacted turns and the new
+        message are always included; history fills whatever budget remains,
+        keeping the most recent turns.
+        
+        Returns:
+            (messages, whether any history was included, prompt token count)
+        """
+        system_messages = self.system_messages
+        fixed = self.system_tokens + self.count_tokens(message)
+        summary = ""
+        if await self.load_history(chat_id):
+            summary, summary_tokens = self.conversations.summary(chat_id)
+        if summary:
+            content = f"{SYSTEM_PROMPT}\n\n" if SYSTEM_PROMPT else ""
+            content += f"Summary of the earlier conversation:\n{summary}"
+            system_messages = [{"role": "system", "content": content}]
+            fixed += summary_tokens
+        history, history_tokens = await self.chat_history(
+            chat_id, max(0, CONTEXT_TOKEN_BUDGET - fixed)
+        )
+        messages = system_messages + history + [{"role": "user", "content": message}]
+        return messages, bool(history or summary), fixed + history_tokens
+    
+    def record_turn(self, chat_id: Optional[int], message: str, reply: str):
+        """Remember a successful exchange in the chat's history"""
+        if self.conversations is None or chat_id is None:
+            return
+        self.conversations.append_turn(chat_id, message, reply)
+        if self.conversation_log is not None:
+            self.conversation_log.append(chat_id, "user", message)
+            self.conversation_log.append(chat_id, "assistant", reply)
+        if self.summarizer is not None:
+            self.summarizer.maybe_schedule(chat_id)
+    
+    async def send_to_databricks_endpoint(
+        self, message: str, chat_id: Optional[int] = None, use_cache: bool = True
+    ) -> str:
         """
         Send a message to the Databricks serving endpoint and get the response.
         
         Args:
             message: The user message to send
+            chat_id: The chat the message came from; its history is sent as
+                context and the exchange is added to it
+            use_cache: Whether the response cache may answer or store this prompt
             
         Returns:
             The response from the model
         """
         try:
-            logger.info(f"Sending to Databricks endpoint: {message[:100]}")
+            deadline.enter("prompt")
+            messages, has_history, prompt_tokens = await self.build_prompt(chat_id, message)
+            # Answers that depend on earlier turns can't be shared
+            cached, cache_state = await self.lookup_cached_answer(
+                message, use_cache and not has_history
+            )
+            if cached is not None:
+                self.record_turn(chat_id, message, cached)
+                return cached
             
-            # Query the serving endpoint using the Databricks SDK
-            response = w.serving_endpoints.query(
-                name=DATABRICKS_SERVING_ENDPOINT,
-                messages=[
-                    ChatMessage(
-                        role=ChatMessageRole.USER,
-                        content=message
+            async def query() -> str:
+                logger.info(f"Sending to Databricks endpoint: {message[:100]}")
+                started = time.monotonic()
+                if self.batcher is not None and len(messages) == 1:
+                    # Only the user's message: sent together with other
+                    # prompts from the same window
+                    result = await self.batcher.submit(message)
+                else:
+                    # Query the serving endpoint without blocking the event loop
+                    result = await self.serving.chat(
+                        self.endpoint, messages, **SERVING_PARAMS
                     )
-                ]
-            )
+                self.prompt_tokens.observe(prompt_tokens, time.monotonic() - started)
+                if result:
+                    logger.info(f"Received response: {result[:100]}")
+                    self.store_cached_answer(cache_state, result)
+                return result
+            
+            deadline.enter("inference")
+            if cache_state is not None:
+                # Identical prompts already in flight share that call
+                result = await self.flights.do(
+                    cache_state[0], query, context=deadline.detached()
+                )
+            else:
+                result = await query()
             
-            # Extract the response content
-            if response.choices and len(response.choices) > 0:
-                result = response.choices[0].message.content
-                logger.info(f"Received response: {result[:100]}")
+            if result:
+                self.record_turn(chat_id, message, result)
                 return result
             else:
                 return "I couldn't generate a response. Please try again."
                 
+        except CircuitOpenError as e:
+            logger.warning(f"Not querying Databricks endpoint: {e}")
+            return UNAVAILABLE_REPLY
         except Exception as e:
             logger.error(f"Error querying Databricks endpoint: {str(e)}")
             return f"Sorry, I encountered an error: {str(e)}"
     
-    async def send_telegram_message(self, chat_id: int, text: str) -> dict:
+    def cache_status(self) -> str:
+        """Response cache counters for /status"""
+        status = ""
+        if self.cache is not None:
+            stats = self.cache.stats()
+            status += (
+                f"\n💾 Cache: {stats['hits']} hits / {stats['misses']} misses "
+                f"({stats['hit_rate']:.0%}), {stats['evictions']} evictions, "
+                f"{stats['entries']} entries ({stats['bytes'] // 1024} KB)"
+            )
+        if self.semantic is not None:
+            stats = self.semantic.stats()
+            status += (
+                f"\n🧭 Semantic cache: {stats['hits']} hits / {stats['misses']} misses "
+                f"({stats['hit_rate']:.0%}), {stats['entries']} entries"
+            )
+        stats = self.flights.stats()
+        status += (
+            f"\n🔗 Coalesced requests: {stats['coalesced']} of "
+            f"{stats['calls'] + stats['coalesced']} ({stats['coalescing_ratio']:.0%})"
+        )
+        return status
+    
+    async def telegram_send(
+        self, method: str, payload: dict, per_chat: bool = True
+    ) -> httpx.Response:
+        """
+        Call a Bot API send method through the outbound rate limiter.
+        
+        429 responses are honoured by blocking the chat for `retry_after`
+        seconds and sending again, so messages are delayed rather than lost.
+        Timeouts, connection errors and 5xx responses are retried with
+        backoff, within TELEGRAM_RETRY_ATTEMPTS and the retry budget.
+        
+        Args:
+            method: Bot API method name, e.g. "sendMessage"
+            payload: JSON body; must contain "chat_id"
+            per_chat: Whether the per-chat/group limits apply in addition
+                to the global limit
+            
+        Returns:
+            The last HTTP response
+            
+        Raises:
+            httpx.HTTPError: If the last attempt failed without a response
+        """
+        url = f"{self.api_url}/{method}"
+        chat_id = payload["chat_id"] if per_chat else None
+        
+        async def attempt() -> httpx.Response:
+            await self.limiter.acquire(chat_id)
+            response = await self.client.post(url, json=payload)
+            retry_after = None
+            if response.status_code == 429:
+                try:
+                    retry_after = float(response.json()["parameters"]["retry_after"])
+                except (ValueError, KeyError, TypeError):
+                    # Proxies and gateways answer 429 without the Bot API's body
+                    retry_after = parse_retry_after(response) or 1.0
+                # The limiter holds the chat back until the flood wait is over;
+                # the retry waits it out too, for calls that skip the chat limits
+                self.limiter.flood_wait(retry_after, payload["chat_id"])
+            if response.status_code in RETRYABLE_STATUSES:
+                raise TransientError(
+                    f"{method} returned {response.status_code}",
+                    status_code=response.status_code,
+                    retry_after=retry_after,
+                    response=response,
+                )
+            return response
+        
+        try:
+            return await self.telegram_retry.run(attempt)
+        except TransientError as e:
+            return e.response
+    
+    async def stream_databricks_reply(self, chat_id: int, message: str, use_cache: bool = True):
+        """
+        Stream a reply from the Databricks serving endpoint into Telegram.
+        
+        A placeholder is posted immediately and progressively edited as
+        chunks arrive, so the user sees text after roughly the first-chunk
+        latency instead of the full generation time.
+        
+        Args:
+            chat_id: The Telegram chat ID
+            message: The user message to send
+            use_cache: Whether the response cache may answer or store this prompt
+        """
+        deadline.enter("prompt")
+        messages, has_history, prompt_tokens = await self.build_prompt(chat_id, message)
+        cached, cache_state = await self.lookup_cached_answer(
+            message, use_cache and not has_history
+        )
+        if cached is not None:
+            self.record_turn(chat_id, message, cached)
+            deadline.enter("send")
+            await self.send_telegram_message(chat_id, cached)
+            return
+        
+        reply = None
+        abandoned = False
+        
+        async def stream() -> str:
+            nonlocal reply
+            logger.info(f"Streaming from Databricks endpoint: {message[:100]}")
+            if not abandoned:
+                reply = ProgressiveMessage(
+                    self, chat_id,
+                    min_interval=STREAM_EDIT_INTERVAL,
+                    max_interval=STREAM_EDIT_MAX_INTERVAL,
+                )
+                await reply.start()
+            started = time.monotonic()
+            text = ""
+            async for chunk in self.serving.stream_chat(
+                self.endpoint, messages, **SERVING_PARAMS
+            ):
+                text += chunk
+                if reply is not None:
+                    reply.update(text)
+            self.prompt_tokens.observe(prompt_tokens, time.monotonic() - started)
+            if text:
+                self.store_cached_answer(cache_state, text)
+            return text
+        
+        deadline.enter("inference")
+        try:
+            if cache_state is not None:
+                # If an identical prompt is already streaming elsewhere, wait
+                # for its final text instead of streaming a second copy. The
+                # stream may outlive this update's deadline if others wait on it
+                text = await self.flights.do(cache_state[0], stream, context=deadline.detached())
+            else:
+                text = await stream()
+            if text:
+                self.record_turn(chat_id, message, text)
+        except asyncio.CancelledError:
+            # Out of time: the deadline reply takes over from the placeholder
+            abandoned = True
+            if reply is not None:
+                reply.abandon()
+                if reply.message_id is not None:
+                    self.placeholders[chat_id] = reply.message_id
+            raise
+        except CircuitOpenError as e:
+            logger.warning(f"Not streaming from Databricks endpoint: {e}")
+            text = UNAVAILABLE_REPLY
+        except Exception as e:
+            logger.error(f"Error streaming from Databricks endpoint: {str(e)}")
+            text = f"Sorry, I encountered an error: {str(e)}"
+        
+        if not text:
+            text = "I couldn't generate a response. Please try again."
+        logger.info(f"Received response: {text[:100]}")
+        deadline.enter("send")
+        if reply is not None:
+            await reply.finish(text)
+        else:
+            await self.send_telegram_message(chat_id, text)
+    
+    async def send_telegram_message(
+        self, chat_id: int, text: str, parse_mode: Optional[str] = "Markdown"
+    ) -> dict:
         """
         Send a message back to Telegram.
         
+        Text longer than Telegram allows is split into several messages at
+        paragraph or sentence boundaries, keeping Markdown entities intact.
+        They are sent one after the other so they arrive in order; a failed
+        part stops the rest. A part whose Markdown Telegram can't parse is
+        sent again as plain text.
+        
         Args:
             chat_id: The Telegram chat ID
             text: The message text to send
+            parse_mode: Telegram parse mode, or None for plain text
+            
+        Returns:
+            The Telegram API response for the last part sent
+        """
+        for part in split_message(text, markdown=parse_mode == "Markdown"):
+            payload = {
+                "chat_id": chat_id,
+                "text": part,
+            }
+            if parse_mode:
+                payload["parse_mode"] = parse_mode
+            
+            try:
+                response = await self.telegram_send("sendMessage", payload)
+                response.raise_for_status()
+                result = response.json()
+            except httpx.HTTPError as e:
+                result = telegram_error(e)
+                if parse_mode and markdown_rejected(result):
+                    logger.warning(f"Telegram rejected Markdown, sending as plain text: {result}")
+                    result = await self.send_telegram_message(chat_id, part, parse_mode=None)
+                    if result.get("ok"):
+                        continue
+                else:
+                    logger.error(f"Error sending message to Telegram: {str(e)}")
+                return result
+        return result
+    
+    async def edit_telegram_message(
+        self, chat_id: int, message_id: int, text: str, parse_mode: Optional[str] = None
+    ) -> dict:
+        """
+        Replace the text of a message previously sent by the bot.
+        
+        Args:
+            chat_id: The Telegram chat ID
+            message_id: The message to edit
+            text: The new message text
+            parse_mode: Telegram parse mode, or None for plain text
             
         Returns:
             The Telegram API response
         """
-        url = f"{TELEGRAM_API_URL}/sendMessage"
         payload = {
             "chat_id": chat_id,
+            "message_id": message_id,
             "text": text,
-            "parse_mode": "Markdown"
         }
+        if parse_mode:
+            payload["parse_mode"] = parse_mode
         
         try:
-            response = await self.client.post(url, json=payload)
+            response = await self.telegram_send("editMessageText", payload)
             response.raise_for_status()
             return response.json()
         except httpx.HTTPError as e:
-            logger.error(f"Error sending message to Telegram: {str(e)}")
-            return {"ok": False, "error": str(e)}
+            logger.error(f"Error editing Telegram message: {str(e)}")
+            return telegram_error(e)
     
     async def send_chat_action(self, chat_id: int, action: str = "typing"):
         """Send chat action (e.g., typing indicator)"""
-        url = f"{TELEGRAM_API_URL}/sendChatAction"
         try:
-            await self.client.post(url, json={"chat_id": chat_id, "action": action})
+            # Chat actions aren't messages, so only the global limit applies
+            await self.telegram_send(
+                "sendChatAction", {"chat_id": chat_id, "action": action}, per_chat=False
+            )
         except Exception as e:
             logger.warning(f"Failed to send chat action: {e}")
     
-    async def get_updates(self) -> list:
+    def poll_limit(self) -> int:
+        """Number of updates to request, sized to free dispatcher capacity"""
+        if self.dispatcher.max_pending <= 0:
+            return TELEGRAM_MAX_UPDATES_LIMIT
+        free = self.dispatcher.max_pending - self.dispatcher.pending
+        return max(1, min(TELEGRAM_MAX_UPDATES_LIMIT, free))
+    
+    async def get_updates(self) -> Optional[list]:
         """
         Get new updates from Telegram using long polling.
         
         Returns:
-            List of updates
+            List of updates, or None if the poll failed
         """
-        url = f"{TELEGRAM_API_URL}/getUpdates"
+        url = f"{self.api_url}/getUpdates"
         params = {
             "offset": self.last_update_id + 1,
-            "timeout": 30,  # Long polling timeout
+            "timeout": LONG_POLL_TIMEOUT,
+            "limit": self.poll_limit(),
             "allowed_updates": ["message"]
         }
         
         try:
             response = await self.client.get(url, params=params)
+            if response.status_code == 409:
+                # Another getUpdates consumer or an active webhook
+                logger.error(f"Conflict polling Telegram: {response.text}")
+                return None
             response.raise_for_status()
             data = response.json()
             
             if data.get("ok"):
-                updates = data.get("result", [])
-                if updates:
-                    # Update the last_update_id to avoid processing same messages
-                    self.last_update_id = max(update["update_id"] for update in updates)
-                return updates
+                # The offset is advanced by the caller once each update
+                # has been handed off for processing
+                return data.get("result", [])
             else:
                 logger.error(f"Error getting updates: {data}")
-                return []
+                return None
                 
         except Exception as e:
             logger.error(f"Error polling Telegram: {str(e)}")
-            return []
+            return None
     
     async def process_update(self, update: dict):
         """
@@ -167,6 +908,7 @@ class TelegramPoller:
             user_name = message.get("from", {}).get("first_name", "User")
             
             logger.info(f"Processing message from {user_name} (chat {chat_id}): {user_message}")
+            deadline.enter("send")
             
             # Handle commands
             if user_message.startswith("/start"):
@@ -183,27 +925,55 @@ class TelegramPoller:
                     "Commands:\n"
                     "/start - Welcome message\n"
                     "/help - This help message\n"
+                    "/reset - Forget our conversation so far\n"
                     "/status - Check bot status"
                 )
                 return
             
+            if user_message.startswith("/reset"):
+                if self.summarizer is not None:
+                    self.summarizer.cancel(chat_id)
+                if self.conversations is not None:
+                    self.conversations.clear(chat_id)
+                if self.conversation_log is not None:
+                    self.conversation_log.clear(chat_id)
+                await self.send_telegram_message(chat_id, "🧹 Conversation cleared.")
+                return
+            
             if user_message.startswith("/status"):
+                # Shard workers don't track the offset; only the leader polls
+                offset = (
+                    f"📊 Last update ID: {self.last_update_id}\n" if self.mode != "worker" else ""
+                )
                 await self.send_telegram_message(
                     chat_id,
                     f"✅ Bot is running\n"
-                    f"🔗 Endpoint: {DATABRICKS_SERVING_ENDPOINT}\n"
-                    f"🔄 Mode: Polling\n"
-                    f"📊 Last update ID: {self.last_update_id}"
+                    f"🔗 Endpoint: {self.endpoint}\n"
+                    f"🔄 Mode: {self.mode.capitalize()}\n"
+                    f"{offset}"
+                    f"⚙️ Pending updates: {self.dispatcher.pending} "
+                    f"across {self.dispatcher.active_chats} chats\n"
+                    f"⏱️ Avg queue wait: {self.dispatcher.stats()['avg_wait']:.2f}s\n"
+                    f"🚦 Throttled sends: {self.limiter.throttled} "
+                    f"(flood waits: {self.limiter.flood_waits})"
+                    + self.cache_status()
+                    + f"\n🧮 Prompt tokens p50/p95: {self.prompt_tokens.percentile(50)}"
+                    f" / {self.prompt_tokens.percentile(95)}"
                 )
                 return
             
-            # Send typing indicator
-            await self.send_chat_action(chat_id, "typing")
+            if SERVING_STREAMING:
+                await self.stream_databricks_reply(chat_id, user_message)
+                logger.info(f"Successfully processed message for chat {chat_id}")
+                return
             
-            # Get response from Databricks endpoint
-            bot_response = await self.send_to_databricks_endpoint(user_message)
+            # Show "typing…" until the reply is ready
+            async with self.typing.keep(chat_id):
+                # Get response from Databricks endpoint
+                bot_response = await self.send_to_databricks_endpoint(user_message, chat_id)
             
             # Send response back to Telegram
+            deadline.enter("send")
             await self.send_telegram_message(chat_id, bot_response)
             
             logger.info(f"Successfully processed message for chat {chat_id}")
@@ -216,56 +986,421 @@ class TelegramPoller:
                     message["chat"]["id"],
                     "Sorry, I encountered an error processing your message. Please try again."
                 )
-            except:
+            except Exception:
                 pass
     
+    async def handle_update(self, update: dict):
+        """Process an update within its deadline and report it as done"""
+        update_deadline = self.deadlines.start(update, queued_at.get())
+        if update_deadline is None:
+            await self.process_update(update)
+            self.update_done(update["update_id"])
+            return
+        
+        # Updates that waited out their deadline in the queue are not started
+        exceeded = update_deadline.remaining() <= 0
+        token = deadline.activate(update_deadline)
+        try:
+            if not exceeded:
+                async with asyncio.timeout(update_deadline.remaining()):
+                    await self.process_update(update)
+        except TimeoutError:
+            exceeded = True
+        finally:
+            deadline.reset(token)
+        if exceeded:
+            self.deadlines.record_exceeded(update_deadline)
+            logger.warning(
+                f"Update {update['update_id']} exceeded its deadline "
+                f"in stage {update_deadline.stage}"
+            )
+            await self.send_deadline_reply(update)
+        self.update_done(update["update_id"])
+    
+    async def send_deadline_reply(self, update: dict):
+        """
+        Tell the user an update timed out, taking at most DEADLINE_REPLY_TIMEOUT.
+        
+        A streaming placeholder left behind by the update is edited to the
+        reply instead of sending a new message.
+        """
+        chat_id = update.get("message", {}).get("chat", {}).get("id")
+        if chat_id is None:
+            return
+        placeholder = self.placeholders.pop(chat_id, None)
+        try:
+            async with asyncio.timeout(DEADLINE_REPLY_TIMEOUT):
+                if placeholder is not None:
+                    result = await self.edit_telegram_message(chat_id, placeholder, DEADLINE_REPLY)
+                    if result.get("ok"):
+                        return
+                await self.send_telegram_message(chat_id, DEADLINE_REPLY, parse_mode=None)
+        except TimeoutError:
+            logger.warning(f"Timed out sending the deadline reply to chat {chat_id}")
+    
+    def update_done(self, update_id: int):
+        """Record a processed update in the ledger, or report it to the leader"""
+        if self.ledger is not None:
+            self.ledger.done(update_id)
+        if self.on_processed is not None:
+            self.on_processed(update_id)
+    
+    def acknowledge(self, update_id: int):
+        """Advance the offset past an update that was accepted or shed"""
+        self.last_update_id = max(self.last_update_id, update_id)
+        if self.ledger is not None:
+            self.ledger.acknowledge(self.last_update_id)
+    
+    async def enqueue_update(self, update: dict):
+        """
+        Hand an update to the dispatcher and acknowledge it.
+
+        The offset only advances past an update once it has been accepted
+        by the dispatcher (or deliberately shed), so a full queue stops
+        polling rather than losing updates in "block" mode. Updates the
+        ledger has already seen are acknowledged without processing.
+        """
+        update_id = update["update_id"]
+        if self.ledger is not None and self.ledger.is_duplicate(update_id):
+            logger.info(f"Skipping already processed update {update_id}")
+        elif INGEST_BACKPRESSURE == "shed":
+            if self.dispatcher.offer(update):
+                if self.ledger is not None:
+                    self.ledger.accept(update)
+            else:
+                self.shed_updates += 1
+                logger.warning(
+                    f"Ingestion queue full ({self.dispatcher.pending}), "
+                    f"shedding update {update_id}"
+                )
+        else:
+            if self.dispatcher.full:
+                logger.warning(
+                    f"Ingestion queue full ({self.dispatcher.pending}), "
+                    f"waiting before acknowledging update {update_id}"
+                )
+            await self.dispatcher.put(update)
+            if self.ledger is not None:
+                self.ledger.accept(update)
+        self.acknowledge(update_id)
+    
+    async def set_webhook(self) -> dict:
+        """
+        Register WEBHOOK_URL with Telegram.
+        
+        Returns:
+            The Telegram API response
+        """
+        # With several bots each one gets its own route under WEBHOOK_URL
+        url = f"{WEBHOOK_URL.rstrip('/')}/{self.name}" if self.name else WEBHOOK_URL
+        payload = {
+            "url": url,
+            "max_connections": WEBHOOK_MAX_CONNECTIONS,
+            "allowed_updates": ["message"],
+            "secret_token": WEBHOOK_SECRET,
+        }
+        response = await self.client.post(f"{self.api_url}/setWebhook", json=payload)
+        response.raise_for_status()
+        logger.info(f"Webhook set to {url} (max_connections={WEBHOOK_MAX_CONNECTIONS})")
+        return response.json()
+    
+    async def delete_webhook(self):
+        """Remove any registered webhook so getUpdates can be used"""
+        try:
+            await self.client.get(f"{self.api_url}/deleteWebhook")
+            logger.info("Webhook deleted (if any)")
+        except Exception as e:
+            logger.warning(f"Failed to delete webhook: {e}")
+    
+    def stats(self) -> dict:
+        """Statistics of every processing stage, for /health"""
+        return {
+            "mode": self.mode,
+            "dispatcher": self.dispatcher.stats(),
+            "rate_limiter": self.limiter.stats(),
+            "typing": self.typing.stats(),
+            "response_cache": self.cache.stats() if self.cache is not None else None,
+            "semantic_cache": self.semantic.stats() if self.semantic is not None else None,
+            "coalescing": self.flights.stats(),
+            "endpoints": {spec: pool.stats() for spec, pool in self.serving.pools.items()},
+            "hedging": self.serving.hedger.stats() if self.serving.hedger is not None else None,
+            "serving": self.serving.stats(),
+            "deadlines": self.deadlines.stats(),
+            "retries": {
+                "telegram": self.telegram_retry.stats(),
+                "serving": self.serving.retry.stats() if self.serving.retry is not None else None,
+            },
+            "batching": self.batcher.stats() if self.batcher is not None else None,
+            "history": self.conversations.stats() if self.conversations is not None else None,
+            "prompt_tokens": self.prompt_tokens.stats(),
+            "summarization": self.summarizer.stats() if self.summarizer is not None else None,
+            "update_ledger": self.ledger.stats() if self.ledger is not None else None,
+            "conversation_log": (
+                self.conversation_log.stats() if self.conversation_log is not None else None
+            ),
+        }
+    
+    async def start(self):
+        """
+        Open durable state, replay unfinished updates and start the processing
+        workers. Does nothing if the bot has already been started.
+        """
+        if self.started:
+            return
+        self.started = True
+        if self.conversation_log is not None:
+            await self.conversation_log.start()
+        if self.ledger is not None:
+            unfinished = await asyncio.to_thread(self.ledger.load)
+            self.last_update_id = max(self.last_update_id, self.ledger.offset)
+            for update in unfinished:
+                # Replayed regardless of the depth limit; they were accepted before
+                self.dispatcher.submit(update)
+            if unfinished:
+                logger.info(f"Replaying {len(unfinished)} unfinished updates")
+            self.ledger.start()
+        self.dispatcher.start()
+    
+    async def close(self):
+        """Stop processing and release connections"""
+        await self.dispatcher.stop()
+        if self.ledger is not None:
+            await self.ledger.close()
+        if self.summarizer is not None:
+            await self.summarizer.close()
+        if self.conversation_log is not None:
+            await self.conversation_log.close()
+        if self.owns_client:
+            await self.client.aclose()
+        if self.owns_serving:
+            await self.serving.aclose()
+    
     async def run(self):
         """Main polling loop"""
         logger.info("=" * 60)
-        logger.info("Telegram Bot Poller Started")
+        logger.info(f"Telegram Bot Poller Started{f' ({self.name})' if self.name else ''}")
         logger.info("=" * 60)
-        logger.info(f"Bot Token: {TELEGRAM_BOT_TOKEN[:10]}...")
-        logger.info(f"Endpoint: {DATABRICKS_SERVING_ENDPOINT}")
-        logger.info(f"Poll Interval: {POLL_INTERVAL}s")
+        logger.info(f"Bot Token: {self.token[:10]}...")
+        logger.info(f"Endpoint: {self.endpoint}")
+        logger.info(f"Long Poll Timeout: {LONG_POLL_TIMEOUT}s")
+        logger.info(f"Dispatcher Workers: {DISPATCHER_WORKERS}")
+        if self.sharded:
+            logger.info(f"Shard Worker Processes: {SHARD_WORKERS}")
+        logger.info(f"Ingestion Queue: max {INGEST_MAX_DEPTH} ({INGEST_BACKPRESSURE})")
         logger.info("=" * 60)
         
         # Delete webhook if it exists
-        try:
-            await self.client.get(f"{TELEGRAM_API_URL}/deleteWebhook")
-            logger.info("Webhook deleted (if any)")
-        except:
-            pass
+        await self.delete_webhook()
+        
+        await self.start()
         
         while True:
             try:
+                if self.ledger is not None:
+                    # The next poll confirms everything up to the offset to
+                    # Telegram, so the ledger must hold those updates first
+                    await self.ledger.sync()
+                
                 # Get new updates
                 updates = await self.get_updates()
                 
+                if updates is None:
+                    # Back off only on errors; a successful long poll
+                    # (empty or not) is followed immediately by the next
+                    delay = self.poll_backoff.next_delay()
+                    logger.info(f"Retrying poll in {delay:.1f}s")
+                    await asyncio.sleep(delay)
+                    continue
+                self.poll_backoff.reset()
+                
                 if updates:
                     logger.info(f"Received {len(updates)} new updates")
                     
-                    # Process each update
+                    # Hand each update to the dispatcher; chats run
+                    # concurrently, messages within a chat stay in order
                     for update in updates:
-                        await self.process_update(update)
-                
-                # Wait before next poll (only if not using long polling timeout)
-                await asyncio.sleep(POLL_INTERVAL)
+                        await self.enqueue_update(update)
                 
             except KeyboardInterrupt:
                 logger.info("Stopping poller...")
                 break
             except Exception as e:
                 logger.error(f"Error in main loop: {str(e)}")
-                await asyncio.sleep(5)  # Wait before retrying
+                await asyncio.sleep(self.poll_backoff.next_delay())
         
-        await self.client.aclose()
+        await self.close()
         logger.info("Poller stopped")
 
 
+def shard_worker(index: int) -> TelegramPoller:
+    """Build the processing side of a shard worker process"""
+    return TelegramPoller(mode="worker", shard=index)
+
+
+class BotHost:
+    """
+    Hosts several bots in one process.
+    
+    Each bot keeps its own token, offset, rate limits, history and state
+    files, while all of them share one HTTP connection pool, one serving
+    client, one response cache and one pool of dispatcher workers.
+    """
+    
+    def __init__(self, configs: List[dict], mode: str = "polling"):
+        """
+        Args:
+            configs: Bot entries as returned by load_bot_configs
+            mode: "polling" or "webhook"
+        """
+        self.mode = mode
+        self.client = http_client()
+        self.serving = serving_client(SERVING_MAX_IN_FLIGHT)
+        # Every bot submits with its own handler
+        self.dispatcher = ChatDispatcher(None, workers=DISPATCHER_WORKERS)
+        self.cache = (
+            ResponseCache(max_bytes=RESPONSE_CACHE_MAX_BYTES, ttl=RESPONSE_CACHE_TTL)
+            if RESPONSE_CACHE_ENABLED else None
+        )
+        self.flights = SingleFlight()
+        if SHARD_WORKERS > 1:
+            logger.warning("SHARD_WORKERS is ignored because BOTS_CONFIG is set")
+        self.bots = {
+            config["name"]: TelegramPoller(
+                mode,
+                name=config["name"],
+                token=config["token"],
+                endpoint=config["endpoint"],
+                client=self.client,
+                serving=self.serving,
+                dispatcher=self.dispatcher,
+                cache=self.cache,
+                flights=self.flights,
+                # HISTORY_MAX_BYTES bounds the process, not each bot
+                history_bytes=max(1, HISTORY_MAX_BYTES // len(configs)),
+            )
+            for config in configs
+        }
+    
+    async def start(self):
+        """Start the shared workers and every bot"""
+        self.dispatcher.start()
+        await asyncio.gather(*(bot.start() for bot in self.bots.values()))
+    
+    async def run(self):
+        """Poll for all bots concurrently"""
+        logger.info(f"Hosting {len(self.bots)} bots: {', '.join(self.bots)}")
+        await self.start()
+        await asyncio.gather(*(bot.run() for bot in self.bots.values()))
+    
+    async def close(self):
+        """Stop the shared workers, then every bot, then the shared clients"""
+        await self.dispatcher.stop()
+        await asyncio.gather(*(bot.close() for bot in self.bots.values()))
+        await self.client.aclose()
+        await self.serving.aclose()
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Start the bot(s) in the configured mode for the lifetime of the app"""
+    if BOT_MODE == "webhook" and not WEBHOOK_SECRET:
+        # Without it anyone could post updates for arbitrary chats
+        raise ValueError("BOT_MODE=webhook requires WEBHOOK_SECRET")
+    if BOTS_CONFIG:
+        runner = BotHost(load_bot_configs(BOTS_CONFIG), mode=BOT_MODE)
+        app.state.bots = runner.bots
+    else:
+        runner = TelegramPoller(mode=BOT_MODE)
+        app.state.bots = {"": runner}
+    task = None
+    if BOT_MODE == "webhook":
+        await runner.start()
+        for bot in app.state.bots.values():
+            await bot.set_webhook()
+    else:
+        task = asyncio.create_task(runner.run())
+    
+    yield
+    
+    if task is not None:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+    await runner.close()
+
+
+app = FastAPI(title="Telegram Databricks Bot", lifespan=lifespan)
+
+
+@app.post("/webhook")
+@app.post("/webhook/{name}")
+async def telegram_webhook(request: Request, name: str = ""):
+    """
+    Receive an update pushed by Telegram.
+    
+    The update is handed to the dispatcher and acknowledged immediately;
+    the reply is sent asynchronously by a dispatcher worker. When several
+    bots are hosted, each one posts to /webhook/<name>. In polling mode
+    the route does not exist.
+    """
+    if BOT_MODE != "webhook":
+        raise HTTPException(status_code=404, detail="Not Found")
+    token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "")
+    # Compared as bytes: compare_digest rejects non-ASCII str
+    if not WEBHOOK_SECRET or not hmac.compare_digest(token.encode(), WEBHOOK_SECRET.encode()):
+        raise HTTPException(status_code=403, detail="Invalid secret token")
+    
+    bot: Optional[TelegramPoller] = request.app.state.bots.get(name)
+    if bot is None:
+        raise HTTPException(status_code=404, detail="Unknown bot")
+    try:
+        update = await request.json()
+    except ValueError:
+        # json.JSONDecodeError and UnicodeDecodeError are both ValueErrors
+        raise HTTPException(status_code=400, detail="Malformed update")
+    if not isinstance(update, dict):
+        raise HTTPException(status_code=400, detail="Malformed update")
+    update_id = update.get("update_id", 0)
+    
+    if bot.ledger is not None and bot.ledger.is_duplicate(update_id):
+        # Redelivered after a timeout or restart; already handled
+        return {"ok": True}
+    
+    if not bot.dispatcher.offer(update):
+        if INGEST_BACKPRESSURE == "shed":
+            bot.shed_updates += 1
+            logger.warning(f"Ingestion queue full, shedding update {update_id}")
+        else:
+            # A non-2xx response makes Telegram redeliver the update later
+            raise HTTPException(status_code=503, detail="Ingestion queue full")
+    else:
+        if bot.ledger is not None:
+            bot.ledger.accept(update)
+        bot.acknowledge(update_id)
+        if bot.ledger is not None:
+            # Answering 200 makes Telegram drop the update, so it has to
+            # be checkpointed first; concurrent requests share one fsync
+            await bot.ledger.sync()
+    
+    return {"ok": True}
+
+
+@app.get("/health")
+async def health(request: Request):
+    """Liveness check with per-stage statistics"""
+    bots = request.app.state.bots
+    if list(bots) == [""]:
+        return {"status": "ok", **bots[""].stats()}
+    return {"status": "ok", "bots": {name: bot.stats() for name, bot in bots.items()}}
+
+
 async def main():
     """Entry point"""
-    poller = TelegramPoller()
-    await poller.run()
+    if BOTS_CONFIG:
+        host = BotHost(load_bot_configs(BOTS_CONFIG))
+        await host.run()
+    else:
+        poller = TelegramPoller()
+        await poller.run()
 
 
 if __name__ == "__main__":
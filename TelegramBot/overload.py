@@ -0,0 +1,310 @@
+"""
+Overload protection for serving endpoint calls.
+
+While an endpoint is scaling up or saturated, sending it more concurrent
+requests only makes every one of them slower. Each endpoint gets an
+adaptive concurrency limit (AIMD): it grows by about one request per
+round trip while latency stays near its long-term baseline, and shrinks
+multiplicatively when latency rises well above it or the endpoint answers
+429/503 or times out. Requests over the limit wait in arrival order.
+
+When an endpoint keeps failing, a circuit breaker opens and requests fail
+fast with CircuitOpenError instead of waiting for a timeout. After a
+jittered, exponentially growing period it half-opens and lets a probe
+request through: success closes the circuit, failure opens it again.
+"""
+import asyncio
+import logging
+import time
+from collections import deque
+from contextlib import asynccontextmanager, contextmanager
+from typing import AsyncIterator, Iterator, Optional
+
+from backoff import ExponentialBackoff
+
+logger = logging.getLogger(__name__)
+
+# Responses meaning "send less", as opposed to plain failures
+OVERLOAD_STATUSES = (429, 503)
+
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an endpoint whose circuit is open"""
+
+    def __init__(self, endpoint: str, retry_after: float):
+        super().__init__(f"Endpoint {endpoint} is unavailable, retry in {retry_after:.0f}s")
+        self.endpoint = endpoint
+        self.retry_after = retry_after
+
+
+class _Slot:
+    """A request admitted by the limiter"""
+
+    __slots__ = ("started", "responded_at")
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.responded_at: Optional[float] = None
+
+    def sending(self):
+        """Restart the clock once local waiting is over, so only the exchange is timed"""
+        self.started = time.monotonic()
+
+    def responded(self):
+        """Mark the response as started; latency is measured up to here (e.g. for streams)"""
+        self.responded_at = time.monotonic()
+
+
+class AdaptiveLimiter:
+    """AIMD concurrency limit driven by latency and overload responses"""
+
+    def __init__(
+        self,
+        max_limit: int,
+        min_limit: int = 1,
+        initial: Optional[int] = None,
+        backoff: float = 0.9,
+        tolerance: float = 2.0,
+        smoothing: float = 0.2,
+        baseline_smoothing: float = 0.02,
+    ):
+        """
+        Args:
+            max_limit: Upper bound for the limit
+            min_limit: Lower bound for the limit
+            initial: Starting limit; defaults to half of `max_limit`
+            backoff: Factor the limit is multiplied by on overload
+            tolerance: Ratio of recent to baseline latency counted as overload
+            smoothing: EWMA weight of a new sample in the recent latency
+            baseline_smoothing: EWMA weight of a new sample in the baseline
+        """
+        self.max_limit = max_limit
+        self.min_limit = min(min_limit, max_limit)
+        if initial is None:
+            initial = max_limit // 2
+        self.limit = float(max(self.min_limit, min(max_limit, initial)))
+        self.backoff = backoff
+        self.tolerance = tolerance
+        self.smoothing = smoothing
+        self.baseline_smoothing = baseline_smoothing
+        self.in_flight = 0
+        self._waiters: deque = deque()
+        self._latency: Optional[float] = None
+        self._baseline: Optional[float] = None
+        self._decreased_at = 0.0
+
+        self.queued = 0
+        self.overloads = 0
+        self.decreases = 0
+
+    def _wake(self):
+        while self._waiters and self.in_flight < int(self.limit):
+            future = self._waiters.popleft()
+            if not future.done():
+                self.in_flight += 1
+                future.set_result(None)
+
+    async def acquire(self):
+        """Wait until a request may be sent"""
+        while self._waiters and self._waiters[0].done():
+            self._waiters.popleft()
+        if not self._waiters and self.in_flight < int(self.limit):
+            self.in_flight += 1
+            return
+        self.queued += 1
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Cancelled after being handed a slot; pass it on
+                self.in_flight -= 1
+                self._wake()
+            raise
+
+    def release(self, started: float, latency: Optional[float] = None, overloaded: bool = False):
+        """
+        Finish a request and adapt the limit to its outcome.
+
+        Args:
+            started: When the request was admitted
+            latency: Latency of a successful request; None to learn nothing
+            overloaded: Whether the endpoint signalled overload
+        """
+        self.in_flight -= 1
+        if overloaded:
+            self.overloads += 1
+            self._decrease(started)
+        elif latency is not None:
+            self._observe(started, latency)
+        self._wake()
+
+    def _observe(self, started: float, latency: float):
+        if self._latency is None:
+            self._latency = self._baseline = latency
+            return
+        self._latency += self.smoothing * (latency - self._latency)
+        self._baseline += self.baseline_smoothing * (latency - self._baseline)
+        if self._latency > self.tolerance * self._baseline:
+            self._decrease(started)
+        elif self.in_flight + 1 >= self.limit / 2:
+            # Only grow a limit that is actually being used; +1/limit per
+            # success is about +1 per round trip
+            self.limit = min(self.max_limit, self.limit + 1.0 / self.limit)
+
+    def _decrease(self, started: float):
+        # Requests sent before the last decrease saw the same congestion;
+        # react once per episode rather than once per request
+        if started < self._decreased_at:
+            return
+        self.limit = max(self.min_limit, self.limit * self.backoff)
+        self._decreased_at = time.monotonic()
+        self.decreases += 1
+
+    @asynccontextmanager
+    async def slot(self) -> AsyncIterator[_Slot]:
+        """
+        Hold a slot for one request, learning from its outcome.
+
+        Exceptions with a `status_code` in OVERLOAD_STATUSES, or with a
+        true `timed_out` attribute, count as overload.
+        """
+        await self.acquire()
+        slot = _Slot()
+        latency = None
+        overloaded = False
+        try:
+            yield slot
+        except Exception as e:
+            overloaded = (
+                getattr(e, "status_code", None) in OVERLOAD_STATUSES
+                or getattr(e, "timed_out", False)
+            )
+            raise
+        else:
+            latency = (slot.responded_at or time.monotonic()) - slot.started
+        finally:
+            self.release(slot.started, latency, overloaded)
+
+    def stats(self) -> dict:
+        """Current limit, load and latency estimates"""
+        return {
+            "limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "waiting": sum(1 for future in self._waiters if not future.done()),
+            "latency": round(self._latency, 3) if self._latency is not None else None,
+            "baseline_latency": round(self._baseline, 3) if self._baseline is not None else None,
+            "queued": self.queued,
+            "overloads": self.overloads,
+            "decreases": self.decreases,
+        }
+
+
+class CircuitBreaker:
+    """Fails fast while an endpoint is unhealthy, probing for recovery"""
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half_open"
+
+    def __init__(
+        self,
+        name: str,
+        failures: int = 5,
+        open_base: float = 30.0,
+        open_max: float = 300.0,
+        probes: int = 1,
+    ):
+        """
+        Args:
+            name: Endpoint name, for errors and logs
+            failures: Consecutive failures that open the circuit
+            open_base: Open period after the first opening, in seconds
+            open_max: Upper bound for the open period, in seconds
+            probes: Concurrent requests let through while half-open
+        """
+        self.name = name
+        self.failures = failures
+        self.open_base = open_base
+        self.probes = probes
+        self.state = self.CLOSED
+        self.backoff = ExponentialBackoff(open_base, open_max)
+        self._failures = 0
+        self._open_until = 0.0
+        self._probing = 0
+
+        self.opened = 0
+        self.rejected = 0
+
+    def _admit(self) -> bool:
+        if self.state == self.CLOSED:
+            return False
+        now = time.monotonic()
+        if self.state == self.OPEN:
+            if now < self._open_until:
+                self.rejected += 1
+                raise CircuitOpenError(self.name, self._open_until - now)
+            self.state = self.HALF_OPEN
+            logger.info(f"Circuit for {self.name} half-open, probing")
+        if self._probing >= self.probes:
+            self.rejected += 1
+            raise CircuitOpenError(self.name, 0.0)
+        self._probing += 1
+        return True
+
+    def _success(self):
+        self._failures = 0
+        if self.state == self.HALF_OPEN:
+            self.state = self.CLOSED
+            self.backoff.reset()
+            logger.info(f"Circuit for {self.name} closed")
+
+    def _failure(self, error: Exception):
+        if self.state == self.OPEN:
+            return
+        self._failures += 1
+        if self.state == self.CLOSED and self._failures < self.failures:
+            return
+        period = self.backoff.next_delay(minimum=self.open_base / 2)
+        self.state = self.OPEN
+        self._open_until = time.monotonic() + period
+        self._failures = 0
+        self.opened += 1
+        logger.warning(f"Circuit for {self.name} open for {period:.0f}s after: {error}")
+
+    @contextmanager
+    def guard(self) -> Iterator[None]:
+        """
+        Admit one request, recording its outcome.
+
+        Failures are classified as in EndpointPool.route: 429, 5xx and
+        errors without a status; other statuses mean the endpoint is up.
+
+        Raises:
+            CircuitOpenError: If the circuit is open, or half-open with
+                every probe slot taken
+        """
+        probe = self._admit()
+        try:
+            yield
+        except Exception as e:
+            status = getattr(e, "status_code", None)
+            if status is None or status == 429 or status >= 500:
+                self._failure(e)
+            else:
+                self._success()
+            raise
+        else:
+            self._success()
+        finally:
+            if probe:
+                self._probing -= 1
+
+    def stats(self) -> dict:
+        """Breaker state and counters"""
+        return {
+            "state": self.state,
+            "opened": self.opened,
+            "rejected": self.rejected,
+        }
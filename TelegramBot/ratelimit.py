@@ -0,0 +1,191 @@
+"""
+Outbound rate limiting for Telegram Bot API send calls.
+
+Telegram allows roughly 30 messages/s overall, 1 message/s per chat and
+20 messages/min per group. Exceeding these results in 429 flood-waits that
+stall every chat, so sends are paced through layered token buckets and
+queued (by sleeping) rather than dropped.
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+
+class TokenBucket:
+    """
+    Lazily refilled token bucket.
+
+    Tokens may go negative: a caller reserves a token immediately and then
+    sleeps for the returned delay, so waiters are served in arrival order
+    without a background refill task.
+    """
+
+    __slots__ = ("rate", "capacity", "tokens", "updated", "blocked_until")
+
+    def __init__(self, rate: float, capacity: float, now: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = now
+        self.blocked_until = 0.0
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def level(self, now: float) -> float:
+        """Current token level after refill"""
+        self._refill(now)
+        return self.tokens
+
+    def reserve(self, now: float) -> float:
+        """
+        Take one token.
+
+        Returns:
+            Seconds to wait before the token may be used
+        """
+        self._refill(now)
+        self.tokens -= 1
+        delay = -self.tokens / self.rate if self.tokens < 0 else 0.0
+        return max(delay, self.blocked_until - now)
+
+    def idle(self, now: float) -> bool:
+        """Whether the bucket is full and unblocked, i.e. safe to drop"""
+        return self.level(now) >= self.capacity and now >= self.blocked_until
+
+
+class ChatBuckets:
+    """Buckets for a single chat; groups also get a per-minute bucket"""
+
+    __slots__ = ("chat", "group", "last_used")
+
+    def __init__(self, chat: TokenBucket, group: Optional[TokenBucket], now: float):
+        self.chat = chat
+        self.group = group
+        self.last_used = now
+
+    def idle(self, now: float) -> bool:
+        return self.chat.idle(now) and (self.group is None or self.group.idle(now))
+
+
+class TelegramRateLimiter:
+    """Global, per-chat and per-group token buckets in front of Bot API sends"""
+
+    def __init__(
+        self,
+        global_rate: float = 30.0,
+        chat_rate: float = 1.0,
+        group_rate: float = 20.0 / 60.0,
+        group_burst: float = 20.0,
+        idle_ttl: float = 300.0,
+    ):
+        """
+        Args:
+            global_rate: Messages per second across all chats
+            chat_rate: Messages per second to a single chat
+            group_rate: Messages per second to a single group
+            group_burst: Messages a group bucket may send back to back
+            idle_ttl: Seconds after which an unused chat bucket is evicted
+        """
+        now = time.monotonic()
+        self.global_bucket = TokenBucket(global_rate, global_rate, now)
+        self.chat_rate = chat_rate
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.idle_ttl = idle_ttl
+        # Ordered by last use so idle buckets can be evicted from the front
+        self._chats: "OrderedDict[int, ChatBuckets]" = OrderedDict()
+
+        self.acquired = 0
+        self.throttled = 0
+        self.throttled_seconds = 0.0
+        self.flood_waits = 0
+
+    def _chat_buckets(self, chat_id: int, now: float) -> ChatBuckets:
+        buckets = self._chats.get(chat_id)
+        if buckets is None:
+            chat = TokenBucket(self.chat_rate, 1.0, now)
+            # Negative chat ids are groups, supergroups and channels
+            group = TokenBucket(self.group_rate, self.group_burst, now) if chat_id < 0 else None
+            buckets = self._chats[chat_id] = ChatBuckets(chat, group, now)
+        else:
+            buckets.last_used = now
+            self._chats.move_to_end(chat_id)
+        return buckets
+
+    def _evict_idle(self, now: float):
+        # Amortised O(1): only the least recently used buckets are inspected
+        while self._chats:
+            chat_id, buckets = next(iter(self._chats.items()))
+            if now - buckets.last_used < self.idle_ttl or not buckets.idle(now):
+                return
+            del self._chats[chat_id]
+
+    async def acquire(self, chat_id: Optional[int] = None):
+        """
+        Wait until a message may be sent.
+
+        Args:
+            chat_id: Target chat, or None to only apply the global limit
+        """
+        now = time.monotonic()
+        self._evict_idle(now)
+        delay = 0.0
+        if chat_id is not None:
+            buckets = self._chat_buckets(chat_id, now)
+            delay = buckets.chat.reserve(now)
+            if buckets.group is not None:
+                delay = max(delay, buckets.group.reserve(now))
+        if delay > 0:
+            # Take the global token only when the chat is ready to send so
+            # a throttled chat doesn't hold global capacity while it waits
+            await asyncio.sleep(delay)
+            now = time.monotonic()
+        global_delay = self.global_bucket.reserve(now)
+        if global_delay > 0:
+            await asyncio.sleep(global_delay)
+
+        self.acquired += 1
+        waited = delay + global_delay
+        if waited > 0:
+            self.throttled += 1
+            self.throttled_seconds += waited
+
+    def available(self) -> bool:
+        """Whether the global limit would let a message through right now"""
+        now = time.monotonic()
+        return self.global_bucket.level(now) >= 1 and now >= self.global_bucket.blocked_until
+
+    def flood_wait(self, retry_after: float, chat_id: Optional[int] = None):
+        """
+        Honour a 429 response by blocking the affected bucket.
+
+        Args:
+            retry_after: Seconds Telegram asked us to wait
+            chat_id: Chat the failed send was for, or None for the global bucket
+        """
+        self.flood_waits += 1
+        now = time.monotonic()
+        if chat_id is not None:
+            bucket = self._chat_buckets(chat_id, now).chat
+        else:
+            bucket = self.global_bucket
+        bucket.blocked_until = max(bucket.blocked_until, now + retry_after)
+        logger.warning(f"Telegram flood wait of {retry_after}s for chat {chat_id}")
+
+    def stats(self) -> dict:
+        """Bucket levels and throttling counters"""
+        now = time.monotonic()
+        return {
+            "global_tokens": round(self.global_bucket.level(now), 2),
+            "chat_buckets": len(self._chats),
+            "acquired": self.acquired,
+            "throttled": self.throttled,
+            "throttled_seconds": round(self.throttled_seconds, 2),
+            "flood_waits": self.flood_waits,
+        }
@@ -0,0 +1,197 @@
+"""
+Retries of transient failures for Bot API and serving endpoint calls.
+
+Timeouts, connection errors, 429 and 5xx responses are retried with
+jittered exponential backoff; anything else (4xx, an open circuit, bad
+responses) fails immediately. Retries are paid for from a budget that
+grows with the number of requests, so during an outage, when almost every
+call fails, retries add at most a fixed fraction of extra load instead of
+multiplying it by the number of attempts. A retry that could not start
+before the current update's deadline is not attempted.
+"""
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Optional, TypeVar
+
+import httpx
+
+import deadline
+from backoff import ExponentialBackoff
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Statuses worth retrying; other 4xx mean the request itself is wrong
+RETRYABLE_STATUSES = frozenset({408, 429, 500, 502, 503, 504})
+
+
+class TransientError(Exception):
+    """A retryable failure that arrived as a response rather than an exception"""
+
+    def __init__(
+        self,
+        message: str,
+        status_code: Optional[int] = None,
+        retry_after: Optional[float] = None,
+        response: Optional[httpx.Response] = None,
+    ):
+        super().__init__(message)
+        self.status_code = status_code
+        self.retry_after = retry_after
+        self.response = response
+
+
+def parse_retry_after(response: httpx.Response) -> Optional[float]:
+    """Seconds from a Retry-After header; only the delay-seconds form is honoured"""
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+def is_retryable(error: BaseException) -> bool:
+    """
+    Whether a failed call may succeed if repeated.
+
+    Errors carrying a `status_code` are retryable if it is in
+    RETRYABLE_STATUSES; errors without one only if they are transport
+    errors or flag themselves `transient`.
+    """
+    if isinstance(error, httpx.TransportError):
+        return True
+    status = getattr(error, "status_code", None)
+    if status is not None:
+        return status in RETRYABLE_STATUSES
+    return isinstance(error, TransientError) or getattr(error, "transient", False)
+
+
+class RetryBudget:
+    """Allows retries for a fraction of requests, plus a small steady allowance"""
+
+    def __init__(self, ratio: float = 0.1, min_per_second: float = 1.0, burst: float = 10.0):
+        """
+        Args:
+            ratio: Retries allowed per request, e.g. 0.1 for 10% extra load
+            min_per_second: Retries allowed per second regardless of traffic,
+                so a quiet bot can still retry
+            burst: Maximum retries that can be saved up
+        """
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self.burst = burst
+        self._tokens = burst
+        self._updated = time.monotonic()
+
+        self.requests = 0
+        self.retries = 0
+        self.exhausted = 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._updated) * self.min_per_second)
+        self._updated = now
+
+    def deposit(self):
+        """Record a new request"""
+        self._refill()
+        self.requests += 1
+        self._tokens = min(self.burst, self._tokens + self.ratio)
+
+    def withdraw(self) -> bool:
+        """Take one retry; False if the budget is spent"""
+        self._refill()
+        if self._tokens < 1.0:
+            self.exhausted += 1
+            return False
+        self._tokens -= 1.0
+        self.retries += 1
+        return True
+
+    def stats(self) -> dict:
+        """Request, retry and refusal counters"""
+        return {
+            "requests": self.requests,
+            "retries": self.retries,
+            "exhausted": self.exhausted,
+            "retry_ratio": self.retries / self.requests if self.requests else 0.0,
+        }
+
+
+class RetryPolicy:
+    """Jittered exponential backoff for retryable errors, within a budget"""
+
+    def __init__(
+        self,
+        attempts: int = 3,
+        base: float = 0.25,
+        max_delay: float = 10.0,
+        budget: Optional[RetryBudget] = None,
+        sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+    ):
+        """
+        Args:
+            attempts: Maximum attempts per request, including the first
+            base: Backoff ceiling after the first failure, in seconds
+            max_delay: Longest wait before a retry; a server asking for a
+                longer `retry_after` is not retried
+            budget: Shared retry budget; None allows every retry
+            sleep: Waits out the delay before a retry
+        """
+        self.attempts = attempts
+        self.base = base
+        self.max_delay = max_delay
+        self.budget = budget if budget is not None else RetryBudget(ratio=1.0, burst=float("inf"))
+        self.sleep = sleep
+
+    def request(self) -> ExponentialBackoff:
+        """Start a request; returns the backoff state to pass to retry_delay"""
+        self.budget.deposit()
+        return ExponentialBackoff(self.base, self.max_delay)
+
+    def retry_delay(self, backoff: ExponentialBackoff, error: BaseException) -> Optional[float]:
+        """
+        Decide whether to retry after a failed attempt.
+
+        Args:
+            backoff: The state returned by request()
+            error: The attempt's failure
+
+        Returns:
+            Seconds to wait before the next attempt, or None to give up
+        """
+        if backoff.failures + 1 >= self.attempts or not is_retryable(error):
+            return None
+        retry_after = getattr(error, "retry_after", None) or 0.0
+        if retry_after > self.max_delay:
+            return None
+        delay = backoff.next_delay(minimum=retry_after)
+        left = deadline.remaining()
+        if left is not None and delay >= left:
+            return None
+        if not self.budget.withdraw():
+            return None
+        return delay
+
+    async def run(self, call: Callable[[], Awaitable[T]]) -> T:
+        """
+        Call `call()` until it succeeds or the failure should not be retried.
+
+        Returns:
+            The result of the first successful attempt
+        """
+        backoff = self.request()
+        while True:
+            try:
+                return await call()
+            except Exception as e:
+                delay = self.retry_delay(backoff, e)
+                if delay is None:
+                    raise
+                logger.info(f"Retrying in {delay:.2f}s after: {e}")
+                await self.sleep(delay)
+
+    def stats(self) -> dict:
+        """Retry budget counters"""
+        return self.budget.stats()
@@ -0,0 +1,211 @@
+"""
+Load balancing across interchangeable serving endpoints.
+
+A pool is configured as a comma-separated list of endpoint names with
+optional weights, e.g. "llm-eu:3,llm-us:1". Each request goes to one
+member, picked either by power-of-two-choices over a latency EWMA
+weighted by outstanding requests, or by least outstanding requests.
+Members that keep failing with 5xx, 429 or connection errors are ejected
+for a jittered, exponentially growing period, then re-admitted on
+probation: one more failure ejects them again.
+"""
+import logging
+import random
+import time
+from contextlib import contextmanager
+from typing import Collection, Iterator, List, Optional, Tuple
+
+from backoff import ExponentialBackoff
+
+logger = logging.getLogger(__name__)
+
+# Supported member selection strategies
+ROUTING_STRATEGIES = ("p2c", "least_outstanding")
+
+
+def parse_endpoints(spec: str) -> List[Tuple[str, float]]:
+    """
+    Parse "name[:weight],..." into (name, weight) pairs.
+
+    Raises:
+        ValueError: If a weight is not a positive number
+    """
+    members = []
+    for part in spec.split(","):
+        name, _, weight = part.strip().partition(":")
+        if not name:
+            continue
+        weight = float(weight) if weight else 1.0
+        if weight <= 0:
+            raise ValueError(f"Endpoint weight must be positive: {part!r}")
+        members.append((name, weight))
+    return members
+
+
+class _Member:
+    __slots__ = (
+        "name", "weight", "outstanding", "ewma", "failures", "ejected_until",
+        "backoff", "requests", "errors", "ejections",
+    )
+
+    def __init__(self, name: str, weight: float, backoff: ExponentialBackoff):
+        self.name = name
+        self.weight = weight
+        self.outstanding = 0
+        # Latency EWMA in seconds; unmeasured members look fast so they get tried
+        self.ewma = 0.0
+        # Consecutive failures
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.backoff = backoff
+        self.requests = 0
+        self.errors = 0
+        self.ejections = 0
+
+
+class _Routed:
+    """The member a request was routed to"""
+
+    __slots__ = ("name", "responded_at")
+
+    def __init__(self, name: str):
+        self.name = name
+        self.responded_at: Optional[float] = None
+
+    def responded(self):
+        """Mark the response as started; latency is measured up to here (e.g. for streams)"""
+        self.responded_at = time.monotonic()
+
+
+class EndpointPool:
+    """Weighted pool of serving endpoints with outlier ejection"""
+
+    def __init__(
+        self,
+        members: List[Tuple[str, float]],
+        strategy: str = "p2c",
+        decay: float = 0.8,
+        eject_after: int = 3,
+        eject_base: float = 10.0,
+        eject_max: float = 300.0,
+    ):
+        """
+        Args:
+            members: (endpoint name, weight) pairs
+            strategy: One of ROUTING_STRATEGIES
+            decay: Weight of the previous EWMA value per latency sample
+            eject_after: Consecutive failures that eject a member
+            eject_base: Ejection period after the first ejection, in seconds
+            eject_max: Upper bound for the ejection period, in seconds
+        """
+        if strategy not in ROUTING_STRATEGIES:
+            raise ValueError(f"Unsupported routing strategy: {strategy}")
+        if not members:
+            raise ValueError("An endpoint pool needs at least one member")
+        self.strategy = strategy
+        self.decay = decay
+        self.eject_after = eject_after
+        self.eject_base = eject_base
+        self._members = [
+            _Member(name, weight, ExponentialBackoff(eject_base, eject_max))
+            for name, weight in members
+        ]
+
+    @property
+    def names(self) -> List[str]:
+        return [member.name for member in self._members]
+
+    def _cost(self, member: _Member) -> float:
+        if self.strategy == "least_outstanding":
+            return member.outstanding / member.weight
+        # Expected wait: latency scaled by the queue already sent there
+        return member.ewma * (member.outstanding + 1) / member.weight
+
+    def pick(self, avoid: Collection[str] = ()) -> _Member:
+        """
+        Choose the member for the next request.
+
+        Args:
+            avoid: Member names to skip if any other member is admitted,
+                e.g. the one a hedged request is already waiting on
+        """
+        now = time.monotonic()
+        admitted = [m for m in self._members if m.ejected_until <= now]
+        if avoid:
+            admitted = [m for m in admitted if m.name not in avoid] or admitted
+        if not admitted:
+            # Everything is ejected: fail open to the one due back soonest
+            return min(self._members, key=lambda m: m.ejected_until)
+        if len(admitted) == 1:
+            return admitted[0]
+        if self.strategy == "least_outstanding":
+            lowest = min(self._cost(m) for m in admitted)
+            return random.choice([m for m in admitted if self._cost(m) == lowest])
+        weights = [m.weight for m in admitted]
+        first, second = random.choices(admitted, weights=weights, k=2)
+        while second is first:
+            second = random.choices(admitted, weights=weights)[0]
+        return first if self._cost(first) <= self._cost(second) else second
+
+    @contextmanager
+    def route(self, avoid: Collection[str] = ()) -> Iterator[_Routed]:
+        """
+        Route one request, recording its outcome.
+
+        Exceptions carrying a `status_code` of 429 or 5xx, and exceptions
+        without a status (connection errors, timeouts) count as failures
+        of the member; other status codes are the caller's fault.
+
+        Args:
+            avoid: Member names to skip if possible
+
+        Yields:
+            The routed member; use its `name` as the endpoint
+        """
+        member = self.pick(avoid)
+        routed = _Routed(member.name)
+        member.outstanding += 1
+        member.requests += 1
+        started = time.monotonic()
+        try:
+            yield routed
+        except Exception as e:
+            status = getattr(e, "status_code", None)
+            if status is None or status == 429 or status >= 500:
+                self._failed(member, e)
+            raise
+        else:
+            latency = (routed.responded_at or time.monotonic()) - started
+            member.ewma = self.decay * member.ewma + (1 - self.decay) * latency
+            member.failures = 0
+            member.backoff.reset()
+        finally:
+            member.outstanding -= 1
+
+    def _failed(self, member: _Member, error: Exception):
+        member.errors += 1
+        member.failures += 1
+        if member.failures < self.eject_after or len(self._members) == 1:
+            return
+        period = member.backoff.next_delay(minimum=self.eject_base / 2)
+        member.ejected_until = time.monotonic() + period
+        member.ejections += 1
+        # On re-admission a single further failure ejects it again
+        member.failures = self.eject_after - 1
+        logger.warning(f"Ejecting endpoint {member.name} for {period:.0f}s after: {error}")
+
+    def stats(self) -> dict:
+        """Per-member load, latency and ejection counters"""
+        now = time.monotonic()
+        return {
+            member.name: {
+                "weight": member.weight,
+                "outstanding": member.outstanding,
+                "ewma_latency": round(member.ewma, 3),
+                "requests": member.requests,
+                "errors": member.errors,
+                "ejections": member.ejections,
+                "ejected": member.ejected_until > now,
+            }
+            for member in self._members
+        }
@@ -0,0 +1,272 @@
+"""
+Semantic response cache.
+
+Prompts are embedded and compared with previously answered prompts by
+cosine similarity, so paraphrases of a cached question can be answered
+without querying the model. Embeddings live in a preallocated float32
+matrix used as a ring buffer; lookups are a single matrix-vector product,
+restricted to the closest clusters of a coarse IVF index once the cache
+grows past a threshold.
+"""
+import asyncio
+import hashlib
+import logging
+import re
+import time
+from typing import Optional
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class HashingEmbedder:
+    """
+    Deterministic local embedder based on feature hashing.
+
+    Word unigrams and character trigrams are hashed into a fixed number of
+    dimensions. It needs no endpoint, so it's a stand-in for development
+    and tests; it captures lexical rather than semantic similarity.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def _bucket(self, feature: str) -> int:
+        digest = hashlib.blake2b(feature.encode(), digest_size=8).digest()
+        return int.from_bytes(digest, "little") % self.dim
+
+    async def embed(self, text: str) -> np.ndarray:
+        vector = np.zeros(self.dim, dtype=np.float32)
+        words = _TOKEN_RE.findall(text.casefold())
+        for word in words:
+            vector[self._bucket("w:" + word)] += 1.0
+            padded = f" {word} "
+            for i in range(len(padded) - 2):
+                vector[self._bucket("c:" + padded[i:i + 3])] += 0.5
+        return vector
+
+
+class EndpointEmbedder:
+    """Embeds text with a Databricks embeddings serving endpoint"""
+
+    def __init__(self, serving, endpoint: str):
+        """
+        Args:
+            serving: The AsyncServingClient to query through
+            endpoint: Name of the embeddings serving endpoint
+        """
+        self.serving = serving
+        self.endpoint = endpoint
+
+    async def embed(self, text: str) -> np.ndarray:
+        data = await self.serving.query(self.endpoint, {"input": [text]})
+        return np.asarray(data["data"][0]["embedding"], dtype=np.float32)
+
+
+class SemanticCache:
+    """Nearest-neighbour cache of answers keyed by prompt embedding"""
+
+    def __init__(
+        self,
+        dim: int,
+        max_entries: int = 100_000,
+        threshold: float = 0.92,
+        ttl: float = 3600.0,
+        ann_threshold: int = 50_000,
+        ann_probes: int = 8,
+    ):
+        """
+        Args:
+            dim: Embedding dimensionality
+            max_entries: Capacity; the oldest entry is overwritten when full
+            threshold: Minimum cosine similarity for a hit
+            ttl: Seconds an entry stays valid
+            ann_threshold: Entry count above which the IVF index is used
+            ann_probes: Number of clusters searched per IVF lookup
+        """
+        self.dim = dim
+        self.max_entries = max_entries
+        self.threshold = threshold
+        self.ttl = ttl
+        self.ann_threshold = ann_threshold
+        self.ann_probes = ann_probes
+
+        # Grown by doubling up to max_entries; rows are unit-normalised
+        self._vectors = np.zeros((min(1024, max_entries), dim), dtype=np.float32)
+        self._expires = np.zeros(len(self._vectors), dtype=np.float64)
+        self._answers: list = [None] * len(self._vectors)
+        self._next = 0
+        self.size = 0
+
+        # IVF index: centroids and the cluster of each slot (-1 = unassigned)
+        self._centroids: Optional[np.ndarray] = None
+        self._assign = np.full(len(self._vectors), -1, dtype=np.int32)
+        self._indexed_size = 0
+        self._building = False
+        self._added = 0
+
+        self.version = ""
+        self.hits = 0
+        self.misses = 0
+
+    def reset(self, version: str = ""):
+        """Drop every entry, e.g. after the served model changed"""
+        self._expires[:] = 0.0
+        self._answers = [None] * len(self._vectors)
+        self._assign[:] = -1
+        self._centroids = None
+        self._next = 0
+        self.size = 0
+        self._indexed_size = 0
+        self.version = version
+
+    @staticmethod
+    def _normalize(vector: np.ndarray) -> Optional[np.ndarray]:
+        norm = float(np.linalg.norm(vector))
+        if norm == 0.0:
+            return None
+        return (vector / norm).astype(np.float32, copy=False)
+
+    def _grow(self):
+        capacity = min(self.max_entries, len(self._vectors) * 2)
+        extra = capacity - len(self._vectors)
+        self._vectors = np.vstack([self._vectors, np.zeros((extra, self.dim), dtype=np.float32)])
+        self._expires = np.concatenate([self._expires, np.zeros(extra)])
+        self._assign = np.concatenate([self._assign, np.full(extra, -1, dtype=np.int32)])
+        self._answers.extend([None] * extra)
+
+    def lookup(self, vector: np.ndarray) -> Optional[str]:
+        """
+        Return the cached answer most similar to `vector`, if similar enough.
+
+        Args:
+            vector: Embedding of the incoming prompt
+        """
+        query = self._normalize(vector)
+        if query is None or self.size == 0:
+            self.misses += 1
+            return None
+
+        if self._centroids is not None and self.size > self.ann_threshold:
+            probes = np.argsort(self._centroids @ query)[-self.ann_probes:]
+            # Unassigned slots (added since the last rebuild) are always searched
+            candidates = np.flatnonzero(
+                np.isin(self._assign[:self.size], probes) | (self._assign[:self.size] < 0)
+            )
+            scores = self._vectors[candidates] @ query
+        else:
+            candidates = None
+            scores = self._vectors[:self.size] @ query
+
+        now = time.monotonic()
+        best = int(np.argmax(scores)) if len(scores) else -1
+        if best >= 0 and scores[best] >= self.threshold:
+            slot = best if candidates is None else int(candidates[best])
+            if self._expires[slot] > now:
+                self.hits += 1
+                return self._answers[slot]
+        self.misses += 1
+        return None
+
+    def add(self, vector: np.ndarray, answer: str):
+        """
+        Cache `answer` for the prompt embedded as `vector`.
+
+        Args:
+            vector: Embedding of the answered prompt
+            answer: The model's answer
+        """
+        row = self._normalize(vector)
+        if row is None:
+            return
+        slot = self._next
+        if slot >= len(self._vectors):
+            self._grow()
+        self._vectors[slot] = row
+        self._expires[slot] = time.monotonic() + self.ttl
+        self._answers[slot] = answer
+        self._assign[slot] = (
+            int(np.argmax(self._centroids @ row)) if self._centroids is not None else -1
+        )
+        self._next = (slot + 1) % self.max_entries
+        self.size = min(self.size + 1, self.max_entries)
+        self._added += 1
+
+    @property
+    def index_due(self) -> bool:
+        """Whether the IVF index should be (re)built"""
+        return (
+            not self._building
+            and self.size > self.ann_threshold
+            and self.size >= 2 * max(self._indexed_size, 1)
+        )
+
+    async def build_index(self):
+        """
+        (Re)build the IVF index in a worker thread.
+
+        Entries added while the index is being built are marked unassigned,
+        which keeps them searchable on every lookup until the next rebuild.
+        """
+        if self._building:
+            return
+        self._building = True
+        started = time.perf_counter()
+        size, added = self.size, self._added
+        try:
+            centroids, assign = await asyncio.to_thread(
+                _cluster, self._vectors[:size], max(1, int(np.sqrt(size)))
+            )
+        finally:
+            self._building = False
+        if self.size < size:
+            # The cache was reset while building
+            return
+        self._assign[:size] = assign
+        for i in range(min(self._added - added, self.size)):
+            self._assign[(self._next - 1 - i) % self.max_entries] = -1
+        self._centroids = centroids
+        self._indexed_size = size
+        logger.info(
+            f"Built semantic cache index: {len(centroids)} clusters over {size} entries "
+            f"in {time.perf_counter() - started:.2f}s"
+        )
+
+    def stats(self) -> dict:
+        """Size and hit/miss counters"""
+        lookups = self.hits + self.misses
+        return {
+            "entries": self.size,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "indexed": self._centroids is not None,
+        }
+
+
+def _cluster(vectors: np.ndarray, clusters: int, iterations: int = 5) -> tuple:
+    """
+    Spherical k-means on a sample of `vectors`.
+
+    Returns:
+        (centroids, cluster index of every row of `vectors`)
+    """
+    rng = np.random.default_rng(0)
+    sample = vectors[rng.choice(len(vectors), size=min(len(vectors), clusters * 32), replace=False)]
+    centroids = sample[rng.choice(len(sample), size=clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        for c in range(clusters):
+            members = sample[assign == c]
+            if len(members):
+                mean = members.sum(axis=0)
+                centroids[c] = mean / (np.linalg.norm(mean) or 1.0)
+    # Assign in blocks to bound the temporary similarity matrix
+    assign = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), 65536):
+        block = vectors[start:start + 65536]
+        assign[start:start + len(block)] = np.argmax(block @ centroids.T, axis=1)
+    return centroids, assign
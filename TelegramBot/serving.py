@@ -0,0 +1,425 @@
+"""
+Async client for Databricks Model Serving endpoints.
+
+The Databricks SDK's `serving_endpoints.query` is synchronous, so calling it
+from the poller blocks the whole event loop for the duration of inference.
+This client talks to the serving invocations REST API directly over httpx,
+reusing the WorkspaceClient's auth, so many inferences can be outstanding
+on one event loop at once.
+
+An endpoint name may also refer to a registered EndpointPool, in which
+case each request is routed to one of the pool's members. Every request
+to an endpoint passes its circuit breaker and adaptive concurrency limit
+(see overload.py). Transient failures are retried according to an optional
+RetryPolicy; a retry avoids the pool members already tried. Requests made
+while processing an update never wait past the update's deadline.
+"""
+import asyncio
+import json
+import logging
+import time
+from contextlib import asynccontextmanager, nullcontext
+from typing import AsyncIterator, Dict, List, Optional
+
+import httpx
+from databricks.sdk import WorkspaceClient
+
+import deadline
+from hedging import Hedger
+from overload import AdaptiveLimiter, CircuitBreaker
+from retry import RetryPolicy, parse_retry_after
+from routing import EndpointPool, parse_endpoints
+
+logger = logging.getLogger(__name__)
+
+
+class ServingError(Exception):
+    """Raised when a serving endpoint call fails"""
+
+    def __init__(
+        self,
+        message: str,
+        status_code: Optional[int] = None,
+        timed_out: bool = False,
+        retry_after: Optional[float] = None,
+    ):
+        super().__init__(message)
+        self.status_code = status_code
+        self.timed_out = timed_out
+        self.retry_after = retry_after
+
+    @property
+    def transient(self) -> bool:
+        """Whether the request failed in transport (no response at all)"""
+        return self.status_code is None
+
+
+class AsyncServingClient:
+    """Non-blocking client for the serving endpoint invocations API"""
+
+    def __init__(
+        self,
+        workspace_client: WorkspaceClient,
+        max_in_flight: int = 32,
+        timeout: float = 120.0,
+        version_ttl: float = 60.0,
+        version_retry: float = 10.0,
+        hedger: Optional[Hedger] = None,
+        min_in_flight: int = 1,
+        latency_tolerance: float = 2.0,
+        breaker_failures: int = 5,
+        breaker_open: float = 30.0,
+        retry: Optional[RetryPolicy] = None,
+    ):
+        """
+        Args:
+            workspace_client: Client whose config provides host and auth
+            max_in_flight: Maximum number of concurrent endpoint requests,
+                overall and the upper bound of each endpoint's adaptive limit
+            timeout: Per-request timeout in seconds
+            version_ttl: Seconds to reuse a looked-up served model version
+            version_retry: Seconds to wait before looking up a version again
+                after a failed lookup
+            hedger: Optional policy for hedging slow (non-streaming) queries
+            min_in_flight: Lower bound of each endpoint's adaptive limit
+            latency_tolerance: Latency over this multiple of an endpoint's
+                baseline lowers its limit
+            breaker_failures: Consecutive failures that open an endpoint's
+                circuit (0 disables circuit breaking)
+            breaker_open: First open period of a circuit, in seconds
+            retry: Optional policy for retrying transient failures
+        """
+        self.config = workspace_client.config
+        self.max_in_flight = max_in_flight
+        self.timeout = timeout
+        self.version_ttl = version_ttl
+        self.version_retry = version_retry
+        # endpoint -> (version, expires_at)
+        self._versions: dict = {}
+        # Pool spec -> EndpointPool
+        self.pools: Dict[str, EndpointPool] = {}
+        self.hedger = hedger
+        self.retry = retry
+        # Endpoint -> endpoint that hedges go to; by default the same
+        # endpoint (another pool member if it is a pool)
+        self.hedge_endpoints: Dict[str, str] = {}
+        self.min_in_flight = min_in_flight
+        self.latency_tolerance = latency_tolerance
+        self.breaker_failures = breaker_failures
+        self.breaker_open = breaker_open
+        # Endpoint -> AdaptiveLimiter / CircuitBreaker, created on first use
+        self.limiters: Dict[str, AdaptiveLimiter] = {}
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._semaphore = asyncio.Semaphore(max_in_flight)
+        self._in_flight = 0
+        self.client = httpx.AsyncClient(
+            timeout=httpx.Timeout(timeout, connect=10.0),
+            limits=httpx.Limits(
+                max_connections=max_in_flight,
+                max_keepalive_connections=max_in_flight,
+            ),
+        )
+
+    @property
+    def in_flight(self) -> int:
+        """Number of endpoint requests currently outstanding"""
+        return self._in_flight
+
+    def register_endpoints(self, spec: str, **pool_options) -> str:
+        """
+        Register a pool for an endpoint spec such as "llm-a:3,llm-b:1".
+
+        Args:
+            spec: One endpoint name, or comma-separated names with optional weights
+            **pool_options: EndpointPool options (strategy, eject_after, ...)
+
+        Returns:
+            The name to pass as `endpoint`: the spec itself, which for a
+            single unweighted endpoint is just its name
+        """
+        if spec in self.pools:
+            return spec
+        members = parse_endpoints(spec)
+        if len(members) > 1 or ":" in spec:
+            self.pools[spec] = EndpointPool(members, **pool_options)
+        return spec
+
+    @asynccontextmanager
+    async def _guarded(self, endpoint: str) -> AsyncIterator:
+        # Circuit breaker, then the endpoint's adaptive limit, then the
+        # client-wide cap; yields the limiter slot for latency marking and
+        # the auth headers. Waiting for the cap and for auth is local, so
+        # the slot's latency clock starts after it
+        limiter = self.limiters.get(endpoint)
+        if limiter is None:
+            limiter = self.limiters[endpoint] = AdaptiveLimiter(
+                self.max_in_flight,
+                min_limit=self.min_in_flight,
+                tolerance=self.latency_tolerance,
+            )
+        breaker = self.breakers.get(endpoint)
+        if breaker is None and self.breaker_failures > 0:
+            breaker = self.breakers[endpoint] = CircuitBreaker(
+                endpoint, failures=self.breaker_failures, open_base=self.breaker_open
+            )
+        with breaker.guard() if breaker is not None else nullcontext():
+            async with limiter.slot() as slot:
+                async with self._semaphore:
+                    self._in_flight += 1
+                    try:
+                        headers = await self._auth_headers()
+                        slot.sending()
+                        yield slot, headers
+                    finally:
+                        self._in_flight -= 1
+
+    def stats(self) -> dict:
+        """Overall load and each endpoint's concurrency limit and circuit state"""
+        return {
+            "in_flight": self.in_flight,
+            "max_in_flight": self.max_in_flight,
+            "endpoints": {
+                endpoint: {
+                    **limiter.stats(),
+                    "circuit": (
+                        self.breakers[endpoint].stats() if endpoint in self.breakers else None
+                    ),
+                }
+                for endpoint, limiter in self.limiters.items()
+            },
+        }
+
+    def _request_timeout(self):
+        # Don't wait on the endpoint past the current update's deadline
+        left = deadline.remaining()
+        if left is None or left >= self.timeout:
+            return httpx.USE_CLIENT_DEFAULT
+        left = max(0.0, left)
+        return httpx.Timeout(left, connect=min(10.0, left))
+
+    def invocations_url(self, endpoint: str) -> str:
+        host = self.config.host.rstrip("/")
+        return f"{host}/serving-endpoints/{endpoint}/invocations"
+
+    async def model_version(self, endpoint: str) -> str:
+        """
+        Identify the model(s) currently served by an endpoint.
+
+        The result changes whenever the endpoint is redeployed with a new
+        config or model version, so it can be used to invalidate cached
+        answers. Lookups are cached for `version_ttl` seconds, failed ones
+        for `version_retry` seconds.
+
+        Args:
+            endpoint: The serving endpoint name
+
+        Returns:
+            An opaque version string, or "" if it could not be determined
+        """
+        pool = self.pools.get(endpoint)
+        if pool is not None:
+            versions = await asyncio.gather(*(self.model_version(name) for name in pool.names))
+            return "|".join(versions)
+
+        cached = self._versions.get(endpoint)
+        now = time.monotonic()
+        if cached is not None and now < cached[1]:
+            return cached[0]
+
+        host = self.config.host.rstrip("/")
+        try:
+            headers = await self._auth_headers()
+            response = await self.client.get(
+                f"{host}/api/2.0/serving-endpoints/{endpoint}", headers=headers
+            )
+            response.raise_for_status()
+            config = response.json().get("config", {})
+        except (httpx.HTTPError, ValueError) as e:
+            logger.warning(f"Could not look up served model version for {endpoint}: {e}")
+            # Keep using the last known version rather than disabling caching,
+            # and don't pay for another lookup on every prompt
+            version = cached[0] if cached is not None else ""
+            self._versions[endpoint] = (version, now + self.version_retry)
+            return version
+
+        served = [
+            f"{entity.get('entity_name')}@{entity.get('entity_version')}"
+            for entity in config.get("served_entities", [])
+        ] or [
+            f"{model.get('model_name')}@{model.get('model_version')}"
+            for model in config.get("served_models", [])
+        ]
+        version = f"{config.get('config_version', '')}:{','.join(sorted(served))}"
+        self._versions[endpoint] = (version, now + self.version_ttl)
+        return version
+
+    async def _auth_headers(self) -> dict:
+        # Token refresh (e.g. OAuth for the App's service principal) may
+        # perform blocking HTTP, so keep it off the event loop.
+        return await asyncio.to_thread(self.config.authenticate)
+
+    async def query(self, endpoint: str, payload: dict) -> dict:
+        """
+        Send a raw payload to a serving endpoint.
+
+        Args:
+            endpoint: The serving endpoint name (or registered pool spec)
+            payload: The JSON request body
+
+        Returns:
+            The decoded JSON response
+        """
+        # Pool members already tried, which hedges and retries avoid
+        picked: List[str] = []
+
+        async def attempt() -> dict:
+            if self.hedger is None:
+                return await self._route(endpoint, payload, picked)
+            secondary = self.hedge_endpoints.get(endpoint, endpoint)
+            return await self.hedger.run(
+                lambda: self._route(endpoint, payload, picked),
+                lambda: self._route(secondary, payload, picked),
+            )
+
+        if self.retry is None:
+            return await attempt()
+        return await self.retry.run(attempt)
+
+    async def _route(self, endpoint: str, payload: dict, picked: Optional[List[str]] = None) -> dict:
+        pool = self.pools.get(endpoint)
+        if pool is None:
+            return await self._post(endpoint, payload)
+        with pool.route(avoid=picked or ()) as member:
+            if picked is not None:
+                picked.append(member.name)
+            return await self._post(member.name, payload)
+
+    async def _post(self, endpoint: str, payload: dict) -> dict:
+        async with self._guarded(endpoint) as (_, headers):
+            try:
+                response = await self.client.post(
+                    self.invocations_url(endpoint),
+                    json=payload,
+                    headers=headers,
+                    timeout=self._request_timeout(),
+                )
+            except httpx.TimeoutException as e:
+                raise ServingError(f"Request to {endpoint} timed out: {e}", timed_out=True) from e
+            except httpx.HTTPError as e:
+                raise ServingError(f"Request to {endpoint} failed: {e}") from e
+
+            if response.status_code >= 400:
+                raise ServingError(
+                    f"Endpoint {endpoint} returned {response.status_code}: {response.text[:200]}",
+                    status_code=response.status_code,
+                    retry_after=parse_retry_after(response),
+                )
+        return response.json()
+
+    async def chat(self, endpoint: str, messages: list, **params) -> str:
+        """
+        Query a chat endpoint and return the first choice's content.
+
+        Args:
+            endpoint: The serving endpoint name
+            messages: List of {"role": ..., "content": ...} dicts
+            **params: Extra generation parameters (max_tokens, temperature, ...)
+
+        Returns:
+            The model's reply text, or an empty string if there was none
+        """
+        data = await self.query(endpoint, {"messages": messages, **params})
+        choices = data.get("choices") or []
+        if not choices:
+            return ""
+        return choices[0].get("message", {}).get("content") or ""
+
+    async def stream_chat(self, endpoint: str, messages: list, **params) -> AsyncIterator[str]:
+        """
+        Query a chat endpoint with `stream=True` and yield content deltas.
+
+        The endpoint answers with server-sent events, one chat completion
+        chunk per `data:` line, terminated by `data: [DONE]`.
+
+        Args:
+            endpoint: The serving endpoint name
+            messages: List of {"role": ..., "content": ...} dicts
+            **params: Extra generation parameters (max_tokens, temperature, ...)
+
+        Yields:
+            Successive pieces of the model's reply text
+        """
+        picked: List[str] = []
+        backoff = self.retry.request() if self.retry is not None else None
+        while True:
+            streamed = False
+            try:
+                async for delta in self._route_stream(endpoint, messages, picked, **params):
+                    streamed = True
+                    yield delta
+                return
+            except Exception as e:
+                # Once text has been shown, a retry would repeat it
+                if streamed or backoff is None:
+                    raise
+                delay = self.retry.retry_delay(backoff, e)
+                if delay is None:
+                    raise
+                logger.info(f"Retrying stream in {delay:.2f}s after: {e}")
+                await self.retry.sleep(delay)
+
+    async def _route_stream(
+        self, endpoint: str, messages: list, picked: List[str], **params
+    ) -> AsyncIterator[str]:
+        pool = self.pools.get(endpoint)
+        if pool is None:
+            async for delta in self._stream(endpoint, messages, None, **params):
+                yield delta
+            return
+        with pool.route(avoid=picked) as member:
+            picked.append(member.name)
+            async for delta in self._stream(member.name, messages, member, **params):
+                yield delta
+
+    async def _stream(self, endpoint: str, messages: list, routed, **params) -> AsyncIterator[str]:
+        payload = {"messages": messages, "stream": True, **params}
+        async with self._guarded(endpoint) as (slot, headers):
+            try:
+                async with self.client.stream(
+                    "POST",
+                    self.invocations_url(endpoint),
+                    json=payload,
+                    headers=headers,
+                    timeout=self._request_timeout(),
+                ) as response:
+                    if response.status_code >= 400:
+                        body = (await response.aread()).decode(errors="replace")
+                        raise ServingError(
+                            f"Endpoint {endpoint} returned {response.status_code}: {body[:200]}",
+                            status_code=response.status_code,
+                            retry_after=parse_retry_after(response),
+                        )
+                    # Latency is measured to the start of the stream
+                    slot.responded()
+                    if routed is not None:
+                        routed.responded()
+                    async for line in response.aiter_lines():
+                        if not line.startswith("data:"):
+                            continue
+                        data = line[5:].strip()
+                        if data == "[DONE]":
+                            break
+                        choices = json.loads(data).get("choices") or []
+                        if choices:
+                            delta = choices[0].get("delta", {}).get("content")
+                            if delta:
+                                yield delta
+            except httpx.TimeoutException as e:
+                raise ServingError(
+                    f"Streaming request to {endpoint} timed out: {e}", timed_out=True
+                ) from e
+            except httpx.HTTPError as e:
+                raise ServingError(f"Streaming request to {endpoint} failed: {e}") from e
+
+    async def aclose(self):
+        await self.client.aclose()
@@ -0,0 +1,321 @@
+"""
+Multi-process sharding of update processing.
+
+Telegram allows a single getUpdates consumer per bot token, so one leader
+process receives every update and routes it to one of N worker processes
+by consistent hash of its chat. Each worker runs its own event loop and
+ChatDispatcher, so messages within a chat stay in order while CPU-bound
+work in different chats runs on different cores. Completions flow back to
+the leader, which keeps the ingestion limit and the update ledger.
+
+Each update is sent to its worker with the time the leader received it,
+so the worker's queue wait and deadline count time spent with the leader.
+
+Worker processes are started with the "spawn" method and build their own
+processing object from a picklable factory: `factory(index)` must return
+an object with a `dispatcher` (ChatDispatcher), an `on_processed`
+attribute that is called with each finished update_id, and async
+`start()`/`close()` methods, like TelegramPoller in "worker" mode.
+"""
+import asyncio
+import bisect
+import hashlib
+import logging
+import multiprocessing
+import queue
+import signal
+import time
+from typing import Callable, Dict, Hashable, Optional
+
+from dispatcher import chat_key
+
+logger = logging.getLogger(__name__)
+
+
+def _hash(value: str) -> int:
+    return int.from_bytes(hashlib.blake2b(value.encode(), digest_size=8).digest(), "big")
+
+
+class HashRing:
+    """Consistent hash ring: changing the shard count moves few chats"""
+
+    def __init__(self, shards: int, replicas: int = 100):
+        """
+        Args:
+            shards: Number of shards
+            replicas: Virtual nodes per shard; more gives a more even spread
+        """
+        points = sorted(
+            (_hash(f"{shard}:{replica}"), shard)
+            for shard in range(shards)
+            for replica in range(replicas)
+        )
+        self._hashes = [point for point, _ in points]
+        self._shards = [shard for _, shard in points]
+
+    def shard(self, key: Hashable) -> int:
+        """Shard owning `key`"""
+        index = bisect.bisect(self._hashes, _hash(repr(key)))
+        return self._shards[index % len(self._shards)]
+
+
+def _worker_main(index: int, factory: Callable, inbox, done):
+    # Shutdown is driven by the leader, not by a terminal's Ctrl+C
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_serve(index, factory, inbox, done))
+
+
+async def _serve(index: int, factory: Callable, inbox, done):
+    loop = asyncio.get_running_loop()
+    worker = factory(index)
+    worker.on_processed = lambda update_id: done.put((index, update_id))
+    await worker.start()
+    logger.info(f"Shard worker {index} started")
+    try:
+        while True:
+            item = await loop.run_in_executor(None, inbox.get)
+            if item is None:
+                break
+            update, received_at = item
+            # Count the time the update already spent with the leader
+            waited = max(0.0, time.time() - received_at)
+            worker.dispatcher.submit(update, received_at=time.monotonic() - waited)
+        await worker.dispatcher.join()
+    finally:
+        await worker.close()
+
+
+class _Shard:
+    __slots__ = ("process", "inbox", "in_flight", "dispatched", "restarts")
+
+    def __init__(self, inbox):
+        self.process: Optional[multiprocessing.Process] = None
+        self.inbox = inbox
+        # update_id -> update, for replay if the worker dies
+        self.in_flight: Dict[int, dict] = {}
+        self.dispatched = 0
+        self.restarts = 0
+
+
+class ShardedDispatcher:
+    """ChatDispatcher-compatible router to per-shard worker processes"""
+
+    def __init__(
+        self,
+        factory: Callable,
+        shards: int,
+        max_pending: int = 0,
+        on_done: Optional[Callable[[int], None]] = None,
+        stop_timeout: float = 10.0,
+    ):
+        """
+        Args:
+            factory: Picklable callable building a shard's worker object
+            shards: Number of worker processes
+            max_pending: Maximum updates routed but not finished (0 = unbounded)
+            on_done: Called in the leader with each finished update_id
+            stop_timeout: Seconds workers get to drain before being terminated
+        """
+        self.factory = factory
+        self.max_pending = max_pending
+        self.on_done = on_done
+        self.stop_timeout = stop_timeout
+        self._context = multiprocessing.get_context("spawn")
+        self._ring = HashRing(shards)
+        self._shards = [_Shard(self._context.Queue()) for _ in range(shards)]
+        self._done = self._context.Queue()
+        self._chats: Dict[Hashable, int] = {}
+        self._keys: Dict[int, Hashable] = {}
+        self._pending = 0
+        self._idle = asyncio.Event()
+        self._idle.set()
+        self._not_full = asyncio.Event()
+        self._not_full.set()
+        self._tasks: list = []
+        self._stopping = False
+
+        self.completed = 0
+        self.latency_total = 0.0
+        self._submitted_at: Dict[int, float] = {}
+
+    @property
+    def pending(self) -> int:
+        """Number of updates routed to workers and not yet finished"""
+        return self._pending
+
+    @property
+    def active_chats(self) -> int:
+        """Number of chats with unfinished updates"""
+        return len(self._chats)
+
+    @property
+    def full(self) -> bool:
+        """Whether the pending limit has been reached"""
+        return 0 < self.max_pending <= self._pending
+
+    def _spawn(self, index: int):
+        shard = self._shards[index]
+        shard.process = self._context.Process(
+            target=_worker_main,
+            args=(index, self.factory, shard.inbox, self._done),
+            name=f"shard-{index}",
+            daemon=True,
+        )
+        shard.process.start()
+
+    def start(self):
+        """Start the worker processes and the completion collector"""
+        if self._tasks:
+            return
+        for index in range(len(self._shards)):
+            self._spawn(index)
+        self._tasks = [
+            asyncio.create_task(self._collect()),
+            asyncio.create_task(self._monitor()),
+        ]
+        logger.info(f"Started {len(self._shards)} shard worker processes")
+
+    def submit(self, update: dict, key: Optional[Hashable] = None):
+        """
+        Route an update to its chat's shard, ignoring the depth limit.
+
+        Args:
+            update: The update dictionary from Telegram
+            key: Ordering key; defaults to the update's chat id
+        """
+        if key is None:
+            key = chat_key(update)
+        index = self._ring.shard(key)
+        shard = self._shards[index]
+        update_id = update["update_id"]
+        shard.in_flight[update_id] = update
+        self._keys[update_id] = key
+        self._chats[key] = self._chats.get(key, 0) + 1
+        self._submitted_at[update_id] = time.monotonic()
+        self._pending += 1
+        self._idle.clear()
+        if self.full:
+            self._not_full.clear()
+        self._send(shard, update_id)
+
+    def _send(self, shard: _Shard, update_id: int):
+        # Monotonic clocks aren't comparable across processes, so the
+        # receive time travels as wall-clock time
+        waited = time.monotonic() - self._submitted_at[update_id]
+        shard.inbox.put((shard.in_flight[update_id], time.time() - waited))
+
+    def offer(self, update: dict) -> bool:
+        """
+        Route an update if there is room.
+
+        Returns:
+            False if the queue is full and the update was not accepted
+        """
+        if self.full:
+            return False
+        self.submit(update)
+        return True
+
+    async def put(self, update: dict):
+        """Route an update, waiting for room if the queue is full"""
+        while self.full:
+            await self._not_full.wait()
+        self.submit(update)
+
+    def _finish(self, index: int, update_id: int):
+        shard = self._shards[index]
+        if shard.in_flight.pop(update_id, None) is None:
+            return
+        shard.dispatched += 1
+        key = self._keys.pop(update_id)
+        remaining = self._chats[key] - 1
+        if remaining:
+            self._chats[key] = remaining
+        else:
+            del self._chats[key]
+        self.completed += 1
+        self.latency_total += time.monotonic() - self._submitted_at.pop(update_id)
+        self._pending -= 1
+        if not self.full:
+            self._not_full.set()
+        if self._pending == 0:
+            self._idle.set()
+        if self.on_done is not None:
+            self.on_done(update_id)
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            item = await loop.run_in_executor(None, self._done.get)
+            if item is None:
+                return
+            self._finish(*item)
+
+    async def _monitor(self, interval: float = 1.0):
+        while not self._stopping:
+            await asyncio.sleep(interval)
+            for index, shard in enumerate(self._shards):
+                if self._stopping or shard.process.is_alive():
+                    continue
+                logger.error(
+                    f"Shard worker {index} exited with code {shard.process.exitcode}, "
+                    f"restarting and replaying {len(shard.in_flight)} updates"
+                )
+                shard.restarts += 1
+                # The old queue may have been left locked by the dead process
+                shard.inbox = self._context.Queue()
+                self._spawn(index)
+                for update_id in sorted(shard.in_flight):
+                    self._send(shard, update_id)
+
+    async def join(self):
+        """Wait until every routed update has been processed"""
+        await self._idle.wait()
+
+    async def stop(self):
+        """Let workers drain for up to `stop_timeout` seconds, then terminate them"""
+        self._stopping = True
+        for shard in self._shards:
+            if shard.process is not None:
+                shard.inbox.put(None)
+        loop = asyncio.get_running_loop()
+        deadline = time.monotonic() + self.stop_timeout
+        for shard in self._shards:
+            if shard.process is None:
+                continue
+            await loop.run_in_executor(
+                None, shard.process.join, max(0.0, deadline - time.monotonic())
+            )
+            if shard.process.is_alive():
+                shard.process.terminate()
+        # Collect completions reported before the workers exited
+        while True:
+            try:
+                item = self._done.get_nowait()
+            except queue.Empty:
+                break
+            if item is not None:
+                self._finish(*item)
+        self._done.put(None)
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        """Queue depth, completion latency and per-shard counters"""
+        return {
+            "pending": self._pending,
+            "active_chats": len(self._chats),
+            "dispatched": self.completed,
+            "avg_latency": self.latency_total / self.completed if self.completed else 0.0,
+            "shards": [
+                {
+                    "pending": len(shard.in_flight),
+                    "dispatched": shard.dispatched,
+                    "alive": shard.process is not None and shard.process.is_alive(),
+                    "restarts": shard.restarts,
+                }
+                for shard in self._shards
+            ],
+        }
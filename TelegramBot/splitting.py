@@ -0,0 +1,192 @@
+"""
+Splitting of long replies into messages Telegram accepts.
+
+sendMessage rejects texts over 4096 characters, so longer replies are sent
+as several messages. Breaks are placed at the latest paragraph, line,
+sentence or word boundary in the second half of each message, in that
+order of preference. Telegram's legacy Markdown entities (*bold*,
+_italic_, `code`, [links](url) and ``` code blocks) are located in one
+scan up front and never split: breaks are only placed outside them,
+except that a code block may be split at a line break, in which case it
+is closed at the end of one message and re-opened, with its language, at
+the start of the next.
+"""
+import bisect
+import re
+from typing import List, Optional, Tuple
+
+# Telegram rejects messages longer than this
+TELEGRAM_MAX_MESSAGE_LENGTH = 4096
+
+_MARKUP = re.compile(r"\\.|```|[`*_\[]", re.S)
+_LINK = re.compile(r"\[[^\]\n]*\]\([^)\s]*\)")
+# Language tag after an opening fence, e.g. "```python\n"
+_FENCE_LANGUAGE = re.compile(r"[\w+#.-]*\n")
+_PRE_CLOSE = "\n```"
+
+# Break separators by preference; a break drops the separator except for
+# the sentence's punctuation
+_BREAKS = (("\n\n",), ("\n",), (". ", "! ", "? "), (" ",))
+
+
+def _entities(text: str) -> Tuple[List[Tuple[int, int, str]], List[Tuple[int, int, str]]]:
+    # (start, end, marker) of inline entities and (start, end, opener) of
+    # code blocks, in order. Unclosed markers are left alone; Telegram
+    # rejects such text whether or not it is split.
+    inline = []
+    pre = []
+    pos = 0
+    while True:
+        match = _MARKUP.search(text, pos)
+        if match is None:
+            break
+        token = match.group()
+        start = match.start()
+        pos = match.end()
+        if token[0] == "\\":
+            continue
+        if token == "```":
+            end = text.find("```", pos)
+            if end < 0:
+                break
+            language = _FENCE_LANGUAGE.match(text, pos, end)
+            opener = f"```{language.group()}" if language else "```"
+            pre.append((start, end + 3, opener))
+            pos = end + 3
+        elif token == "[":
+            link = _LINK.match(text, start)
+            if link is not None:
+                inline.append((start, link.end(), ""))
+                pos = link.end()
+        else:
+            end = text.find(token, pos)
+            if end >= 0:
+                inline.append((start, end + 1, token))
+                pos = end + 1
+    return inline, pre
+
+
+def _containing(spans: List[Tuple[int, int, str]], starts: List[int], pos: int) -> Optional[tuple]:
+    # The span strictly containing `pos`, if any
+    index = bisect.bisect_left(starts, pos) - 1
+    if index >= 0 and spans[index][1] > pos:
+        return spans[index]
+    return None
+
+
+class _Splitter:
+    def __init__(self, text: str, limit: int, markdown: bool):
+        self.text = text
+        self.limit = limit
+        self.inline, self.pre = _entities(text) if markdown else ([], [])
+        self.inline_starts = [span[0] for span in self.inline]
+        self.pre_starts = [span[0] for span in self.pre]
+
+    def _last_break(self, separators: tuple, low: int, high: int) -> Optional[tuple]:
+        # Latest valid break in [low, high): (cut, resume, suffix, prefix)
+        best = None
+        for separator in separators:
+            end = high
+            while True:
+                pos = self.text.rfind(separator, low, end)
+                if pos <= low or (best is not None and pos <= best[0]):
+                    break
+                span = _containing(self.inline, self.inline_starts, pos)
+                if span is not None:
+                    end = span[0]
+                    continue
+                cut = pos + 1 if separator[0] in ".!?" else pos
+                resume = pos + len(separator)
+                block = _containing(self.pre, self.pre_starts, pos)
+                if block is None:
+                    best = (cut, resume, "", "")
+                    break
+                start, stop, opener = block
+                # Inside a code block only line breaks that leave code on
+                # both sides of the break are usable
+                if (
+                    separator[0] == "\n"
+                    and start + len(opener) < pos < stop - 4
+                    and cut + len(_PRE_CLOSE) <= high
+                ):
+                    best = (cut, pos + 1, _PRE_CLOSE, opener)
+                    break
+                end = pos if separator[0] == "\n" else start
+        return best
+
+    def _hard_break(self, start: int, high: int) -> tuple:
+        # No boundary at all: cut mid-word, closing and re-opening any
+        # entity the cut falls into
+        block = _containing(self.pre, self.pre_starts, high)
+        if block is not None:
+            cut = max(start + 1, high - len(_PRE_CLOSE))
+            return cut, cut, _PRE_CLOSE, block[2]
+        span = _containing(self.inline, self.inline_starts, high)
+        if span is not None and span[2]:
+            # Prefer a word boundary inside the entity
+            pos = self.text.rfind(" ", max(start, span[0] + 1), high - 1)
+            if pos > start:
+                return pos, pos + 1, span[2], span[2]
+            cut = max(start + 1, high - 1)
+            return cut, cut, span[2], span[2]
+        return high, high, "", ""
+
+    def _skip_blank(self, pos: int) -> int:
+        # Leading line breaks would show as empty lines
+        while pos < len(self.text) and self.text[pos] == "\n":
+            pos += 1
+        return pos
+
+    def split(self) -> List[str]:
+        text = self.text
+        chunks = []
+        start = 0
+        prefix = ""
+        while True:
+            room = self.limit - len(prefix)
+            if len(text) - start <= room:
+                chunks.append(prefix + text[start:])
+                return chunks
+            high = start + room
+            found = None
+            for low in (start + room // 2, start):
+                for separators in _BREAKS:
+                    found = self._last_break(separators, low, high)
+                    if found is not None:
+                        break
+                if found is not None:
+                    break
+            if found is None:
+                found = self._hard_break(start, high)
+            cut, resume, suffix, next_prefix = found
+            chunks.append(prefix + text[start:cut].rstrip(" ") + suffix)
+            start = resume if next_prefix else self._skip_blank(resume)
+            prefix = next_prefix
+
+
+def split_message(
+    text: str, limit: int = TELEGRAM_MAX_MESSAGE_LENGTH, markdown: bool = True
+) -> List[str]:
+    """
+    Split text into parts of at most `limit` characters.
+
+    Args:
+        text: The message text
+        limit: Maximum length of a part
+        markdown: Whether the text uses legacy Markdown entities that must
+            stay intact; False splits at plain text boundaries only
+
+    Returns:
+        The parts, in order; a single part if the text already fits
+    """
+    if len(text) <= limit:
+        return [text]
+    parts = _Splitter(text, limit, markdown).split()
+    # Breaks next to runs of blank lines can leave parts with nothing to
+    # show, which sendMessage rejects
+    return [part for part in parts if part.strip()] or [text[:limit]]
+
+
+def markdown_rejected(result: dict) -> bool:
+    """Whether a Bot API response says the message's Markdown didn't parse"""
+    return "can't parse entities" in str(result.get("description", ""))
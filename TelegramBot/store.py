@@ -0,0 +1,246 @@
+"""
+Durable conversation log on SQLite.
+
+New turns are appended to an in-memory queue and written behind by a
+background task in batched transactions (group commit), so the request
+path never waits for the disk. The database runs in WAL mode with
+synchronous=NORMAL: commits append to the WAL without an fsync, which
+happens at checkpoints instead. All database work runs on one dedicated
+thread, which keeps the event loop free and the connection single-user.
+"""
+import asyncio
+import logging
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS turns (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    chat_id INTEGER NOT NULL,
+    role TEXT NOT NULL,
+    content TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS turns_chat ON turns (chat_id, id);
+CREATE INDEX IF NOT EXISTS turns_created ON turns (created_at);
+CREATE TABLE IF NOT EXISTS summaries (
+    chat_id INTEGER PRIMARY KEY,
+    content TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+"""
+
+
+class SQLiteConversationLog:
+    """Write-behind persistent log of conversation messages"""
+
+    def __init__(
+        self,
+        path: str,
+        flush_interval: float = 0.05,
+        max_batch: int = 1000,
+        retention: float = 30 * 86400.0,
+        keep_per_chat: int = 200,
+        prune_interval: float = 3600.0,
+    ):
+        """
+        Args:
+            path: SQLite database file
+            flush_interval: Maximum seconds a queued write waits to be committed
+            max_batch: Maximum operations per transaction
+            retention: Seconds after which messages are pruned
+            keep_per_chat: Maximum messages kept per chat when compacting
+            prune_interval: Seconds between prune/compaction passes
+        """
+        self.path = path
+        self.flush_interval = flush_interval
+        self.max_batch = max_batch
+        self.retention = retention
+        self.keep_per_chat = keep_per_chat
+        self.prune_interval = prune_interval
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="sqlite")
+        self._conn: Optional[sqlite3.Connection] = None
+        # ("add", chat_id, role, content, ts), ("clear", chat_id)
+        # or ("compact", chat_id, summary, keep)
+        self._queue: list = []
+        self._wake = asyncio.Event()
+        self._tasks: list = []
+
+        self.written = 0
+        self.commits = 0
+
+    async def _run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self._executor, fn, *args)
+
+    def _open(self):
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        # Wait for another connection's write or checkpoint instead of failing
+        conn.execute("PRAGMA busy_timeout=5000")
+        conn.executescript(SCHEMA)
+        self._conn = conn
+
+    async def start(self):
+        """Open the database and start the writer and pruner tasks"""
+        await self._run(self._open)
+        self._tasks = [
+            asyncio.create_task(self._writer()),
+            asyncio.create_task(self._pruner()),
+        ]
+        logger.info(f"Conversation log opened at {self.path}")
+
+    def append(self, chat_id: int, role: str, content: str):
+        """Queue a message for writing; never blocks"""
+        self._queue.append(("add", chat_id, role, content, time.time()))
+        if len(self._queue) >= self.max_batch:
+            self._wake.set()
+
+    def clear(self, chat_id: int):
+        """Queue deletion of a chat's messages"""
+        self._queue.append(("clear", chat_id))
+
+    def compact(self, chat_id: int, summary: str, keep: int):
+        """
+        Queue replacement of a chat's older messages by a summary.
+
+        Args:
+            chat_id: The Telegram chat ID
+            summary: Summary of the compacted messages
+            keep: Number of most recent messages that remain
+        """
+        self._queue.append(("compact", chat_id, summary, keep))
+
+    @property
+    def pending(self) -> int:
+        """Operations queued but not yet committed"""
+        return len(self._queue)
+
+    def _write(self, ops: list):
+        with self._conn:
+            for op in ops:
+                if op[0] == "add":
+                    self._conn.execute(
+                        "INSERT INTO turns (chat_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                        op[1:],
+                    )
+                elif op[0] == "compact":
+                    _, chat_id, summary, keep = op
+                    self._conn.execute(
+                        "INSERT OR REPLACE INTO summaries (chat_id, content, updated_at) VALUES (?, ?, ?)",
+                        (chat_id, summary, time.time()),
+                    )
+                    self._conn.execute(
+                        """
+                        DELETE FROM turns WHERE chat_id = ? AND id NOT IN (
+                            SELECT id FROM turns WHERE chat_id = ? ORDER BY id DESC LIMIT ?
+                        )
+                        """,
+                        (chat_id, chat_id, keep),
+                    )
+                else:
+                    self._conn.execute("DELETE FROM turns WHERE chat_id = ?", (op[1],))
+                    self._conn.execute("DELETE FROM summaries WHERE chat_id = ?", (op[1],))
+
+    async def flush(self):
+        """Commit everything queued so far"""
+        while self._queue:
+            ops, self._queue = self._queue[:self.max_batch], self._queue[self.max_batch:]
+            try:
+                await self._run(self._write, ops)
+            except sqlite3.Error as e:
+                logger.error(f"Failed to write {len(ops)} conversation log entries: {e}")
+                continue
+            self.written += len(ops)
+            self.commits += 1
+
+    async def _writer(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wake.wait(), timeout=self.flush_interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wake.clear()
+            await self.flush()
+
+    def _read(self, chat_id: int, limit: int) -> Tuple[str, List[tuple]]:
+        rows = self._conn.execute(
+            "SELECT role, content FROM turns WHERE chat_id = ? ORDER BY id DESC LIMIT ?",
+            (chat_id, limit),
+        ).fetchall()
+        rows.reverse()
+        summary = self._conn.execute(
+            "SELECT content FROM summaries WHERE chat_id = ?", (chat_id,)
+        ).fetchone()
+        return (summary[0] if summary else ""), rows
+
+    async def load(self, chat_id: int, limit: int) -> Tuple[str, List[tuple]]:
+        """
+        Read a chat's summary and most recent messages.
+
+        Args:
+            chat_id: The Telegram chat ID
+            limit: Maximum number of messages
+
+        Returns:
+            (summary or "", (role, content) tuples oldest first)
+        """
+        # Make sure queued writes for this chat are visible first
+        if any(op[1] == chat_id for op in self._queue):
+            await self.flush()
+        return await self._run(self._read, chat_id, limit)
+
+    def _prune(self) -> int:
+        with self._conn:
+            cutoff = time.time() - self.retention
+            cursor = self._conn.execute("DELETE FROM turns WHERE created_at < ?", (cutoff,))
+            removed = cursor.rowcount
+            self._conn.execute("DELETE FROM summaries WHERE updated_at < ?", (cutoff,))
+            cursor = self._conn.execute(
+                """
+                DELETE FROM turns WHERE id IN (
+                    SELECT id FROM (
+                        SELECT id, ROW_NUMBER() OVER (
+                            PARTITION BY chat_id ORDER BY id DESC
+                        ) AS rn FROM turns
+                    ) WHERE rn > ?
+                )
+                """,
+                (self.keep_per_chat,),
+            )
+            removed += cursor.rowcount
+        self._conn.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        return removed
+
+    async def _pruner(self):
+        while True:
+            await asyncio.sleep(self.prune_interval)
+            try:
+                removed = await self._run(self._prune)
+                logger.info(f"Pruned {removed} old conversation log entries")
+            except sqlite3.Error as e:
+                logger.error(f"Failed to prune conversation log: {e}")
+
+    async def close(self):
+        """Stop background tasks, commit outstanding writes and close"""
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        if self._conn is not None:
+            await self.flush()
+            await self._run(self._conn.close)
+            self._conn = None
+        self._executor.shutdown(wait=False)
+
+    def stats(self) -> dict:
+        """Write-behind counters"""
+        return {
+            "pending": len(self._queue),
+            "written": self.written,
+            "commits": self.commits,
+        }
@@ -0,0 +1,135 @@
+"""
+Progressive delivery of streamed model output to Telegram.
+
+A placeholder message is sent as soon as the request starts and is then
+updated with editMessageText as chunks arrive. Edits run in the background
+so reading the stream is never blocked on Telegram, and the interval
+between edits grows as the reply gets longer so long generations stay
+well inside per-chat edit limits. A final reply too long for one message
+is continued in further messages.
+"""
+import asyncio
+import logging
+import time
+from typing import Optional
+
+from splitting import TELEGRAM_MAX_MESSAGE_LENGTH, markdown_rejected, split_message
+
+logger = logging.getLogger(__name__)
+
+
+class ProgressiveMessage:
+    """A Telegram message that is edited in place while a reply streams in"""
+
+    def __init__(
+        self,
+        bot,
+        chat_id: int,
+        min_interval: float = 1.0,
+        max_interval: float = 3.0,
+        placeholder: str = "…",
+    ):
+        """
+        Args:
+            bot: The TelegramPoller used to send and edit messages
+            chat_id: The Telegram chat ID
+            min_interval: Seconds between the first edits
+            max_interval: Upper bound for the interval between edits
+            placeholder: Text of the initial message
+        """
+        self.bot = bot
+        self.chat_id = chat_id
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.placeholder = placeholder
+        self.message_id: Optional[int] = None
+        self.edits = 0
+        self.started_at = time.monotonic()
+        self.first_visible_at: Optional[float] = None
+        self._shown = ""
+        self._last_edit = 0.0
+        self._edit_task: Optional[asyncio.Task] = None
+        self.abandoned = False
+
+    @property
+    def interval(self) -> float:
+        """Current minimum time between edits"""
+        return min(self.max_interval, self.min_interval * (1.0 + self.edits / 10.0))
+
+    async def start(self):
+        """Send the placeholder message"""
+        result = await self.bot.send_telegram_message(
+            self.chat_id, self.placeholder, parse_mode=None
+        )
+        if result.get("ok"):
+            self.message_id = result["result"]["message_id"]
+
+    def update(self, text: str):
+        """
+        Offer the reply text so far; an edit is scheduled if one is due.
+
+        Args:
+            text: The full reply accumulated so far
+        """
+        if self.abandoned or self.message_id is None or not text.strip():
+            return
+        if self._edit_task is not None and not self._edit_task.done():
+            return
+        # Show the first chunk as soon as possible, then pace the edits
+        if self.edits and time.monotonic() - self._last_edit < self.interval:
+            return
+        self._edit_task = asyncio.create_task(self._edit(text))
+
+    def abandon(self):
+        """Stop editing the message, e.g. once a fallback reply replaced it"""
+        self.abandoned = True
+        if self._edit_task is not None:
+            self._edit_task.cancel()
+
+    async def _edit(self, text: str, parse_mode: Optional[str] = None) -> dict:
+        text = text[:TELEGRAM_MAX_MESSAGE_LENGTH]
+        if text == self._shown:
+            return {"ok": True}
+        result = await self.bot.edit_telegram_message(
+            self.chat_id, self.message_id, text, parse_mode=parse_mode
+        )
+        if not result.get("ok"):
+            return result
+        self._shown = text
+        self._last_edit = time.monotonic()
+        self.edits += 1
+        if self.first_visible_at is None:
+            self.first_visible_at = self._last_edit
+        return result
+
+    async def finish(self, text: str):
+        """
+        Wait for any in-flight edit and show the final text.
+
+        Intermediate edits are plain text because partial Markdown may not
+        parse; the final edit is rendered as Markdown, or as plain text if
+        Telegram can't parse it. If the reply is too long for one message,
+        the rest follows in new messages.
+
+        Args:
+            text: The complete reply
+        """
+        if self._edit_task is not None:
+            await asyncio.gather(self._edit_task, return_exceptions=True)
+        if self.message_id is None:
+            await self.bot.send_telegram_message(self.chat_id, text)
+            return
+        first, *rest = split_message(text)
+        self._shown = ""
+        result = await self._edit(first, parse_mode="Markdown")
+        if markdown_rejected(result):
+            await self._edit(first)
+        for part in rest:
+            result = await self.bot.send_telegram_message(self.chat_id, part)
+            if not result.get("ok"):
+                break
+        if self.first_visible_at is not None:
+            logger.info(
+                f"Streamed reply to chat {self.chat_id}: first text after "
+                f"{self.first_visible_at - self.started_at:.2f}s, {self.edits} edits"
+            )
@@ -0,0 +1,168 @@
+"""
+Background compaction of long conversation histories.
+
+Once a chat's history grows past a token threshold (or fills its ring
+buffer), the oldest turns are sent to a serving endpoint, possibly a
+cheaper one than the chat endpoint, and replaced by a single summary.
+Summarization runs as a background task after the reply has been sent,
+so it never delays the user, and at most one runs per chat at a time.
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional
+
+import deadline
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_INSTRUCTIONS = (
+    "You maintain a running summary of a conversation between a user and an "
+    "assistant. Combine the existing summary (if any) with the new messages "
+    "into one concise summary. Keep facts, names, preferences, decisions and "
+    "open questions that later replies may depend on; drop small talk. "
+    "Answer with the summary only."
+)
+
+
+class HistorySummarizer:
+    """Replaces the oldest turns of long chats with a model-written summary"""
+
+    def __init__(
+        self,
+        serving,
+        endpoint: str,
+        conversations,
+        log=None,
+        trigger_tokens: int = 2048,
+        keep_messages: int = 6,
+        params: Optional[dict] = None,
+    ):
+        """
+        Args:
+            serving: The AsyncServingClient to query through
+            endpoint: The serving endpoint that writes summaries
+            conversations: The ConversationStore to compact
+            log: Optional SQLiteConversationLog kept in sync with the store
+            trigger_tokens: History size (including any summary) that triggers compaction
+            keep_messages: Most recent messages that are never summarized
+            params: Extra generation parameters for summary requests
+        """
+        self.serving = serving
+        self.endpoint = endpoint
+        self.conversations = conversations
+        self.log = log
+        self.trigger_tokens = trigger_tokens
+        self.keep_messages = keep_messages
+        self.params = params or {}
+        self._tasks: Dict[int, asyncio.Task] = {}
+
+        self.runs = 0
+        self.failures = 0
+        self.compacted = 0
+
+    def due(self, chat_id: int) -> bool:
+        """Whether a chat's history should be compacted"""
+        history, tokens = self.conversations.window(chat_id)
+        if len(history) <= self.keep_messages:
+            return False
+        _, summary_tokens = self.conversations.summary(chat_id)
+        return (
+            tokens + summary_tokens > self.trigger_tokens
+            or len(history) >= self.conversations.max_messages
+        )
+
+    def maybe_schedule(self, chat_id: int) -> bool:
+        """
+        Start summarizing a chat in the background if it is due.
+
+        Returns:
+            True if a summarization task was started
+        """
+        if chat_id in self._tasks or not self.due(chat_id):
+            return False
+        # Not bound by the deadline of the update that triggered it
+        task = asyncio.create_task(self._summarize(chat_id), context=deadline.detached())
+        self._tasks[chat_id] = task
+        task.add_done_callback(lambda _: self._forget(chat_id, task))
+        return True
+
+    def cancel(self, chat_id: int):
+        """Abandon a chat's running summarization, e.g. after /reset"""
+        task = self._tasks.pop(chat_id, None)
+        if task is not None:
+            task.cancel()
+
+    def _forget(self, chat_id: int, task: asyncio.Task):
+        if self._tasks.get(chat_id) is task:
+            del self._tasks[chat_id]
+
+    @staticmethod
+    def transcript(summary: str, messages: List[dict]) -> str:
+        """Render an earlier summary and messages as plain text for the summarizer"""
+        lines = []
+        if summary:
+            lines.append(f"Existing summary:\n{summary}\n")
+        lines.append("New messages:")
+        for message in messages:
+            speaker = "User" if message["role"] == "user" else "Assistant"
+            lines.append(f"{speaker}: {message['content']}")
+        return "\n".join(lines)
+
+    async def _summarize(self, chat_id: int):
+        history, _ = self.conversations.window(chat_id)
+        cut = len(history) - self.keep_messages
+        # The remaining history must still start with a user message
+        while cut < len(history) and history[cut]["role"] != "user":
+            cut += 1
+        prefix = history[:cut]
+        if not prefix:
+            return
+        previous, _ = self.conversations.summary(chat_id)
+
+        self.runs += 1
+        try:
+            summary = await self.serving.chat(
+                self.endpoint,
+                [
+                    {"role": "system", "content": SUMMARY_INSTRUCTIONS},
+                    {"role": "user", "content": self.transcript(previous, prefix)},
+                ],
+                **self.params,
+            )
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.failures += 1
+            logger.warning(f"Failed to summarize history of chat {chat_id}: {e}")
+            return
+        if not summary:
+            self.failures += 1
+            return
+
+        if chat_id not in self.conversations:
+            # Evicted meanwhile; the durable log still holds the full history
+            return
+        remaining = self.conversations.compact(chat_id, prefix, summary.strip())
+        if self.log is not None:
+            self.log.compact(chat_id, summary.strip(), remaining)
+        self.compacted += len(prefix)
+        logger.info(
+            f"Summarized {len(prefix)} messages of chat {chat_id}, {remaining} kept"
+        )
+
+    async def close(self):
+        """Cancel summarizations still running"""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+
+    def stats(self) -> dict:
+        """Summarization counters"""
+        return {
+            "running": len(self._tasks),
+            "runs": self.runs,
+            "failures": self.failures,
+            "compacted_messages": self.compacted,
+        }
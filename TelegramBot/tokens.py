@@ -0,0 +1,100 @@
+"""
+Token counting and prompt size statistics.
+
+Token counts are used to fit conversation history into a prompt budget.
+They are computed once per message, with either a real tokenizer or a
+fast character-based approximation.
+"""
+import bisect
+import logging
+from typing import Callable, Optional
+
+logger = logging.getLogger(__name__)
+
+# Message framing overhead (role markers, separators) in most chat templates
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+def approximate_tokens(text: str) -> int:
+    """Estimate tokens as ~4 characters each, which is close for English BPE vocabularies"""
+    return (len(text) + 3) // 4 + MESSAGE_OVERHEAD_TOKENS
+
+
+def get_tokenizer(spec: str = "approx") -> Callable[[str], int]:
+    """
+    Return a token counting function.
+
+    Args:
+        spec: "approx", or "tiktoken:<encoding>" (e.g. "tiktoken:cl100k_base")
+            if the optional tiktoken package is installed
+
+    Returns:
+        A function mapping text to a token count
+    """
+    if spec.startswith("tiktoken:"):
+        try:
+            import tiktoken
+        except ImportError:
+            logger.warning("tiktoken is not installed, using approximate token counts")
+            return approximate_tokens
+        encoding = tiktoken.get_encoding(spec.split(":", 1)[1])
+        return lambda text: len(encoding.encode(text)) + MESSAGE_OVERHEAD_TOKENS
+    if spec != "approx":
+        logger.warning(f"Unknown tokenizer {spec!r}, using approximate token counts")
+    return approximate_tokens
+
+
+class TokenHistogram:
+    """Histogram of prompt sizes with the mean endpoint latency per bucket"""
+
+    BOUNDS = (128, 256, 512, 1024, 2048, 4096, 8192, 16384, 32768)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.latency = [0.0] * (len(self.BOUNDS) + 1)
+        self.total = 0
+
+    def observe(self, tokens: int, latency: Optional[float] = None):
+        """
+        Record one prompt.
+
+        Args:
+            tokens: Prompt size in tokens
+            latency: Endpoint latency for the prompt, in seconds
+        """
+        bucket = bisect.bisect_left(self.BOUNDS, tokens)
+        self.counts[bucket] += 1
+        if latency is not None:
+            self.latency[bucket] += latency
+        self.total += 1
+
+    @classmethod
+    def labels(cls) -> list:
+        return [f"<={bound}" for bound in cls.BOUNDS] + [f">{cls.BOUNDS[-1]}"]
+
+    def percentile(self, q: float) -> str:
+        """Label of the bucket holding the q-th percentile (0-100)"""
+        if not self.total:
+            return "n/a"
+        rank = q / 100.0 * self.total
+        seen = 0
+        for label, count in zip(self.labels(), self.counts):
+            seen += count
+            if seen >= rank and count:
+                return label
+        return self.labels()[-1]
+
+    def stats(self) -> dict:
+        """Bucket counts and mean latency, keyed by bucket label"""
+        labels = self.labels()
+        return {
+            "prompts": self.total,
+            "buckets": {
+                label: {
+                    "count": count,
+                    "avg_latency": round(latency / count, 3) if count else None,
+                }
+                for label, count, latency in zip(labels, self.counts, self.latency)
+                if count
+            },
+        }
@@ -0,0 +1,50 @@
+"""
+Concurrent serving queries through the async client.
+
+50 queries go to a fake endpoint answering after 200ms. They are sent
+concurrently, as dispatcher workers do, and then one at a time, as the
+blocking client's processing loop did.
+
+    python benchmarks/bench_async_client.py
+"""
+import asyncio
+import time
+
+import common  # noqa: F401  (import path and configuration)
+
+import httpx
+
+from common import FakeWorkspace
+from serving import AsyncServingClient
+
+QUERIES = 50
+LATENCY = 0.2
+
+
+async def endpoint(request: httpx.Request) -> httpx.Response:
+    await asyncio.sleep(LATENCY)
+    return httpx.Response(200, json={"choices": [{"message": {"content": "hi"}}]})
+
+
+async def main():
+    client = AsyncServingClient(FakeWorkspace(), max_in_flight=QUERIES)
+    client.client = httpx.AsyncClient(transport=httpx.MockTransport(endpoint))
+    messages = [{"role": "user", "content": "q"}]
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client.chat("llm", messages) for _ in range(QUERIES)))
+    concurrent = time.perf_counter() - started
+
+    started = time.perf_counter()
+    for _ in range(QUERIES):
+        await client.chat("llm", messages)
+    sequential = time.perf_counter() - started
+
+    print(f"{QUERIES} queries at {LATENCY * 1000:.0f}ms each")
+    print(f"  concurrent: {concurrent:.2f}s")
+    print(f"  sequential: {sequential:.2f}s")
+    await client.aclose()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
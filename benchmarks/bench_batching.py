@@ -0,0 +1,69 @@
+"""
+Throughput and latency of micro-batching against a batch-capable endpoint.
+
+The fake endpoint takes 50ms plus 5ms per item and the client allows 8
+concurrent requests. 400 prompts arrive at ~400/s, first sent one per
+request and then micro-batched with several window lengths.
+
+    python benchmarks/bench_batching.py
+"""
+import asyncio
+import json
+import time
+
+import common  # noqa: F401  (import path and configuration)
+
+import httpx
+
+from batching import MicroBatcher
+from common import FakeWorkspace, percentile
+from serving import AsyncServingClient
+
+PROMPTS = 400
+RATE = 400.0
+
+
+async def endpoint(request: httpx.Request) -> httpx.Response:
+    inputs = json.loads(request.content)["inputs"]
+    await asyncio.sleep(0.05 + 0.005 * len(inputs))
+    return httpx.Response(200, json={"predictions": [p.upper() for p in inputs]})
+
+
+async def measure(window: float):
+    client = AsyncServingClient(FakeWorkspace(), max_in_flight=8)
+    client.client = httpx.AsyncClient(transport=httpx.MockTransport(endpoint))
+    batcher = MicroBatcher(client, "llm", max_batch=32, max_wait=window) if window else None
+    latencies = []
+
+    async def one(i: int):
+        started = time.perf_counter()
+        if batcher is not None:
+            await batcher.submit(f"p{i}")
+        else:
+            await client.query("llm", {"inputs": [f"p{i}"]})
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    tasks = []
+    for i in range(PROMPTS):
+        tasks.append(asyncio.create_task(one(i)))
+        await asyncio.sleep(1 / RATE)
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+    label = f"window {window * 1000:3.0f}ms" if window else "unbatched    "
+    batches = f"avg batch {batcher.stats()['avg_batch_size']:.1f}" if batcher else ""
+    print(
+        f"{label}: {PROMPTS / elapsed:4.0f} req/s  "
+        f"p50 {percentile(latencies, 50) * 1000:5.0f}ms  "
+        f"p99 {percentile(latencies, 99) * 1000:5.0f}ms  {batches}"
+    )
+    await client.aclose()
+
+
+async def run():
+    for window in (0, 0.002, 0.01, 0.02, 0.05):
+        await measure(window)
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,57 @@
+"""
+Memory and speed of the in-memory conversation history.
+
+100k chats each receive 10 turns (60-character prompts, 300-character
+replies, all distinct strings). Memory per chat is measured with
+tracemalloc and compared with the store's own byte accounting; append
+and assembly times are measured in a separate run without tracemalloc,
+which would slow them down.
+
+    python benchmarks/bench_history.py
+"""
+import time
+import tracemalloc
+
+import common  # noqa: F401  (import path and configuration)
+
+from history import ConversationStore
+
+CHATS = 100_000
+TURNS = 10
+
+
+def fill(store: ConversationStore) -> float:
+    started = time.perf_counter()
+    for turn in range(TURNS):
+        for chat in range(CHATS):
+            store.append_turn(chat, f"u{chat}".ljust(60), f"a{turn}".ljust(300))
+    # Each turn appends two messages
+    return (time.perf_counter() - started) / (2 * CHATS * TURNS)
+
+
+def run():
+    tracemalloc.start()
+    store = ConversationStore(max_turns=TURNS, max_bytes=10**12)
+    fill(store)
+    used, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(
+        f"{CHATS:,} chats x {TURNS} turns: {used / CHATS / 1024:.1f} KiB per chat measured, "
+        f"{store.bytes / CHATS / 1024:.1f} KiB tracked"
+    )
+    del store
+
+    store = ConversationStore(max_turns=TURNS, max_bytes=10**12)
+    append = fill(store)
+    started = time.perf_counter()
+    for chat in range(CHATS):
+        messages = store.messages(chat)
+    assemble = (time.perf_counter() - started) / CHATS
+    print(
+        f"append {append * 1e6:.2f}us per message, "
+        f"assemble {assemble * 1e6:.2f}us per {len(messages)}-message history"
+    )
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,125 @@
+"""
+Delay between an update reaching Telegram and its processing starting.
+
+A fake Bot API holds getUpdates open until an update arrives, like a real
+long poll. Updates arrive one at a time at random (Poisson) and in
+bursts of 20. Processing is instant, so only the polling loop is
+measured. The adaptive loop in TelegramPoller.run is compared with the
+previous loop, which slept POLL_INTERVAL (2s) after every poll.
+
+    python benchmarks/bench_poll_latency.py
+"""
+import asyncio
+import random
+import time
+
+import common  # noqa: F401  (import path and configuration)
+
+import httpx
+
+import main
+from common import percentile
+
+POLL_INTERVAL = 2.0
+DURATION = 30.0
+
+
+class FakeTelegram:
+    def __init__(self):
+        self.updates = []
+        self.arrived = {}
+        self._new = asyncio.Event()
+
+    def deliver(self, count: int = 1):
+        for _ in range(count):
+            update_id = len(self.updates) + 1
+            self.updates.append({
+                "update_id": update_id,
+                "message": {"chat": {"id": update_id % 50}, "text": "hi"},
+            })
+            self.arrived[update_id] = time.monotonic()
+        self._new.set()
+
+    async def handler(self, request: httpx.Request) -> httpx.Response:
+        if request.url.path.endswith("/getUpdates"):
+            offset = int(request.url.params["offset"])
+            limit = int(request.url.params.get("limit", 100))
+            deadline = time.monotonic() + float(request.url.params.get("timeout", 0))
+            while True:
+                ready = [u for u in self.updates if u["update_id"] >= offset][:limit]
+                if ready or time.monotonic() >= deadline:
+                    return httpx.Response(200, json={"ok": True, "result": ready})
+                self._new.clear()
+                try:
+                    await asyncio.wait_for(self._new.wait(), deadline - time.monotonic())
+                except asyncio.TimeoutError:
+                    pass
+        return httpx.Response(200, json={"ok": True, "result": True})
+
+
+async def traffic(telegram: FakeTelegram, burst: int, rate: float):
+    rng = random.Random(1)
+    end = time.monotonic() + DURATION
+    while time.monotonic() < end:
+        await asyncio.sleep(rng.expovariate(rate))
+        telegram.deliver(burst)
+
+
+class MeasuredPoller(main.TelegramPoller):
+    def __init__(self, telegram: FakeTelegram, delays: list):
+        super().__init__()
+        self.telegram = telegram
+        self.delays = delays
+        self.client = httpx.AsyncClient(transport=httpx.MockTransport(telegram.handler))
+
+    async def handle_update(self, update: dict):
+        self.delays.append(time.monotonic() - self.telegram.arrived[update["update_id"]])
+
+
+async def adaptive_loop(telegram: FakeTelegram, delays: list):
+    await MeasuredPoller(telegram, delays).run()
+
+
+async def fixed_sleep_loop(telegram: FakeTelegram, delays: list):
+    # The loop before the change: poll, process the batch, sleep
+    client = httpx.AsyncClient(transport=httpx.MockTransport(telegram.handler))
+    offset = 1
+    while True:
+        response = await client.get(
+            "https://api.telegram.org/bot/getUpdates", params={"offset": offset, "timeout": 30}
+        )
+        for update in response.json()["result"]:
+            delays.append(time.monotonic() - telegram.arrived[update["update_id"]])
+            offset = update["update_id"] + 1
+        await asyncio.sleep(POLL_INTERVAL)
+
+
+async def measure(loop, burst: int, rate: float) -> list:
+    telegram = FakeTelegram()
+    delays = []
+    task = asyncio.create_task(loop(telegram, delays))
+    await traffic(telegram, burst, rate)
+    await asyncio.sleep(POLL_INTERVAL + 0.5)
+    task.cancel()
+    await asyncio.gather(task, return_exceptions=True)
+    return delays
+
+
+async def run():
+    scenarios = [
+        ("single updates, ~2/s", 1, 2.0),
+        ("bursts of 20, every ~3s", 20, 1 / 3),
+    ]
+    for title, burst, rate in scenarios:
+        print(title)
+        for name, loop in (("fixed 2s sleep", fixed_sleep_loop), ("adaptive", adaptive_loop)):
+            delays = await measure(loop, burst, rate)
+            print(
+                f"  {name:15} {len(delays):4} updates  "
+                f"p50 {percentile(delays, 50) * 1000:6.0f}ms  "
+                f"p99 {percentile(delays, 99) * 1000:6.0f}ms"
+            )
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
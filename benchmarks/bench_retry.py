@@ -0,0 +1,122 @@
+"""
+Success rate and added latency of retries under injected faults.
+
+400 message round trips (a serving query, then sendMessage to a distinct
+chat) run in waves of 20. Both fakes take ~20-50ms and fail a share of
+calls with a random mix of timeouts, connection errors, 429 and 503.
+Each combination of fault rate and retry policy (1 attempt, 3 attempts
+within the default 10% retry budget, 3 attempts without a budget) reports
+the share of round trips that succeeded, latency percentiles, and calls
+made per request (serving queries plus sends attempted). Retry backoff
+starts at 50ms. A retried send also waits for its chat's 1 msg/s bucket,
+as in production, which shows in the p99.
+
+    python benchmarks/bench_retry.py
+"""
+import asyncio
+import os
+import random
+import time
+
+import common  # noqa: F401  (import path and configuration)
+
+# Keep the outbound rate limiter out of the measurement
+os.environ["TELEGRAM_GLOBAL_RATE"] = "100000"
+
+import httpx
+
+import main
+from common import FakeWorkspace, percentile
+from retry import RetryBudget, RetryPolicy
+from serving import AsyncServingClient
+
+ROUND_TRIPS = 400
+WAVE = 20
+BASE = 0.05
+
+
+def faulty(rng: random.Random, fault_rate: float, ok: httpx.Response, calls: list):
+    """A MockTransport handler failing `fault_rate` of calls"""
+
+    async def handler(request: httpx.Request) -> httpx.Response:
+        calls.append(1)
+        await asyncio.sleep(rng.uniform(0.02, 0.05))
+        if rng.random() >= fault_rate:
+            return ok
+        fault = rng.choice(("timeout", "connect", "429", "503"))
+        if fault == "timeout":
+            raise httpx.ReadTimeout("injected", request=request)
+        if fault == "connect":
+            raise httpx.ConnectError("injected", request=request)
+        if fault == "429":
+            return httpx.Response(
+                429, json={"ok": False, "error_code": 429, "parameters": {"retry_after": 0}}
+            )
+        return httpx.Response(503, json={})
+
+    return handler
+
+
+def policy(attempts: int, budgeted: bool) -> RetryPolicy:
+    return RetryPolicy(attempts, base=BASE, budget=RetryBudget() if budgeted else None)
+
+
+async def measure(fault_rate: float, attempts: int, budgeted: bool):
+    rng = random.Random(11)
+    serving_calls, telegram_calls = [], []
+    answer = httpx.Response(200, json={"choices": [{"message": {"content": "ok"}}]})
+    sent = httpx.Response(200, json={"ok": True, "result": {"message_id": 1}})
+
+    serving = AsyncServingClient(
+        FakeWorkspace(),
+        # A fixed concurrency limit and no circuit breaker: measure retries alone
+        min_in_flight=32,
+        breaker_failures=0,
+        retry=policy(attempts, budgeted),
+    )
+    serving.client = httpx.AsyncClient(
+        transport=httpx.MockTransport(faulty(rng, fault_rate, answer, serving_calls))
+    )
+    bot = main.TelegramPoller(serving=serving)
+    bot.client = httpx.AsyncClient(
+        transport=httpx.MockTransport(faulty(rng, fault_rate, sent, telegram_calls))
+    )
+    bot.telegram_retry = policy(attempts, budgeted)
+    latencies, successes, requests = [], 0, 0
+
+    async def round_trip(chat_id: int):
+        nonlocal successes, requests
+        started = time.perf_counter()
+        requests += 1
+        try:
+            reply = await serving.chat("llm", [{"role": "user", "content": "hi"}])
+            requests += 1
+            response = await bot.telegram_send("sendMessage", {"chat_id": chat_id, "text": reply})
+            successes += response.status_code == 200
+        except Exception:
+            pass
+        latencies.append(time.perf_counter() - started)
+
+    for wave in range(0, ROUND_TRIPS, WAVE):
+        await asyncio.gather(*(round_trip(chat_id) for chat_id in range(wave, wave + WAVE)))
+
+    label = f"{attempts}{', no budget' if not budgeted and attempts > 1 else ''}"
+    calls = (len(serving_calls) + len(telegram_calls)) / requests
+    print(
+        f"{fault_rate:4.0%}  {label:13} {successes / ROUND_TRIPS:6.1%}  "
+        f"{percentile(latencies, 50) * 1000:5.0f}ms  {percentile(latencies, 99) * 1000:5.0f}ms  "
+        f"{calls:.2f}"
+    )
+    await bot.close()
+    await serving.aclose()
+
+
+async def run():
+    print("fault  attempts      success  p50      p99    calls/request")
+    for fault_rate in (0.05, 0.2, 1.0):
+        for attempts, budgeted in ((1, True), (3, True), (3, False)):
+            await measure(fault_rate, attempts, budgeted)
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,118 @@
+"""
+Semantic cache hit rate on a replayed prompt log, and lookup latency.
+
+The replay feeds data/prompt_log.jsonl through the cache in order, the
+way the bot would: a miss stores the prompt's answer, a hit serves the
+answer of the closest earlier prompt. Each prompt is labelled with an
+intent; paraphrases share one, near misses ("capital of Spain" after
+"capital of France") do not. It reports the hit rate on paraphrases of
+already answered prompts and the false-hit rate (answers served for a
+different intent) at SEMANTIC_CACHE_THRESHOLD and nearby thresholds.
+Prompts are embedded with SEMANTIC_CACHE_EMBEDDING_ENDPOINT when it is
+set (with real workspace credentials), otherwise with HashingEmbedder.
+
+For latency, random 256-dimensional vectors fill caches of 10k, 100k and
+1M entries; 200 noisy copies of stored vectors are then looked up. Pass
+sizes to run fewer, e.g. `python benchmarks/bench_semantic.py 10000 100000`.
+
+    python benchmarks/bench_semantic.py
+"""
+import asyncio
+import json
+import os
+import sys
+import time
+
+import common  # noqa: F401  (import path and configuration)
+
+import numpy as np
+
+from semantic import EndpointEmbedder, HashingEmbedder, SemanticCache
+
+DIM = 256
+QUERIES = 200
+PROMPT_LOG = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data", "prompt_log.jsonl")
+THRESHOLD = float(os.getenv("SEMANTIC_CACHE_THRESHOLD", "0.92"))
+EMBEDDING_ENDPOINT = os.getenv("SEMANTIC_CACHE_EMBEDDING_ENDPOINT")
+
+
+async def embed_log() -> tuple:
+    with open(PROMPT_LOG) as f:
+        records = [json.loads(line) for line in f if line.strip()]
+    if EMBEDDING_ENDPOINT:
+        from databricks.sdk import WorkspaceClient
+        from serving import AsyncServingClient
+
+        serving = AsyncServingClient(WorkspaceClient())
+        embedder, name = EndpointEmbedder(serving, EMBEDDING_ENDPOINT), EMBEDDING_ENDPOINT
+    else:
+        serving, embedder, name = None, HashingEmbedder(DIM), "HashingEmbedder"
+    vectors = [await embedder.embed(record["prompt"]) for record in records]
+    if serving is not None:
+        await serving.aclose()
+    return records, vectors, name
+
+
+def replay(records: list, vectors: list, threshold: float) -> tuple:
+    """Returns (paraphrase hit rate, false-hit rate, hits) for one threshold"""
+    cache = SemanticCache(dim=len(vectors[0]), threshold=threshold)
+    seen = set()
+    paraphrases = correct = false_hits = 0
+    for record, vector in zip(records, vectors):
+        intent = record["intent"]
+        answer = cache.lookup(vector)
+        if intent in seen:
+            paraphrases += 1
+            correct += answer == intent
+        if answer is None:
+            cache.add(vector, intent)
+            seen.add(intent)
+        elif answer != intent:
+            false_hits += 1
+    return correct / max(1, paraphrases), false_hits / len(records), correct + false_hits
+
+
+def measure_replay():
+    records, vectors, name = asyncio.run(embed_log())
+    intents = len({record["intent"] for record in records})
+    print(f"Replay of {len(records)} prompts ({intents} intents), embedded with {name}:")
+    for threshold in sorted({0.8, 0.85, 0.9, THRESHOLD, 0.95}):
+        hit_rate, false_rate, hits = replay(records, vectors, threshold)
+        marker = "  (SEMANTIC_CACHE_THRESHOLD)" if threshold == THRESHOLD else ""
+        print(
+            f"  threshold {threshold:.2f}: paraphrase hit rate {hit_rate:.2f}, "
+            f"false-hit rate {false_rate:.2f}, {hits} hits{marker}"
+        )
+
+
+def measure(size: int, indexed: bool):
+    # An ANN threshold above the size keeps the cache brute force
+    cache = SemanticCache(
+        dim=DIM, max_entries=size, ann_threshold=size // 2 if indexed else size * 10
+    )
+    rng = np.random.default_rng(1)
+    vectors = rng.standard_normal((size, DIM)).astype(np.float32)
+    started = time.perf_counter()
+    for vector in vectors:
+        cache.add(vector, "answer")
+        if cache.index_due:
+            asyncio.run(cache.build_index())
+    fill = time.perf_counter() - started
+
+    queries = vectors[rng.integers(0, size, QUERIES)]
+    queries += 0.05 * rng.standard_normal((QUERIES, DIM)).astype(np.float32)
+    started = time.perf_counter()
+    hits = sum(cache.lookup(query) is not None for query in queries)
+    lookup = (time.perf_counter() - started) / QUERIES
+    print(
+        f"{size:>9,} {'IVF' if indexed else 'flat':4}: {lookup * 1000:7.2f}ms/lookup, "
+        f"recall {hits / QUERIES:.2f}, filled in {fill:.1f}s"
+    )
+
+
+if __name__ == "__main__":
+    measure_replay()
+    sizes = [int(arg) for arg in sys.argv[1:]] or [10_000, 100_000, 1_000_000]
+    for size in sizes:
+        for indexed in (False, True):
+            measure(size, indexed)
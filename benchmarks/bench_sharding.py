@@ -0,0 +1,99 @@
+"""
+Update throughput in-process and across shard worker processes.
+
+2000 updates across 200 chats; each does 20ms of simulated I/O and then
+about 1.5ms of CPU-bound hashing. Workers check that updates of a chat
+are processed in order; one that isn't is never reported done, so the
+run would not finish. CPU-bound work only scales with shards up to the
+number of cores, which the output reports.
+
+    python benchmarks/bench_sharding.py
+"""
+import asyncio
+import hashlib
+import os
+import time
+
+import common  # noqa: F401  (import path and configuration)
+
+from dispatcher import ChatDispatcher
+from sharding import ShardedDispatcher
+
+UPDATES = 2000
+CHATS = 200
+
+
+def updates() -> list:
+    return [
+        {"update_id": i + 1, "message": {"chat": {"id": i % CHATS}, "text": str(i // CHATS)}}
+        for i in range(UPDATES)
+    ]
+
+
+class SimulatedWorker:
+    """Stands in for TelegramPoller in "worker" mode"""
+
+    def __init__(self):
+        self.dispatcher = ChatDispatcher(self.handle, workers=16)
+        self.on_processed = None
+        self._last = {}
+
+    async def handle(self, update: dict):
+        message = update["message"]
+        chat, sequence = message["chat"]["id"], int(message["text"])
+        if self._last.get(chat, -1) != sequence - 1:
+            raise AssertionError(f"Chat {chat} out of order")
+        self._last[chat] = sequence
+        await asyncio.sleep(0.02)
+        digest = b"reply"
+        for _ in range(2000):
+            digest = hashlib.sha256(digest).digest()
+        if self.on_processed is not None:
+            self.on_processed(update["update_id"])
+
+    async def start(self):
+        self.dispatcher.start()
+
+    async def close(self):
+        await self.dispatcher.stop()
+
+
+def shard_worker(index: int) -> SimulatedWorker:
+    return SimulatedWorker()
+
+
+async def in_process() -> float:
+    worker = SimulatedWorker()
+    await worker.start()
+    started = time.perf_counter()
+    for update in updates():
+        worker.dispatcher.submit(update)
+    await worker.dispatcher.join()
+    elapsed = time.perf_counter() - started
+    await worker.close()
+    return UPDATES / elapsed
+
+
+async def sharded(shards: int) -> float:
+    dispatcher = ShardedDispatcher(shard_worker, shards)
+    dispatcher.start()
+    # Wait for the processes to start, so only processing is timed
+    await asyncio.sleep(3)
+    started = time.perf_counter()
+    for update in updates():
+        dispatcher.submit(update)
+    await dispatcher.join()
+    elapsed = time.perf_counter() - started
+    await dispatcher.stop()
+    return UPDATES / elapsed
+
+
+async def run():
+    print(f"{os.cpu_count()} CPU core(s)")
+    print(f"  in-process: {await in_process():5.0f} updates/s")
+    for shards in (1, 2, 4, 8):
+        print(f"  {shards} shard(s):  {await sharded(shards):5.0f} updates/s")
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
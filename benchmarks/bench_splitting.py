@@ -0,0 +1,113 @@
+"""
+Speed and correctness of splitting long replies into Telegram messages.
+
+20 generated ~100KB replies mix prose, *bold*, _italic_, `code`, links and
+code blocks of up to 400 lines. Every part is checked to fit, to contain
+only closed entities and, together with the others, to keep all of the
+text. Pathological inputs follow: no break opportunities at all, one huge
+code block, one huge bold span, and plain text split without Markdown.
+
+    python benchmarks/bench_splitting.py
+"""
+import random
+import re
+import time
+
+import common  # noqa: F401  (import path and configuration)
+
+from splitting import TELEGRAM_MAX_MESSAGE_LENGTH, _entities, split_message
+
+WORDS = (
+    "the model returns a fairly long answer with several sentences and some detail about each step"
+).split()
+
+
+def sentence(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(5, 18))]
+    i = rng.randrange(len(words))
+    kind = rng.random()
+    if kind < 0.1:
+        words[i] = f"*{words[i]} {rng.choice(WORDS)}*"
+    elif kind < 0.2:
+        words[i] = f"_{words[i]}_"
+    elif kind < 0.3:
+        words[i] = f"`{words[i]}()`"
+    elif kind < 0.35:
+        words[i] = f"[{words[i]}](https://example.com/{words[i]})"
+    return " ".join(words).capitalize() + rng.choice(".!?")
+
+
+def code_block(rng: random.Random, lines: int) -> str:
+    language = rng.choice(["python", "", "bash"])
+    body = "\n".join(f"    x_{i} = compute({i}, 'value')  # step {i}" for i in range(lines))
+    return f"```{language}\n{body}\n```"
+
+
+def document(rng: random.Random, size: int) -> str:
+    parts = []
+    length = 0
+    while length < size:
+        if rng.random() < 0.15:
+            part = code_block(rng, rng.randint(3, 400))
+        else:
+            part = " ".join(sentence(rng) for _ in range(rng.randint(1, 8)))
+        parts.append(part)
+        length += len(part) + 2
+    return "\n\n".join(parts)[:size].rsplit("\n\n", 1)[0]
+
+
+def check(text: str, parts: list):
+    for part in parts:
+        assert len(part) <= TELEGRAM_MAX_MESSAGE_LENGTH, len(part)
+        inline, pre = _entities(part)
+        covered = set()
+        for start, end, _ in inline + pre:
+            covered.update(range(start, end))
+        stray = [
+            i for i, char in enumerate(part)
+            if char in "*_`[" and i not in covered and (i == 0 or part[i - 1] != "\\")
+        ]
+        assert not stray, f"Unclosed entity near {part[max(0, stray[0] - 40):stray[0] + 40]!r}"
+
+    # Markers and whitespace may move at breaks; the words must not
+    def words(value: str) -> str:
+        return re.sub(r"```\w*|[\s*_`]", "", value)
+
+    assert words(text) == words("\n".join(parts)), "Text changed"
+
+
+def run():
+    rng = random.Random(3)
+    texts = [document(rng, 100_000) for _ in range(20)]
+    times = []
+    counts = []
+    for text in texts:
+        started = time.perf_counter()
+        parts = split_message(text)
+        times.append(time.perf_counter() - started)
+        counts.append(len(parts))
+        check(text, parts)
+    size = sum(len(text) for text in texts) / len(texts) / 1024
+    mean = sum(times) / len(times)
+    print(
+        f"{len(texts)} replies of {size:.0f}KB, {min(counts)}-{max(counts)} parts each: "
+        f"mean {mean * 1000:.2f}ms ({mean * 1e6 / size:.1f}us/KB), max {max(times) * 1000:.2f}ms, "
+        f"all parts valid"
+    )
+
+    pathological = [
+        ("no boundaries", "x" * 100_000, True),
+        ("one code block", "```python\n" + "\n".join("y=1" for _ in range(30_000)) + "\n```", True),
+        ("one bold span", "*" + "word " * 20_000 + "*", True),
+        ("plain text", document(rng, 100_000), False),
+    ]
+    for name, text, markdown in pathological:
+        started = time.perf_counter()
+        parts = split_message(text, markdown=markdown)
+        elapsed = time.perf_counter() - started
+        assert all(len(part) <= TELEGRAM_MAX_MESSAGE_LENGTH for part in parts)
+        print(f"{name:14}: {len(text) // 1024:4}KB in {elapsed * 1000:5.2f}ms, {len(parts)} parts")
+
+
+if __name__ == "__main__":
+    run()
@@ -0,0 +1,76 @@
+"""
+Sustained insert rate of the SQLite conversation log.
+
+20k 200-byte turns are written with one commit per turn (WAL, with
+synchronous FULL and NORMAL) and through SQLiteConversationLog's group
+commit. Append call times show what the request path pays; the slowest
+ones are noisy, since the writer thread competes for the GIL.
+
+    python benchmarks/bench_store.py
+"""
+import asyncio
+import os
+import sqlite3
+import tempfile
+import time
+
+import common  # noqa: F401  (import path and configuration)
+
+from common import percentile
+from store import SCHEMA, SQLiteConversationLog
+
+TURNS = 20_000
+CONTENT = "x" * 200
+
+
+def commit_per_turn(path: str, synchronous: str) -> float:
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(f"PRAGMA synchronous={synchronous}")
+    conn.executescript(SCHEMA)
+    started = time.perf_counter()
+    for i in range(TURNS):
+        with conn:
+            conn.execute(
+                "INSERT INTO turns (chat_id, role, content, created_at) VALUES (?, ?, ?, ?)",
+                (i % 500, "user", CONTENT, time.time()),
+            )
+    elapsed = time.perf_counter() - started
+    conn.close()
+    return TURNS / elapsed
+
+
+async def group_commit(path: str) -> tuple:
+    log = SQLiteConversationLog(path)
+    await log.start()
+    appends = []
+    started = time.perf_counter()
+    for i in range(TURNS):
+        call = time.perf_counter()
+        log.append(i % 500, "user", CONTENT)
+        appends.append(time.perf_counter() - call)
+        if i % 100 == 0:
+            # Let the writer run, as it would between updates
+            await asyncio.sleep(0)
+    await log.flush()
+    elapsed = time.perf_counter() - started
+    commits = log.commits
+    await log.close()
+    return TURNS / elapsed, commits, appends
+
+
+def run():
+    with tempfile.TemporaryDirectory() as directory:
+        for synchronous in ("FULL", "NORMAL"):
+            rate = commit_per_turn(os.path.join(directory, f"{synchronous}.db"), synchronous)
+            print(f"commit per turn, synchronous={synchronous:6}: {rate:9,.0f} turns/s")
+        rate, commits, appends = asyncio.run(group_commit(os.path.join(directory, "log.db")))
+        print(f"group commit via the log:            {rate:9,.0f} turns/s ({commits} commits)")
+        print(
+            f"append call: p99 {percentile(appends, 99) * 1e6:.1f}us, "
+            f"max {max(appends) * 1e6:.0f}us"
+        )
+
+
+if __name__ == "__main__":
+    run()
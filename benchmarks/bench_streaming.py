@@ -0,0 +1,81 @@
+"""
+Time until reply text becomes visible in Telegram, with and without streaming.
+
+A fake endpoint sends its first chunk after 300ms and then 40 chunks at
+100ms intervals. With streaming, the reply is edited into a placeholder as
+chunks arrive; without it, the reply is sent once generation has finished.
+
+    python benchmarks/bench_streaming.py
+"""
+import asyncio
+import json
+import time
+
+import common  # noqa: F401  (import path and configuration)
+
+import httpx
+
+import main
+
+FIRST_CHUNK = 0.3
+CHUNKS = 40
+CHUNK_INTERVAL = 0.1
+
+
+def chunk(text: str) -> bytes:
+    return f"data: {json.dumps({'choices': [{'delta': {'content': text}}]})}\n\n".encode()
+
+
+async def endpoint(request: httpx.Request) -> httpx.Response:
+    if request.method == "GET":
+        return httpx.Response(200, json={"config": {}})
+    if json.loads(request.content).get("stream"):
+        async def body():
+            await asyncio.sleep(FIRST_CHUNK)
+            for i in range(CHUNKS):
+                yield chunk(f"token{i} ")
+                await asyncio.sleep(CHUNK_INTERVAL)
+            yield b"data: [DONE]\n\n"
+
+        return httpx.Response(200, content=body())
+    await asyncio.sleep(FIRST_CHUNK + CHUNKS * CHUNK_INTERVAL)
+    text = "".join(f"token{i} " for i in range(CHUNKS))
+    return httpx.Response(200, json={"choices": [{"message": {"content": text}}]})
+
+
+async def measure(streaming: bool) -> tuple:
+    visible = []
+
+    async def telegram(request: httpx.Request) -> httpx.Response:
+        method = request.url.path.rsplit("/", 1)[-1]
+        if method in ("sendMessage", "editMessageText"):
+            text = json.loads(request.content)["text"]
+            if text != "…":
+                visible.append(time.monotonic())
+        return httpx.Response(200, json={"ok": True, "result": {"message_id": 1}})
+
+    bot = main.TelegramPoller()
+    bot.client = httpx.AsyncClient(transport=httpx.MockTransport(telegram))
+    bot.serving.client = httpx.AsyncClient(transport=httpx.MockTransport(endpoint))
+    await bot.start()
+    started = time.monotonic()
+    if streaming:
+        await bot.stream_databricks_reply(1, "hello", use_cache=False)
+    else:
+        reply = await bot.send_to_databricks_endpoint("hello", chat_id=1, use_cache=False)
+        await bot.send_telegram_message(1, reply)
+    await bot.close()
+    return visible[0] - started, visible[-1] - started, len(visible)
+
+
+async def run():
+    for streaming in (False, True):
+        first, last, messages = await measure(streaming)
+        print(
+            f"{'streaming' if streaming else 'blocking':9}: first text after {first:.2f}s, "
+            f"final text after {last:.2f}s ({messages} sends/edits)"
+        )
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
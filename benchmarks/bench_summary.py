@@ -0,0 +1,99 @@
+"""
+Prompt size and latency of a long conversation, with and without summarization.
+
+One chat runs for 200 turns (~200-character questions, ~600-character
+answers) against a fake endpoint whose latency grows with prompt length:
+5ms plus 6ms per 1000 prompt tokens. History keeps 100 turns and prompts
+are trimmed to a 16k-token budget, as in main.py's build_prompt. With
+summarization, HistorySummarizer compacts the chat in the background
+once its history passes 2048 tokens; the user waits 20ms between turns.
+
+    python benchmarks/bench_summary.py
+"""
+import asyncio
+import json
+import time
+
+import common  # noqa: F401  (import path and configuration)
+
+import httpx
+
+from common import FakeWorkspace, percentile
+from history import ConversationStore
+from serving import AsyncServingClient
+from summarizer import SUMMARY_INSTRUCTIONS, HistorySummarizer
+from tokens import approximate_tokens
+
+TURNS = 200
+MAX_TURNS = 100
+BUDGET = 16384
+TRIGGER = 2048
+THINK_TIME = 0.02
+CHAT = 1
+
+
+async def endpoint(request: httpx.Request) -> httpx.Response:
+    messages = json.loads(request.content)["messages"]
+    tokens = sum(approximate_tokens(m["content"]) for m in messages)
+    await asyncio.sleep(0.005 + 0.006 * tokens / 1000)
+    if messages[0]["content"] == SUMMARY_INSTRUCTIONS:
+        text = "Summary of the conversation so far. ".ljust(800, ".")
+    else:
+        text = "An answer. ".ljust(600, ".")
+    return httpx.Response(200, json={"choices": [{"message": {"content": text}}]})
+
+
+def build_prompt(conversations: ConversationStore, message: str) -> list:
+    """The same assembly as TelegramPoller.build_prompt, without a system prompt"""
+    fixed = approximate_tokens(message)
+    system = []
+    summary, summary_tokens = conversations.summary(CHAT)
+    if summary:
+        system = [{"role": "system", "content": f"Summary of the earlier conversation:\n{summary}"}]
+        fixed += summary_tokens
+    history, _ = conversations.window(CHAT, max(0, BUDGET - fixed))
+    return system + history + [{"role": "user", "content": message}]
+
+
+async def measure(summarize: bool):
+    client = AsyncServingClient(FakeWorkspace())
+    client.client = httpx.AsyncClient(transport=httpx.MockTransport(endpoint))
+    conversations = ConversationStore(max_turns=MAX_TURNS)
+    summarizer = (
+        HistorySummarizer(client, "llm", conversations, trigger_tokens=TRIGGER)
+        if summarize else None
+    )
+    prompt_tokens, latencies = [], []
+
+    for turn in range(TURNS):
+        message = f"Question {turn}: ".ljust(200, "?")
+        messages = build_prompt(conversations, message)
+        prompt_tokens.append(sum(approximate_tokens(m["content"]) for m in messages))
+        started = time.perf_counter()
+        reply = await client.chat("llm", messages)
+        latencies.append(time.perf_counter() - started)
+        conversations.append_turn(CHAT, message, reply)
+        if summarizer is not None:
+            summarizer.maybe_schedule(CHAT)
+        await asyncio.sleep(THINK_TIME)
+
+    label = "with   " if summarize else "without"
+    calls = f", {summarizer.stats()['runs']} summary calls" if summarizer else ""
+    print(
+        f"{label}: prompt p50 {percentile(prompt_tokens, 50):5.0f} "
+        f"p99 {percentile(prompt_tokens, 99):5.0f} tokens, "
+        f"latency mean {sum(latencies) / len(latencies) * 1000:4.0f}ms "
+        f"(last 50: {sum(latencies[-50:]) / 50 * 1000:4.0f}ms){calls}"
+    )
+    if summarizer is not None:
+        await summarizer.close()
+    await client.aclose()
+
+
+async def run():
+    for summarize in (False, True):
+        await measure(summarize)
+
+
+if __name__ == "__main__":
+    asyncio.run(run())
@@ -0,0 +1,46 @@
+"""
+Shared setup for the benchmarks.
+
+Every benchmark runs against local fakes (httpx.MockTransport) of the
+Bot API and serving endpoints, so no credentials or network are needed.
+Importing this module puts TelegramBot/ on the import path and sets the
+configuration main.py reads at import time.
+"""
+import logging
+import os
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "TelegramBot"))
+
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123:bench")
+os.environ.setdefault("DATABRICKS_HOST", "https://workspace.example")
+os.environ.setdefault("DATABRICKS_TOKEN", "bench")
+os.environ.setdefault("DATABRICKS_SERVING_ENDPOINT", "bench-endpoint")
+os.environ.setdefault("UPDATE_STATE_PATH", "")
+os.environ.setdefault("CONVERSATION_DB_PATH", "")
+
+# Warnings from deliberately injected faults would drown the results
+logging.disable(logging.CRITICAL)
+
+
+class FakeConfig:
+    host = "https://workspace.example"
+
+    def authenticate(self) -> dict:
+        return {"Authorization": "Bearer bench"}
+
+
+class FakeWorkspace:
+    """Stands in for databricks.sdk.WorkspaceClient"""
+
+    config = FakeConfig()
+
+
+def percentile(values, q: float) -> float:
+    """The q-th percentile (0-100) of `values`, nearest rank"""
+    ordered = sorted(values)
+    if not ordered:
+        return float("nan")
+    index = min(len(ordered) - 1, max(0, round(q / 100.0 * len(ordered)) - 1))
+    return ordered[index]
@@ -0,0 +1,13 @@
+import os
+import sys
+
+# The bot's modules import each other by name from TelegramBot/
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "TelegramBot"))
+
+# main.py reads its configuration at import time
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123:test")
+os.environ.setdefault("DATABRICKS_HOST", "https://workspace.example")
+os.environ.setdefault("DATABRICKS_TOKEN", "test")
+os.environ.setdefault("DATABRICKS_SERVING_ENDPOINT", "test-endpoint")
+os.environ.setdefault("UPDATE_STATE_PATH", "")
+os.environ.setdefault("CONVERSATION_DB_PATH", "")
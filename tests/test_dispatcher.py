@@ -0,0 +1,134 @@
+"""
+Per-chat ordering, concurrency and backpressure of the update dispatcher.
+"""
+import asyncio
+import random
+import time
+
+from dispatcher import ChatDispatcher, DispatcherView, chat_key, queued_at
+
+
+def update(update_id: int, chat_id: int) -> dict:
+    return {"update_id": update_id, "message": {"chat": {"id": chat_id}, "text": str(update_id)}}
+
+
+def test_updates_of_a_chat_run_in_order_while_chats_run_concurrently():
+    rng = random.Random(5)
+    processed = {}
+    running = 0
+    most_running = 0
+
+    async def handler(u: dict):
+        nonlocal running, most_running
+        running += 1
+        most_running = max(most_running, running)
+        # Random latencies would reorder a chat's updates if they overlapped
+        await asyncio.sleep(rng.uniform(0, 0.005))
+        processed.setdefault(chat_key(u), []).append(u["update_id"])
+        running -= 1
+
+    async def run():
+        dispatcher = ChatDispatcher(handler, workers=8)
+        dispatcher.start()
+        for update_id in range(200):
+            dispatcher.submit(update(update_id, update_id % 10))
+        await dispatcher.join()
+        await dispatcher.stop()
+
+    asyncio.run(run())
+    assert sorted(processed) == list(range(10))
+    for chat_id, update_ids in processed.items():
+        assert update_ids == list(range(chat_id, 200, 10))
+    assert 1 < most_running <= 8
+
+
+def test_a_failing_update_does_not_block_its_chat():
+    processed = []
+
+    async def handler(u: dict):
+        if u["update_id"] == 1:
+            raise RuntimeError("boom")
+        processed.append(u["update_id"])
+
+    async def run():
+        dispatcher = ChatDispatcher(handler, workers=2)
+        dispatcher.start()
+        for update_id in range(1, 4):
+            dispatcher.submit(update(update_id, 7))
+        await dispatcher.join()
+        await dispatcher.stop()
+
+    asyncio.run(run())
+    assert processed == [2, 3]
+
+
+def test_offer_refuses_updates_once_the_queue_is_full():
+    async def run():
+        gate = asyncio.Event()
+
+        async def handler(u: dict):
+            await gate.wait()
+
+        dispatcher = ChatDispatcher(handler, workers=1, max_pending=2)
+        dispatcher.start()
+        accepted = [dispatcher.offer(update(i, i)) for i in range(3)]
+        full = dispatcher.full
+        gate.set()
+        await dispatcher.join()
+        after = dispatcher.offer(update(3, 3))
+        await dispatcher.join()
+        await dispatcher.stop()
+        return accepted, full, after
+
+    accepted, full, after = asyncio.run(run())
+    assert accepted == [True, True, False]
+    assert full
+    assert after
+
+
+def test_handler_sees_when_its_update_was_queued():
+    waits = []
+
+    async def handler(u: dict):
+        waits.append(time.monotonic() - queued_at.get())
+
+    async def run():
+        dispatcher = ChatDispatcher(handler, workers=1)
+        dispatcher.submit(update(1, 1))
+        await asyncio.sleep(0.05)
+        dispatcher.start()
+        await dispatcher.join()
+        await dispatcher.stop()
+
+    asyncio.run(run())
+    assert waits[0] >= 0.05
+
+
+def test_views_keep_tenants_chats_apart_on_a_shared_pool():
+    processed = []
+
+    async def run():
+        shared = ChatDispatcher(None, workers=4)
+        shared.start()
+        views = [
+            DispatcherView(
+                shared, name, lambda u, name=name: record(name, u), max_pending=5
+            )
+            for name in ("a", "b")
+        ]
+
+        async def record(name: str, u: dict):
+            await asyncio.sleep(0)
+            processed.append((name, u["update_id"]))
+
+        for update_id in range(5):
+            # Same chat id in both bots: separate chats, each in order
+            views[0].submit(update(update_id, 1))
+            views[1].submit(update(update_id, 1))
+        assert views[0].full and not views[0].offer(update(5, 1))
+        await asyncio.gather(*(view.join() for view in views))
+        await shared.stop()
+
+    asyncio.run(run())
+    for name in ("a", "b"):
+        assert [i for n, i in processed if n == name] == list(range(5))
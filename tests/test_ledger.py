@@ -0,0 +1,86 @@
+"""
+Crash recovery of the update ledger and replay of unfinished updates.
+"""
+import asyncio
+
+import main
+from ledger import UpdateLedger
+
+
+def update(update_id: int, chat_id: int = 1) -> dict:
+    return {"update_id": update_id, "message": {"chat": {"id": chat_id}, "text": str(update_id)}}
+
+
+def crash_with(path: str, accepted: range, processed: list, offset: int):
+    """Record updates in a ledger and stop without closing it, as a crash would"""
+
+    async def run():
+        ledger = UpdateLedger(path)
+        ledger.start()
+        for update_id in accepted:
+            ledger.accept(update(update_id))
+        for update_id in processed:
+            ledger.done(update_id)
+        ledger.acknowledge(offset)
+        await ledger.sync()
+        ledger._task.cancel()
+
+    asyncio.run(run())
+
+
+def test_a_restarted_ledger_returns_unfinished_updates_in_order(tmp_path):
+    path = str(tmp_path / "ledger.json")
+    crash_with(path, range(100, 110), [100, 101, 103, 105], offset=109)
+
+    ledger = UpdateLedger(path)
+    unfinished = ledger.load()
+    assert [u["update_id"] for u in unfinished] == [102, 104, 106, 107, 108, 109]
+    assert ledger.offset == 109
+    # Redelivered updates are recognized whether they finished or not
+    assert ledger.is_duplicate(101)
+    assert ledger.is_duplicate(104)
+    assert not ledger.is_duplicate(110)
+
+
+def test_the_processed_window_slides(tmp_path):
+    ledger = UpdateLedger(str(tmp_path / "ledger.json"), window=64)
+    for update_id in range(1000, 1200):
+        ledger.done(update_id)
+    assert all(ledger.is_duplicate(update_id) for update_id in range(1000, 1200))
+    assert not ledger.is_duplicate(1200)
+    # Older than the window counts as processed
+    assert ledger.is_duplicate(5)
+
+
+def test_a_corrupt_checkpoint_is_ignored(tmp_path):
+    path = tmp_path / "ledger.json"
+    path.write_text('{"offset": 12, "pend')
+    ledger = UpdateLedger(str(path))
+    assert ledger.load() == []
+    assert ledger.offset == 0
+
+
+def test_start_replays_unfinished_updates_before_polling(tmp_path):
+    path = str(tmp_path / "ledger.json")
+    crash_with(path, range(1, 5), [1, 3], offset=4)
+    processed = []
+
+    async def process_update(u: dict):
+        processed.append(u["update_id"])
+
+    async def run():
+        bot = main.TelegramPoller()
+        bot.ledger = UpdateLedger(path)
+        bot.process_update = process_update
+        await bot.start()
+        await bot.dispatcher.join()
+        offset = bot.last_update_id
+        await bot.close()
+        return offset
+
+    assert asyncio.run(run()) == 4
+    assert processed == [2, 4]
+
+    ledger = UpdateLedger(path)
+    assert ledger.load() == []
+    assert ledger.is_duplicate(2) and ledger.is_duplicate(4)
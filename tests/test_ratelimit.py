@@ -0,0 +1,89 @@
+"""
+Token bucket arithmetic and the layered buckets of the outbound rate limiter.
+"""
+import asyncio
+import time
+
+from ratelimit import TelegramRateLimiter, TokenBucket
+
+
+def test_reservations_wait_in_arrival_order():
+    bucket = TokenBucket(rate=2.0, capacity=2.0, now=0.0)
+    delays = [bucket.reserve(now=0.0) for _ in range(5)]
+    # Two tokens of burst, then one every half second
+    assert delays == [0.0, 0.0, 0.5, 1.0, 1.5]
+
+
+def test_refill_is_capped_at_capacity():
+    bucket = TokenBucket(rate=1.0, capacity=3.0, now=0.0)
+    for _ in range(3):
+        bucket.reserve(now=0.0)
+    assert bucket.level(now=1.5) == 1.5
+    assert bucket.level(now=100.0) == 3.0
+    assert bucket.idle(now=100.0)
+
+
+def test_a_blocked_bucket_delays_even_with_tokens_left():
+    bucket = TokenBucket(rate=1.0, capacity=5.0, now=0.0)
+    bucket.blocked_until = 4.0
+    assert bucket.reserve(now=1.0) == 3.0
+    assert not bucket.idle(now=3.0)
+    assert bucket.reserve(now=4.0) == 0.0
+
+
+def test_groups_get_a_per_minute_bucket_with_a_burst():
+    limiter = TelegramRateLimiter(group_burst=20.0)
+    group = limiter._chat_buckets(-100, now=0.0)
+    private = limiter._chat_buckets(100, now=0.0)
+    assert private.group is None
+    delays = [group.group.reserve(now=0.0) for _ in range(21)]
+    assert delays[:20] == [0.0] * 20
+    assert delays[20] == 3.0
+
+
+def test_sends_to_one_chat_are_paced_but_other_chats_are_not():
+    limiter = TelegramRateLimiter(global_rate=1000.0, chat_rate=10.0)
+
+    async def timed(chat_id: int) -> float:
+        started = time.monotonic()
+        await limiter.acquire(chat_id)
+        return time.monotonic() - started
+
+    async def run():
+        same = await asyncio.gather(*(timed(1) for _ in range(3)))
+        other = await asyncio.gather(*(timed(chat_id) for chat_id in range(2, 5)))
+        return same, other
+
+    same, other = asyncio.run(run())
+    assert sorted(same)[-1] >= 0.19
+    assert max(other) < 0.05
+    assert limiter.stats()["throttled"] == 2
+
+
+def test_flood_wait_blocks_only_the_affected_chat():
+    limiter = TelegramRateLimiter()
+    limiter.flood_wait(30.0, chat_id=1)
+    now = time.monotonic()
+    assert limiter._chat_buckets(1, now).chat.reserve(now) > 29.0
+    assert limiter._chat_buckets(2, now).chat.reserve(now) == 0.0
+    assert limiter.available()
+    limiter.flood_wait(30.0)
+    assert not limiter.available()
+    assert limiter.stats()["flood_waits"] == 2
+
+
+def test_idle_chat_buckets_are_evicted():
+    limiter = TelegramRateLimiter(idle_ttl=0.0)
+
+    async def run():
+        for chat_id in range(5):
+            await limiter.acquire(chat_id)
+        busy = limiter.stats()["chat_buckets"]
+        # Refilled and past the TTL: the next acquire drops them
+        for buckets in limiter._chats.values():
+            buckets.chat.updated -= 10.0
+        await limiter.acquire()
+        return busy
+
+    assert asyncio.run(run()) == 5
+    assert limiter.stats()["chat_buckets"] == 0
@@ -0,0 +1,226 @@
+"""
+Fault injection tests for retries against local fakes of the Bot API and
+a serving endpoint.
+"""
+import asyncio
+
+import httpx
+import pytest
+
+from overload import CircuitOpenError
+from retry import RetryBudget, RetryPolicy, TransientError, is_retryable
+from serving import AsyncServingClient, ServingError
+
+
+class FakeConfig:
+    host = "https://workspace.example"
+
+    def authenticate(self):
+        return {"Authorization": "Bearer test"}
+
+
+class FakeWorkspace:
+    config = FakeConfig()
+
+
+class Script:
+    """Transport handler answering with a list of responses, then the last one"""
+
+    def __init__(self, *responses):
+        self.responses = list(responses)
+        self.calls = 0
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        self.calls += 1
+        response = self.responses[min(self.calls, len(self.responses)) - 1]
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+
+class Sleeps(list):
+    """A RetryPolicy sleep that records delays instead of waiting them out"""
+
+    async def __call__(self, delay: float):
+        self.append(delay)
+
+
+@pytest.fixture
+def sleeps():
+    return Sleeps()
+
+
+def answer(text="hi"):
+    return httpx.Response(200, json={"choices": [{"message": {"content": text}}]})
+
+
+def serving_client(handler, **options) -> AsyncServingClient:
+    client = AsyncServingClient(FakeWorkspace(), breaker_failures=0, **options)
+    client.client = httpx.AsyncClient(transport=httpx.MockTransport(handler))
+    return client
+
+
+def chat(client: AsyncServingClient) -> str:
+    return asyncio.run(client.chat("llm", [{"role": "user", "content": "q"}]))
+
+
+@pytest.mark.parametrize(
+    "error, expected",
+    [
+        (httpx.ConnectError("refused"), True),
+        (httpx.ReadTimeout("slow"), True),
+        (TransientError("flood", status_code=429), True),
+        (ServingError("unavailable", status_code=503), True),
+        (ServingError("gateway", status_code=504), True),
+        (ServingError("no response"), True),
+        (ServingError("bad request", status_code=400), False),
+        (ServingError("forbidden", status_code=403), False),
+        (CircuitOpenError("llm", 30.0), False),
+        (ValueError("bad JSON"), False),
+    ],
+)
+def test_is_retryable(error, expected):
+    assert is_retryable(error) is expected
+
+
+def test_retries_transient_failures_until_success(sleeps):
+    script = Script(
+        httpx.ConnectError("refused"),
+        httpx.Response(503, json={}),
+        answer("recovered"),
+    )
+    client = serving_client(script, retry=RetryPolicy(attempts=3, sleep=sleeps))
+
+    assert chat(client) == "recovered"
+    assert script.calls == 3
+    assert len(sleeps) == 2
+
+
+def test_does_not_retry_client_errors(sleeps):
+    script = Script(httpx.Response(400, json={"error": "bad request"}))
+    client = serving_client(script, retry=RetryPolicy(attempts=3, sleep=sleeps))
+
+    with pytest.raises(ServingError) as raised:
+        chat(client)
+    assert raised.value.status_code == 400
+    assert script.calls == 1
+    assert sleeps == []
+
+
+def test_gives_up_after_max_attempts(sleeps):
+    script = Script(httpx.Response(503, json={}))
+    client = serving_client(script, retry=RetryPolicy(attempts=3, sleep=sleeps))
+
+    with pytest.raises(ServingError):
+        chat(client)
+    assert script.calls == 3
+
+
+def test_budget_exhaustion_stops_retries(sleeps):
+    # One saved-up retry and no refill: only the first request may retry
+    budget = RetryBudget(ratio=0.0, min_per_second=0.0, burst=1.0)
+    script = Script(httpx.Response(503, json={}))
+    client = serving_client(script, retry=RetryPolicy(attempts=3, budget=budget, sleep=sleeps))
+
+    for _ in range(3):
+        with pytest.raises(ServingError):
+            chat(client)
+    # 2 attempts for the first request, 1 for each of the others
+    assert script.calls == 4
+    assert budget.stats()["retries"] == 1
+    assert budget.stats()["exhausted"] == 3
+
+
+def test_honours_retry_after_header(sleeps):
+    script = Script(
+        httpx.Response(503, headers={"Retry-After": "7"}, json={}),
+        answer(),
+    )
+    client = serving_client(script, retry=RetryPolicy(attempts=2, base=0.01, sleep=sleeps))
+
+    assert chat(client) == "hi"
+    assert sleeps and sleeps[0] >= 7
+
+
+def test_gives_up_when_retry_after_exceeds_max_delay(sleeps):
+    script = Script(httpx.Response(429, headers={"Retry-After": "120"}, json={}))
+    client = serving_client(script, retry=RetryPolicy(attempts=3, max_delay=10.0, sleep=sleeps))
+
+    with pytest.raises(ServingError):
+        chat(client)
+    assert script.calls == 1
+    assert sleeps == []
+
+
+def test_telegram_flood_wait_delays_retry(sleeps):
+    import main
+
+    flood = httpx.Response(
+        429,
+        json={"ok": False, "error_code": 429, "parameters": {"retry_after": 5}},
+    )
+    script = Script(flood, httpx.Response(200, json={"ok": True, "result": True}))
+
+    async def send():
+        bot = main.TelegramPoller()
+        bot.client = httpx.AsyncClient(transport=httpx.MockTransport(script))
+        bot.telegram_retry.sleep = sleeps
+        try:
+            # Chat actions skip the per-chat bucket the flood wait blocks
+            return await bot.telegram_send(
+                "sendChatAction", {"chat_id": 1, "action": "typing"}, per_chat=False
+            )
+        finally:
+            await bot.close()
+
+    response = asyncio.run(send())
+    assert response.status_code == 200
+    assert script.calls == 2
+    assert sleeps and sleeps[0] >= 5
+
+
+def test_telegram_429_without_json_body_falls_back_to_retry_after_header(sleeps):
+    import main
+
+    # A proxy in front of the Bot API answering with its own error page
+    script = Script(
+        httpx.Response(429, headers={"Retry-After": "3"}, text="<html>Too Many Requests</html>"),
+        httpx.Response(429, content=b""),
+        httpx.Response(200, json={"ok": True, "result": True}),
+    )
+
+    async def send():
+        bot = main.TelegramPoller()
+        bot.client = httpx.AsyncClient(transport=httpx.MockTransport(script))
+        bot.telegram_retry.sleep = sleeps
+        try:
+            return await bot.telegram_send(
+                "sendChatAction", {"chat_id": 1, "action": "typing"}, per_chat=False
+            )
+        finally:
+            await bot.close()
+
+    response = asyncio.run(send())
+    assert response.status_code == 200
+    assert script.calls == 3
+    assert sleeps[0] >= 3
+    assert sleeps[1] >= 1
+
+
+def test_telegram_client_errors_are_returned_without_retry(sleeps):
+    import main
+
+    script = Script(httpx.Response(400, json={"ok": False, "description": "chat not found"}))
+
+    async def send():
+        bot = main.TelegramPoller()
+        bot.client = httpx.AsyncClient(transport=httpx.MockTransport(script))
+        bot.telegram_retry.sleep = sleeps
+        try:
+            return await bot.telegram_send("sendMessage", {"chat_id": 1, "text": "hi"})
+        finally:
+            await bot.close()
+
+    response = asyncio.run(send())
+    assert response.status_code == 400
+    assert script.calls == 1
@@ -0,0 +1,149 @@
+"""
+Coalescing and cancellation of shared calls in SingleFlight.
+"""
+import asyncio
+
+import pytest
+
+import deadline
+from cache import SingleFlight, _Flight
+from dispatcher import ChatDispatcher
+
+
+def test_concurrent_calls_share_one_execution():
+    flights = SingleFlight()
+    started = []
+
+    async def call():
+        started.append(1)
+        await asyncio.sleep(0.01)
+        return "answer"
+
+    async def run():
+        return await asyncio.gather(*(flights.do("key", call) for _ in range(5)))
+
+    assert asyncio.run(run()) == ["answer"] * 5
+    assert len(started) == 1
+    assert flights.stats()["coalesced"] == 4
+    assert not flights.in_flight("key")
+
+
+def test_an_exception_reaches_every_waiter():
+    flights = SingleFlight()
+
+    async def call():
+        await asyncio.sleep(0.01)
+        raise ValueError("boom")
+
+    async def run():
+        return await asyncio.gather(
+            *(flights.do("key", call) for _ in range(3)), return_exceptions=True
+        )
+
+    results = asyncio.run(run())
+    assert [type(result) for result in results] == [ValueError] * 3
+
+
+def test_cancelling_one_waiter_keeps_the_shared_call_running():
+    flights = SingleFlight()
+
+    async def call():
+        await asyncio.sleep(0.02)
+        return "answer"
+
+    async def run():
+        first = asyncio.create_task(flights.do("key", call))
+        second = asyncio.create_task(flights.do("key", call))
+        await asyncio.sleep(0)
+        first.cancel()
+        return await second, first.cancelled()
+
+    assert asyncio.run(run()) == ("answer", True)
+    assert flights.stats()["calls"] == 1
+
+
+def test_cancelling_the_last_waiter_cancels_and_forgets_the_call():
+    flights = SingleFlight()
+    cancelled = []
+
+    async def call():
+        try:
+            await asyncio.sleep(1)
+        except asyncio.CancelledError:
+            cancelled.append(1)
+            raise
+        return "stale"
+
+    async def fresh():
+        return "fresh"
+
+    async def run():
+        waiter = asyncio.create_task(flights.do("key", call))
+        await asyncio.sleep(0)
+        waiter.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiter
+        forgotten = not flights.in_flight("key")
+        # Same key straight away: a new call, not the cancelled one
+        return forgotten, await flights.do("key", fresh)
+
+    assert asyncio.run(run()) == (True, "fresh")
+    assert cancelled == [1]
+    assert flights.stats()["calls"] == 2
+
+
+def test_a_cancelled_call_is_not_handed_to_a_new_caller():
+    flights = SingleFlight()
+
+    async def fresh():
+        return "fresh"
+
+    async def run():
+        # A call that was cancelled but whose done callback hasn't run yet
+        abandoned = asyncio.create_task(asyncio.sleep(1))
+        await asyncio.sleep(0)
+        abandoned.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await abandoned
+        flights._flights["key"] = _Flight(abandoned)
+        return await flights.do("key", fresh)
+
+    assert asyncio.run(run()) == "fresh"
+
+
+def test_a_detached_call_outlives_the_deadline_of_the_caller():
+    flights = SingleFlight()
+
+    async def call():
+        return deadline.remaining()
+
+    async def run():
+        token = deadline.activate(deadline.Deadline(0.0))
+        try:
+            return await flights.do("key", call, context=deadline.detached()), deadline.remaining()
+        finally:
+            deadline.reset(token)
+
+    inside, outside = asyncio.run(run())
+    assert inside is None
+    assert outside < 0
+
+
+def test_a_dispatcher_worker_survives_a_stray_cancellation():
+    processed = []
+
+    async def handler(u: dict):
+        if u["update_id"] == 1:
+            raise asyncio.CancelledError()
+        processed.append(u["update_id"])
+
+    async def run():
+        dispatcher = ChatDispatcher(handler, workers=1)
+        dispatcher.start()
+        for update_id in range(1, 4):
+            dispatcher.submit({"update_id": update_id}, key="chat")
+        await dispatcher.join()
+        await dispatcher.stop()
+
+    asyncio.run(run())
+    assert processed == [2, 3]
@@ -0,0 +1,62 @@
+"""
+Splitting of long Markdown replies at small limits, where breaks land
+close together and next to blank lines and entities.
+"""
+import pytest
+
+from splitting import split_message
+
+REPLY = (
+    "Here is a *summary* of the options.\n"
+    "\n"
+    " \n"
+    "\n"
+    "1. Use _pandas_ for small data; call `df.groupby` and then `agg`.\n"
+    "2. Use *Spark* for anything larger!  See [the docs](https://spark.apache.org/docs).\n"
+    "\n"
+    "\n"
+    "```python\n"
+    "df = spark.read.table(\"events\")\n"
+    "df.groupBy(\"day\").count().show()\n"
+    "```\n"
+    "\n"
+    " \n"
+    "Is that enough?  Ask me about *partitioning*, _caching_ or `OPTIMIZE` next.\n"
+    "\n"
+    "\n"
+) * 3
+
+
+# Found by fuzzing: breaks land just before runs of blank lines that
+# hold spaces, which used to come out as parts of their own
+BLANK_LINES = (
+    "*bold words here* alpha [link](http://x.io/a)    \n \n zeta   _it_ delta!"
+    "       _it_ _it_    epsilon? gamma. delta! \n \n [link](http://x.io/a)"
+    " epsilon? \n \n"
+)
+
+
+@pytest.mark.parametrize("text", [REPLY, BLANK_LINES])
+@pytest.mark.parametrize("limit", [50, 100, 200])
+def test_small_limits_give_no_blank_or_oversized_parts(text, limit):
+    parts = split_message(text, limit)
+
+    assert len(parts) > 1 or len(text) <= limit
+    for part in parts:
+        assert part.strip()
+        assert len(part) <= limit
+
+
+@pytest.mark.parametrize("text", [REPLY, BLANK_LINES])
+@pytest.mark.parametrize("limit", [50, 100, 200])
+def test_small_limits_keep_entities_balanced(text, limit):
+    for part in split_message(text, limit):
+        assert part.count("```") % 2 == 0
+        # Outside code, bold and italic markers must pair up in each part
+        prose = "".join(part.split("```")[::2])
+        assert prose.count("*") % 2 == 0
+        assert prose.count("`") % 2 == 0
+
+
+def test_text_that_fits_is_returned_unchanged():
+    assert split_message("short *reply*", 50) == ["short *reply*"]